@@ -0,0 +1,169 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import uuid
+
+import cv2
+
+from constants.ultrasound import (
+    FRAME_DEFAULT_COL_CROP_FOR_SCAN_SELECTION,
+    FRAME_DEFAULT_ROW_CROP_FOR_SCAN_SELECTION,
+    HSV_COLOR_THRESHOLD,
+    HSV_GRAYSCALE_THRESHOLD
+)
+
+LOGGER = logging.getLogger('processing')
+
+# Bump when the frame pipeline changes in a way not captured by the pipeline parameters
+FRAME_CACHE_VERSION = 1
+
+# Records of the completed patients of a run, in the manifest output directory
+MANIFEST_CHECKPOINT_FILE = "manifest_{0}.checkpoint.jsonl"
+
+
+def default_pipeline_parameters():
+    """Parameters of the frame pipeline that change the cached OCR record or image focus"""
+    return {
+        "version": FRAME_CACHE_VERSION,
+        "hsv_color_threshold": [HSV_COLOR_THRESHOLD.LOWER.value, HSV_COLOR_THRESHOLD.UPPER.value],
+        "hsv_grayscale_threshold": [HSV_GRAYSCALE_THRESHOLD.LOWER.value, HSV_GRAYSCALE_THRESHOLD.UPPER.value],
+        "scan_selection_crop": [FRAME_DEFAULT_ROW_CROP_FOR_SCAN_SELECTION, FRAME_DEFAULT_COL_CROP_FOR_SCAN_SELECTION]
+    }
+
+
+def atomic_write(path, data):
+    """Write bytes to path such that readers never see a partially written file"""
+    temp_path = "{0}.{1}.tmp".format(path, uuid.uuid4())
+
+    with open(temp_path, "wb") as f:
+        f.write(data)
+
+    os.replace(temp_path, path)
+
+
+class FrameCache(object):
+    """On-disk cache of per-frame OCR records and image focuses
+
+    Entries are keyed by the content hash of the raw frame file and the hash of the pipeline
+    parameters, so renamed or re-copied frames still hit and any change to the thresholds or crop
+    constants invalidates every entry. The image focus is stored before interpolation since the
+    interpolation factor depends on corpus-wide statistics that change as patients are added.
+
+    Writes are atomic so that the cache can be shared by concurrent worker processes.
+
+    Arguments:
+        path_to_cache_dir                    directory holding the cache. Created if it does not exist
+
+    Optional:
+        pipeline_parameters                  JSON serializable parameters of the frame pipeline.
+                                                 Default default_pipeline_parameters()
+    """
+
+    def __init__(self, path_to_cache_dir, pipeline_parameters=None):
+        self.path_to_cache_dir = path_to_cache_dir.rstrip("/")
+
+        if pipeline_parameters is None:
+            pipeline_parameters = default_pipeline_parameters()
+
+        self.parameters_hash = hashlib.sha1(
+            json.dumps(pipeline_parameters, sort_keys=True).encode("utf-8")).hexdigest()
+
+        os.makedirs(self.path_to_cache_dir, exist_ok=True)
+
+    def key(self, frame_bytes):
+        """Cache key of the raw (encoded) frame file contents"""
+        frame_hash = hashlib.sha1(frame_bytes)
+        frame_hash.update(self.parameters_hash.encode("utf-8"))
+
+        return frame_hash.hexdigest()
+
+    def __entry_path(self, key, extension):
+        return "{0}/{1}/{2}.{3}".format(self.path_to_cache_dir, key[:2], key, extension)
+
+    def get(self, key):
+        """Look up a cache entry
+
+        Returns:
+            (frame_record, path_to_focus) if present, else None. path_to_focus is None if the
+            segmentation failed for the frame
+        """
+        record_path = self.__entry_path(key, "json")
+
+        if not os.path.isfile(record_path):
+            return None
+
+        with open(record_path, "r") as f:
+            frame_record = json.load(f)
+
+        focus_path = self.__entry_path(key, "png")
+
+        return frame_record, (focus_path if os.path.isfile(focus_path) else None)
+
+    def put(self, key, frame_record, image_focus=None):
+        """Store the frame record and optional image focus under key"""
+        os.makedirs("{0}/{1}".format(self.path_to_cache_dir, key[:2]), exist_ok=True)
+
+        # The focus is written first. The record marks the entry complete
+        if image_focus is not None:
+            encoded_focus = cv2.imencode(".png", image_focus)[1]
+            atomic_write(self.__entry_path(key, "png"), encoded_focus.tobytes())
+
+        atomic_write(self.__entry_path(key, "json"), json.dumps(frame_record).encode("utf-8"))
+
+
+def manifest_checkpoint_path(path_to_manifest_output_dir, timestamp):
+    return "{0}/{1}".format(path_to_manifest_output_dir.rstrip("/"), MANIFEST_CHECKPOINT_FILE.format(timestamp))
+
+
+def latest_checkpoint_timestamp(path_to_manifest_output_dir):
+    """Timestamp of the most recently modified manifest checkpoint (an interrupted run) in the manifest output
+    directory. None if there is no checkpoint"""
+    prefix, suffix = MANIFEST_CHECKPOINT_FILE.split("{0}")
+    checkpoint_paths = glob.glob(manifest_checkpoint_path(path_to_manifest_output_dir, "*"))
+
+    if not checkpoint_paths:
+        return None
+
+    latest_path = max(checkpoint_paths, key=os.path.getmtime)
+
+    return os.path.basename(latest_path)[len(prefix):-len(suffix)]
+
+
+def load_manifest_checkpoint(checkpoint_path):
+    """Load the patient records of an interrupted run. Returns {} if there is no checkpoint
+
+    A truncated final line (crash mid-write) is removed from the file, so that entries appended on resume start
+    on a line of their own. That patient is simply processed again.
+    """
+    patient_records = {}
+
+    if not os.path.isfile(checkpoint_path):
+        return patient_records
+
+    with open(checkpoint_path, "rb+") as checkpoint_file:
+        data = checkpoint_file.read()
+        complete_length = data.rfind(b"\n") + 1
+
+        if complete_length < len(data):
+            LOGGER.warning("Removing truncated checkpoint entry from: %s", checkpoint_path)
+            checkpoint_file.truncate(complete_length)
+
+    for line in data[:complete_length].decode("utf-8").splitlines():
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            LOGGER.warning("Ignoring corrupt checkpoint entry in: %s", checkpoint_path)
+            continue
+
+        patient_records[entry["patient"]] = entry["records"]
+
+    return patient_records
+
+
+def append_manifest_checkpoint(checkpoint_file, patient_label, records):
+    """Append the records of a completed patient to the checkpoint (JSON lines) and flush to disk"""
+    checkpoint_file.write(json.dumps({"patient": patient_label, "records": records}) + "\n")
+    checkpoint_file.flush()
+    os.fsync(checkpoint_file.fileno())
@@ -2,7 +2,7 @@ import argparse
 import cv2
 
 from constants.ultrasound import IMAGE_TYPE
-from utilities.ocr.ocr import isolate_text
+from dataset_preparation.ocr.ocr import isolate_text
 
 # construct the argument parse and parse the arguments
 parser = argparse.ArgumentParser()
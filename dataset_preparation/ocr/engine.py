@@ -0,0 +1,283 @@
+import hashlib
+
+import numpy as np
+
+from collections import OrderedDict
+
+from PIL import Image
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+# Tesseract segmentation mode 11 (sparse text) is critical for reading the ultrasound readouts
+TESSERACT_PAGE_SEGMENTATION_MODE = 11
+NUMERIC_WHITELIST = "0123456789."
+
+# Tiled pages are split so that a single page stays well within Tesseract's image size limits
+MAXIMUM_TILED_PAGE_HEIGHT = 16000
+TILE_GAP = 20
+
+# Distinct readout crops remembered per process. Crops are tiny so the recognized text is what is kept
+OCR_MEMO_MAXIMUM_SIZE = 4096
+
+
+def tile_crops(crops, gap=TILE_GAP):
+    """Stack crops vertically into a single page separated by background rows
+
+    Arguments:
+        crops                               list of binarized single channel crops (text 255, background 0)
+
+    Optional:
+        gap                                 number of background rows between consecutive crops
+
+    Returns:
+        page                                2D array containing all crops
+        row_offsets                         first row of each crop in the page
+    """
+    page_width = max(crop.shape[1] for crop in crops)
+    page_height = sum(crop.shape[0] for crop in crops) + gap * (len(crops) - 1)
+
+    page = np.zeros((page_height, page_width), dtype=np.uint8)
+    row_offsets = []
+
+    row = 0
+    for crop in crops:
+        page[row: row + crop.shape[0], :crop.shape[1]] = crop
+        row_offsets.append(row)
+        row += crop.shape[0] + gap
+
+    return page, row_offsets
+
+
+def words_to_text(words):
+    """Rebuild newline separated text from recognized words of a single crop
+
+    Words whose vertical extents overlap are joined left to right on the same line, matching the
+    line structure of image_to_string output.
+
+    Arguments:
+        words                               list of (left, top, height, text)
+    """
+    lines = []
+
+    for left, top, height, text in sorted(words, key=lambda word: (word[1], word[0])):
+        if lines and top < lines[-1]["bottom"]:
+            lines[-1]["words"].append((left, text))
+            lines[-1]["bottom"] = max(lines[-1]["bottom"], top + height)
+        else:
+            lines.append({"bottom": top + height, "words": [(left, text)]})
+
+    return "\n".join(" ".join(text for _, text in sorted(line["words"])) for line in lines)
+
+
+class TesseractAPIEngine(object):
+    """OCR backend holding persistent Tesseract API handles (tesserocr)
+
+    The Tesseract engine (and its language model) is initialized once per handle instead of once per
+    call. One handle is kept per character whitelist. Handles are created lazily so an engine
+    can be passed to worker processes before first use.
+    """
+
+    def __init__(self, lang="eng"):
+        self.lang = lang
+        self.__handles = {}
+
+    def __handle(self, whitelist):
+        if whitelist not in self.__handles:
+            handle = tesserocr.PyTessBaseAPI(
+                lang=self.lang,
+                psm=TESSERACT_PAGE_SEGMENTATION_MODE)
+
+            if whitelist is not None:
+                handle.SetVariable("tessedit_char_whitelist", whitelist)
+
+            self.__handles[whitelist] = handle
+
+        return self.__handles[whitelist]
+
+    def image_to_string(self, crop, whitelist=None):
+        handle = self.__handle(whitelist)
+        handle.SetImage(Image.fromarray(crop))
+
+        return handle.GetUTF8Text()
+
+    def image_to_string_batch(self, crops, whitelist=None):
+        return [self.image_to_string(crop, whitelist) for crop in crops]
+
+    def close(self):
+        for handle in self.__handles.values():
+            handle.End()
+
+        self.__handles = {}
+
+    def __getstate__(self):
+        # Handles are process local. Workers recreate them on first use
+        return {"lang": self.lang}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+class PytesseractEngine(object):
+    """OCR backend spawning the tesseract executable (pytesseract)
+
+    Every call pays the process startup and model load. Batches amortize this by tiling the
+    crops of many frames into a single page, running Tesseract once and mapping recognized words
+    back to their crop by position.
+    """
+
+    def __init__(self, lang="eng", maximum_page_height=MAXIMUM_TILED_PAGE_HEIGHT):
+        self.lang = lang
+        self.maximum_page_height = maximum_page_height
+
+    def __config(self, whitelist):
+        config = r"--psm {0}".format(TESSERACT_PAGE_SEGMENTATION_MODE)
+
+        if whitelist is not None:
+            config += r" -c tessedit_char_whitelist={0}".format(whitelist)
+
+        return config
+
+    def image_to_string(self, crop, whitelist=None):
+        return pytesseract.image_to_string(
+            crop,
+            lang=self.lang,
+            config=self.__config(whitelist))
+
+    def __image_to_string_page(self, crops, whitelist):
+        if len(crops) == 1:
+            return [self.image_to_string(crops[0], whitelist)]
+
+        page, row_offsets = tile_crops(crops)
+
+        data = pytesseract.image_to_data(
+            page,
+            lang=self.lang,
+            config=self.__config(whitelist),
+            output_type=pytesseract.Output.DICT)
+
+        row_limits = [offset + crop.shape[0] for offset, crop in zip(row_offsets, crops)]
+        crop_words = [[] for _ in crops]
+
+        for left, top, height, text in zip(data["left"], data["top"], data["height"], data["text"]):
+            if not text.strip():
+                continue
+
+            # Assign the word to the crop containing its vertical center
+            center = top + height / 2
+            index = int(np.searchsorted(row_limits, center))
+
+            if index < len(crops) and center >= row_offsets[index]:
+                crop_words[index].append((left, top, height, text.strip()))
+
+        return [words_to_text(words) for words in crop_words]
+
+    def image_to_string_batch(self, crops, whitelist=None):
+        texts = []
+        page_crops = []
+        page_height = 0
+
+        for crop in crops:
+            if page_crops and page_height + TILE_GAP + crop.shape[0] > self.maximum_page_height:
+                texts += self.__image_to_string_page(page_crops, whitelist)
+                page_crops = []
+                page_height = 0
+
+            page_height += crop.shape[0] + (TILE_GAP if page_crops else 0)
+            page_crops.append(crop)
+
+        if page_crops:
+            texts += self.__image_to_string_page(page_crops, whitelist)
+
+        return texts
+
+    def close(self):
+        pass
+
+
+class MemoizedEngine(object):
+    """LRU memoization of OCR results in front of another engine
+
+    The scanner readout rarely changes within a patient clip, so the binarized readout crops of most
+    frames are pixel-identical. Crops are keyed by a fast hash of their pixels (plus shape and
+    whitelist). Identical crops skip Tesseract entirely, including duplicates within one batch.
+
+    Arguments:
+        engine                              engine used on a memo miss
+
+    Optional:
+        maximum_size                        number of distinct crops remembered. Default OCR_MEMO_MAXIMUM_SIZE
+    """
+
+    def __init__(self, engine, maximum_size=OCR_MEMO_MAXIMUM_SIZE):
+        self.engine = engine
+        self.maximum_size = maximum_size
+        self.hits = 0
+        self.misses = 0
+        self.__memo = OrderedDict()
+
+    def __key(self, crop, whitelist):
+        crop = np.ascontiguousarray(crop)
+        digest = hashlib.blake2b(crop.data, digest_size=16).digest()
+
+        return (whitelist, crop.shape, digest)
+
+    def __remember(self, key, text):
+        self.__memo[key] = text
+
+        if len(self.__memo) > self.maximum_size:
+            self.__memo.popitem(last=False)
+
+    def image_to_string(self, crop, whitelist=None):
+        return self.image_to_string_batch([crop], whitelist)[0]
+
+    def image_to_string_batch(self, crops, whitelist=None):
+        keys = [self.__key(crop, whitelist) for crop in crops]
+
+        texts = {}
+
+        # Distinct crops not in the memo. Recognized once even if repeated within the batch
+        missing = OrderedDict()
+        for key, crop in zip(keys, crops):
+            if key in self.__memo:
+                self.__memo.move_to_end(key)
+                texts[key] = self.__memo[key]
+            elif key not in missing:
+                missing[key] = crop
+
+        self.misses += len(missing)
+        self.hits += len(crops) - len(missing)
+
+        if missing:
+            for key, text in zip(missing.keys(), self.engine.image_to_string_batch(list(missing.values()), whitelist)):
+                texts[key] = text
+                self.__remember(key, text)
+
+        return [texts[key] for key in keys]
+
+    def close(self):
+        self.engine.close()
+
+
+__DEFAULT_ENGINE = None
+
+
+def get_ocr_engine():
+    """Process-wide default OCR engine
+
+    Memoized persistent API handles when tesserocr is installed, memoized pytesseract otherwise
+    """
+    global __DEFAULT_ENGINE
+
+    if __DEFAULT_ENGINE is None:
+        __DEFAULT_ENGINE = MemoizedEngine(
+            TesseractAPIEngine() if tesserocr is not None else PytesseractEngine())
+
+    return __DEFAULT_ENGINE
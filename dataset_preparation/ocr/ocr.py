@@ -2,7 +2,6 @@ import os
 import re 
 import cv2 
 import argparse 
-import pytesseract 
 import uuid
 
 import numpy as np
@@ -15,12 +14,15 @@ from constants.ultrasound import (
 	READOUT_ABBREVS as RA,
 	WALL_FILTER_MODES
 )
+from dataset_preparation.ocr.engine import NUMERIC_WHITELIST, get_ocr_engine
 
 
-def isolate_text(grayscale_image, image_type):
-	
-	FOUND_TEXT = {}
+def crop_readout_regions(grayscale_image):
+	"""Crop the on-screen readout regions of a binarized frame
 
+	Returns:
+		(left_bar_crop, bottom_left_crop, scale_crop)
+	"""
 	# Hardcoded cropping bounds based on the specific ultrasound dataset
 	# TODO: move to constants file
 
@@ -28,28 +30,106 @@ def isolate_text(grayscale_image, image_type):
 	bottom_left_crop = grayscale_image[365:, 30:140].copy()
 	scale_crop = grayscale_image[15:40, 585:].copy()
 
-	# load the image as a PIL/Pillow image, apply OCR, and then delete
-	# the temporary file. Tesseract segmentation mode 11 is critical for this to work
+	return left_bar_crop, bottom_left_crop, scale_crop
+
+
+def isolate_text(grayscale_image, image_type, engine=None):
+	"""Read the on-screen readout of a single binarized frame. See isolate_text_batch"""
+
+	if engine is None:
+		engine = get_ocr_engine()
+
+	left_bar_crop, bottom_left_crop, scale_crop = crop_readout_regions(grayscale_image)
+
+	# Tesseract segmentation mode 11 is critical for this to work
 	# None of the other automatic segmentation modes correctly read the text
 
-	raw_text = pytesseract.image_to_string(left_bar_crop,
-		lang="eng",
-		boxes=False,  
-		config=r"--psm 11") 
+	raw_text = engine.image_to_string(left_bar_crop)
 
 	# Specifically whitelist numerical characters and "." to aid the OCR engine
 
-	raw_text_size = pytesseract.image_to_string(bottom_left_crop,
-		lang="eng",
-		boxes=False,  
-		config=r"--psm 11 -c tessedit_char_whitelist=0123456789.") 
+	raw_text_size = engine.image_to_string(bottom_left_crop, whitelist=NUMERIC_WHITELIST)
+	raw_text_scale = engine.image_to_string(scale_crop, whitelist=NUMERIC_WHITELIST)
+
+	return parse_readout_text(raw_text, raw_text_size, raw_text_scale, image_type)
+
+
+def isolate_text_batch(readout_regions, image_types, engine=None):
+	"""Read the on-screen readouts of many frames with one OCR batch per readout region
+
+	Arguments:
+		readout_regions                      list of (left_bar_crop, bottom_left_crop, scale_crop). One per frame
+		image_types                          list of IMAGE_TYPE. One per frame
+
+	Optional:
+		engine                               OCR engine. Default is the process-wide engine (get_ocr_engine)
+
+	Returns:
+		List with one entry per frame. Either the found text dictionary or the exception raised
+		while recognizing or parsing the text of that frame
+	"""
+	found_texts = []
+
+	for raw_texts, image_type in zip(recognize_readout_regions(readout_regions, engine), image_types):
+		errors = [raw_text for raw_text in raw_texts if isinstance(raw_text, Exception)]
+		if errors:
+			found_texts.append(errors[0])
+			continue
+
+		try:
+			found_texts.append(parse_readout_text(*raw_texts, image_type=image_type))
+		except Exception as e:
+			found_texts.append(e)
+
+	return found_texts
 
-	# Specifically whitelist numerical characters and "." to aid the OCR engine
 
-	raw_text_scale = pytesseract.image_to_string(scale_crop,
-		lang="eng",
-		boxes=False,  
-		config=r"--psm 11 -c tessedit_char_whitelist=0123456789.") 
+def recognize_readout_regions(readout_regions, engine=None):
+	"""Run OCR over the readout regions of many frames
+
+	Returns:
+		List of (raw_text, raw_text_size, raw_text_scale). One per frame. A text is the exception raised by
+		the OCR engine if the crop could not be recognized
+	"""
+
+	if engine is None:
+		engine = get_ocr_engine()
+
+	left_bar_crops, bottom_left_crops, scale_crops = zip(*readout_regions)
+
+	raw_texts = recognize_crops(engine, list(left_bar_crops))
+	raw_texts_size = recognize_crops(engine, list(bottom_left_crops), whitelist=NUMERIC_WHITELIST)
+	raw_texts_scale = recognize_crops(engine, list(scale_crops), whitelist=NUMERIC_WHITELIST)
+
+	return list(zip(raw_texts, raw_texts_size, raw_texts_scale))
+
+
+def recognize_crops(engine, crops, whitelist=None):
+	"""Text of every crop, recognized in one engine batch
+
+	If the batch fails, every crop is recognized on its own so that a crop the engine cannot read only fails
+	its own frame. The entry of such a crop is the exception raised
+	"""
+	try:
+		return engine.image_to_string_batch(crops, whitelist=whitelist)
+	except Exception:
+		pass
+
+	texts = []
+
+	for crop in crops:
+		try:
+			texts.append(engine.image_to_string(crop, whitelist=whitelist))
+		except Exception as e:
+			texts.append(e)
+
+	return texts
+
+
+def parse_readout_text(raw_text, raw_text_size, raw_text_scale, image_type):
+	"""Parse the raw OCR text of the readout regions of a frame into the found text dictionary"""
+	
+	FOUND_TEXT = {}
 
 	text_segments = raw_text.splitlines()
 	text_segments = [segment.upper().strip() for segment in text_segments if segment is not ""]
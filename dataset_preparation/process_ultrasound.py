@@ -2,24 +2,33 @@ import argparse
 import json
 import logging
 import os
+import shutil
 import uuid
 
 from datetime import datetime
+from multiprocessing import Pool
 
 import cv2
 import numpy as np
 
-from src.utilities.image.image import determine_image_type
-from src.utilities.segmentation.brute.grayscale import load_select_save_scan_window
-from src.utilities.segmentation.brute.color import load_select_color_image_focus
-
-from src.utilities.ocr.ocr import isolate_text
+from utilities.image.image import determine_image_type
+from dataset_preparation.segmentation.brute.grayscale import select_scan_window, select_scan_window_batch
+from dataset_preparation.segmentation.brute.color import get_color_image_focus, get_color_image_focus_batch
+
+from dataset_preparation.ocr.ocr import crop_readout_regions, isolate_text_batch
+from dataset_preparation.ocr.engine import get_ocr_engine
+from dataset_preparation.cache.frame_cache import (
+    FrameCache,
+    append_manifest_checkpoint,
+    latest_checkpoint_timestamp,
+    load_manifest_checkpoint,
+    manifest_checkpoint_path
+)
 
-from src.constants.ultrasound import (
+from constants.ultrasound import (
     FOCUS_HASH_LABEL,
     FRAME_LABEL,
     HSV_COLOR_THRESHOLD,
-    HSV_GRAYSCALE_THRESHOLD,
     IMAGE_TYPE,
     IMAGE_TYPE_LABEL,
     INTERPOLATION_FACTOR_LABEL,
@@ -34,74 +43,142 @@ from tqdm import tqdm
 
 LOGGER = logging.getLogger('processing')
 
-def frame_segmentation(
-        path_to_frame,
-        abs_path_to_focus_output_dir,
-        image_type,
-        interpolation_factor=None):
-    """
-    upscale_to_maximum: (float, float) containing the maximum scale to be used and the average in case of
-    missing scale for a frame
+LOG_FORMAT = "%(asctime)s %(processName)s %(levelname)s %(message)s"
+
+def frame_focus(color_frame, image_type, grayscale_frame=None):
+    """Select the image focus of an in-memory frame
+
+    Arguments:
+        color_frame                          frame loaded w/ BGR channels (IMREAD_COLOR)
+        image_type                           IMAGE_TYPE of the frame
+
+    Optional:
+        grayscale_frame                      grayscale conversion of color_frame. Pass in if already computed
+
+    Returns:
+        The image focus. Color focus for COLOR frames, grayscale scan window otherwise
     """
     if image_type is IMAGE_TYPE.COLOR:
 
-        # Load color frame and select the image focus
-        image_focus = load_select_color_image_focus(
-            path_to_frame,
+        # Select the highlighted image focus
+        return get_color_image_focus(
+            color_frame,
             np.array(HSV_COLOR_THRESHOLD.LOWER.value, np.uint8),
             np.array(HSV_COLOR_THRESHOLD.UPPER.value, np.uint8))
-    else:
 
-        # Load grayscale frame and select the scan window
-        image_focus = load_select_save_scan_window(
-            path_to_frame, 
-            np.array(HSV_GRAYSCALE_THRESHOLD.LOWER.value, np.uint8),
-            np.array(HSV_GRAYSCALE_THRESHOLD.UPPER.value, np.uint8))
+    if grayscale_frame is None:
+        grayscale_frame = cv2.cvtColor(color_frame, cv2.COLOR_BGR2GRAY)
+
+    # TODO PENN-42: The scan window of a grayscale ultrasound frame is NOT the final image focus
+    # Integrate automatic segmentation (Xian) here to get the the tumor ROI (image focus)
+    # from the scan window. Note: this only applies to grayscale frames
+    return select_scan_window(grayscale_frame, cm=0)
 
-        # TODO PENN-42: The scan window of a grayscale ultrasound frame is NOT the final image focus
-        # Integrate automatic segmentation (Xian) here to get the the tumor ROI (image focus)
-        # from the scan window. Note: this only applies to grayscale frames
 
-    # Optionally run interpolation
-    if interpolation_factor is not None:
-        image_focus = cv2.resize(
-            image_focus, 
-            None, 
-            fx=interpolation_factor, 
-            fy=interpolation_factor)
+def frame_focus_batch(frames, image_types):
+    """Select the image focus of a stack of in-memory frames (e.g. all frames of a patient)
 
+    Frames are grouped by image type and each group is segmented with the batch API of its type.
+    The focus bounds found on one frame are reused for the following frames of the same scanner
+    geometry instead of searching every frame independently.
+
+    Arguments:
+        frames                               frames to segment. BGR frames (IMREAD_COLOR) for COLOR
+                                                 frames, grayscale frames otherwise
+        image_types                          IMAGE_TYPE of each frame
+
+    Returns:
+        List with one entry per frame. Either the image focus or the exception raised for that frame
+    """
+    image_focuses = [None] * len(frames)
+
+    color_indices = [index for index, image_type in enumerate(image_types) if image_type is IMAGE_TYPE.COLOR]
+    grayscale_indices = [index for index, image_type in enumerate(image_types) if image_type is not IMAGE_TYPE.COLOR]
+
+    # Select the highlighted image focus
+    color_focuses = get_color_image_focus_batch(
+        [frames[index] for index in color_indices],
+        np.array(HSV_COLOR_THRESHOLD.LOWER.value, np.uint8),
+        np.array(HSV_COLOR_THRESHOLD.UPPER.value, np.uint8))
+
+    # TODO PENN-42: See frame_focus. Grayscale frames only yield the scan window
+    grayscale_focuses = select_scan_window_batch(
+        [frames[index] for index in grayscale_indices],
+        cm=0)
+
+    for index, image_focus in zip(color_indices + grayscale_indices, color_focuses + grayscale_focuses):
+        image_focuses[index] = image_focus
+
+    return image_focuses
+
+
+def interpolate_focus(image_focus, interpolation_factor=None):
+    """Optionally resize the image focus by the interpolation factor"""
+    if interpolation_factor is None:
+        return image_focus
+
+    return cv2.resize(
+        image_focus,
+        None,
+        fx=interpolation_factor,
+        fy=interpolation_factor)
+
+
+def save_focus(image_focus, abs_path_to_focus_output_dir):
+    """Save the image focus with a random hash as filename. Returns the path to the saved focus"""
     hash_path = "{0}/{1}.png".format(abs_path_to_focus_output_dir, uuid.uuid4())
     cv2.imwrite(hash_path, image_focus)
 
     return hash_path
 
 
-def frame_ocr(color_frame, image_type):
+def binarize_frame(color_frame, grayscale_frame=None):
     # Always use the grayscale converted image for text isolation
-    grayscale_frame = cv2.cvtColor(color_frame, cv2.COLOR_BGR2GRAY)
+    if grayscale_frame is None:
+        grayscale_frame = cv2.cvtColor(color_frame, cv2.COLOR_BGR2GRAY)
 
     # Some weird thresholding code. Not sure where it came from
-    grayscale_frame = cv2.threshold(grayscale_frame, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
+    return cv2.threshold(grayscale_frame, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
+
 
-    return isolate_text(grayscale_frame, image_type)
+def frame_readout_regions(color_frame, grayscale_frame=None):
+    """Binarized readout region crops of a frame. Input to isolate_text_batch"""
+    return crop_readout_regions(binarize_frame(color_frame, grayscale_frame))
 
 
+def frame_interpolation_factor(frame_record, interpolation_context):
+    """Interpolation factor of a frame given the corpus (minimum scale, average scale)
+
+    If the scale of the frame is undefined, the global average frame scale is used
+    """
+    found_scale = frame_record.get(RA.SCALE, interpolation_context[1])
+    found_scale = found_scale if found_scale is not None else interpolation_context[1]
+
+    interpolation_factor = found_scale / interpolation_context[0]
 
-def patient_ocr(
+    # Sanity check
+    if interpolation_factor > 5:
+        LOGGER.warning("Segmentation | Factor: %f exceeds limit for frame: %s",
+                       interpolation_factor, frame_record[FRAME_LABEL])
+
+    return interpolation_factor
+
+
+def patient_frame_pipeline(
         abs_path_to_patient_folder,
         patient,
         rel_path_to_frames_folder,
         rel_path_to_focus_output_folder,
         timestamp,
-        composite_records=None,
-        patient_type_label=None):
-    """Run OCR subroutine for an individual patient
+        patient_type_label=None,
+        frame_cache=None):
+    """Run OCR and segmentation for an individual patient in a single pass over the frames
 
-    Each patient"s ultrasound lives in a unique folder. Expectation is that a consistently named
-    folder exists for each patient containing the individual frames of the patient"s ultrasound.
-    For this patient, go frame by frame and process use OCR to extract textual information (WF, RAD/ARAD, etc.),
-    and a the tumor segmentation ("frame focus"). The frame focus is clearly delineated for color frames
-    and must be inferred for grayscale frames.
+    Each frame is decoded exactly once. The image type, OCR text and image focus are all determined
+    from the same in-memory frame. Segmentation and OCR run once per patient over all frames so the
+    focus search and OCR engine overhead are paid per batch, not per frame. The image focus is saved
+    without interpolation because the interpolation factor depends on corpus-wide scale statistics.
+    Use patient_interpolation once those statistics are known.
 
     Arguments:
         abs_path_to_patient_folder           absolute path to patient folder
@@ -111,18 +188,15 @@ def patient_ocr(
         timestamp                            timestamp to postfix to focus output directory
 
     Optional:
-        composite_records                    reference to manifest with keys patient ids (e.g. 00BER90238)
-                                                 and values list of all frame records for the patient
-
         patient_type_label                   type of patient. Prefix in filename and present in all records
 
+        frame_cache                          FrameCache of OCR records and focuses. Frames with unchanged content
+                                                 are not decoded and their cached focus is copied to the output
+
     Returns:
-      If composite_records is passed in, returns reference to composite_records.
-      Else returns an array of patient records
+        Array of patient frame records. Frames that fail OCR are skipped. Frames that fail
+        segmentation have no FOCUS entry
     """
-
-    build_new_records_flag = composite_records is None
-
     abs_path_to_frame_dir = "{}/{}".format(
         abs_path_to_patient_folder.rstrip("/"),
         rel_path_to_frames_folder)
@@ -136,189 +210,271 @@ def patient_ocr(
     if not os.path.isdir(abs_path_to_focus_output_dir):
         os.mkdir(abs_path_to_focus_output_dir)
 
-    individual_patient_frames = [name for name in os.listdir(abs_path_to_frame_dir)]
+    individual_patient_frames = sorted(os.listdir(abs_path_to_frame_dir))
 
-    # Create an array to store all found & cleared text patient records if building the records from scratch
-    if build_new_records_flag:
-        compiled_patient_records = []
+    # One entry per frame. Frames that fail OCR are left as None
+    compiled_patient_records = [None] * len(individual_patient_frames)
 
-    ############################################################
-    # OCR to get frame scale, RAD/ARAD, etc
-    ############################################################
+    # Frames awaiting segmentation and OCR: (index, frame_label, cache_key, image_type, readout_regions, frame)
+    # The frame is replaced by its image focus once the patient is segmented
+    pending_frames = []
 
-    for frame_label in individual_patient_frames:
+    cache_key = None
+    cache_hits = 0
+
+    for index, frame_label in enumerate(individual_patient_frames):
 
         path_to_frame = "{}/{}".format(abs_path_to_frame_dir, frame_label)
-        color_frame = cv2.imread(path_to_frame, cv2.IMREAD_COLOR)
 
-        # Run the OCR subroutine
+        with open(path_to_frame, "rb") as frame_file:
+            frame_bytes = frame_file.read()
+
+        if frame_cache is not None:
+            cache_key = frame_cache.key(frame_bytes)
+            cache_entry = frame_cache.get(cache_key)
+
+            if cache_entry is not None:
+                LOGGER.info("Cache hit for frame: %s", frame_label)
+                frame_record, cached_focus_path = cache_entry
+                cache_hits += 1
+
+                frame_record[FRAME_LABEL] = frame_label
+                frame_record[TUMOR_TYPE_LABEL] = patient_type_label
+
+                if cached_focus_path is not None:
+                    hash_path = "{0}/{1}.png".format(abs_path_to_focus_output_dir, uuid.uuid4())
+                    shutil.copyfile(cached_focus_path, hash_path)
+                    frame_record[FOCUS_HASH_LABEL] = hash_path
+
+                compiled_patient_records[index] = frame_record
+                continue
+
+        color_frame = cv2.imdecode(np.frombuffer(frame_bytes, np.uint8), cv2.IMREAD_COLOR)
+
         try:
             # Determine whether the frame is color or grayscale
             image_type = determine_image_type(color_frame)
 
-            LOGGER.info("Attempting text OCR for frame: %s", frame_label)
-            found_text = frame_ocr(color_frame, image_type)
+            # Shared by the OCR and the grayscale scan window selection
+            grayscale_frame = cv2.cvtColor(color_frame, cv2.COLOR_BGR2GRAY)
+
+            readout_regions = frame_readout_regions(color_frame, grayscale_frame=grayscale_frame)
 
         except Exception as exc:
             LOGGER.error("Failed text OCR for frame: %s. %s", frame_label, str(exc))
             continue
 
-        if build_new_records_flag:
-            # Use the found text as a basis for a new frame record
-            found_text[FRAME_LABEL] = frame_label
-            found_text[TUMOR_TYPE_LABEL] = patient_type_label
-            found_text[IMAGE_TYPE_LABEL] = image_type.value
+        # Keep only the frame the segmentation of its image type works on
+        segmentation_frame = color_frame if image_type is IMAGE_TYPE.COLOR else grayscale_frame
 
-            compiled_patient_records.append(found_text)
+        pending_frames.append((index, frame_label, cache_key, image_type, readout_regions, segmentation_frame))
 
-        else:
-            # Get the reference to the current frame record
-            frame_record = [rec for rec in composite_records[patient] if rec[FRAME_LABEL] == frame_label]
+    # Segment every remaining frame of the patient as a stack. Focus bounds are shared across frames
+    if pending_frames:
+        LOGGER.info("Attempting tumor segmentation for %d frames of patient: %s", len(pending_frames), patient)
 
-            if not frame_record:
-                LOGGER.error("Frame record not in composite records: %s", frame_label)
-                continue
+        image_focuses = frame_focus_batch(
+            [pending[5] for pending in pending_frames],
+            [pending[3] for pending in pending_frames])
 
-            frame_record = frame_record[0]
+        for pending, image_focus in zip(pending_frames, image_focuses):
+            if isinstance(image_focus, Exception):
+                LOGGER.error("Failed tumor segmentation for frame: %s. %s", pending[1], str(image_focus))
 
-            # Augment the existing record with new frame information
-            for key, value in found_text.items():
-                frame_record[key] = value
+        pending_frames = [
+            pending[:5] + (None if isinstance(image_focus, Exception) else image_focus,)
+            for pending, image_focus in zip(pending_frames, image_focuses)]
 
-    # Either return the new records or reference to the composite records
-    return compiled_patient_records if build_new_records_flag else composite_records
+    # OCR every remaining frame of the patient in a single batch
+    if pending_frames:
+        LOGGER.info("Attempting text OCR for %d frames of patient: %s", len(pending_frames), patient)
 
+        ocr_engine = get_ocr_engine()
+        ocr_hits, ocr_misses = ocr_engine.hits, ocr_engine.misses
 
-def patient_segmentation(
-        abs_path_to_patient_folder,
-        patient,
-        rel_path_to_frames_folder,
-        rel_path_to_focus_output_folder,
-        timestamp,
-        composite_records=None,
-        patient_type_label=None,
-        interpolation_context=None):
+        found_texts = isolate_text_batch(
+            [pending[4] for pending in pending_frames],
+            [pending[3] for pending in pending_frames],
+            engine=ocr_engine)
 
-    """
-        ############################################################
-        # Segmentation to crop the frame's "focus"
-        # Ideally, the focus is a close crop of the tumor
-        ############################################################
+        # Identical readout crops are recognized once. See MemoizedEngine
+        LOGGER.info("OCR memo | patient: %s | hits: %d | misses: %d",
+                    patient, ocr_engine.hits - ocr_hits, ocr_engine.misses - ocr_misses)
+    else:
+        found_texts = []
 
-            interpolation_context: (float, float) containing the maximum scale
-            to be used and the average in case of missing scale for a frame
-    """
+    for (index, frame_label, cache_key, image_type, _, image_focus), found_text in zip(pending_frames, found_texts):
 
-    build_new_records_flag = composite_records is None
+        if isinstance(found_text, Exception):
+            LOGGER.error("Failed text OCR for frame: %s. %s", frame_label, str(found_text))
+            continue
 
-    # patient_label = os.path.basename(abs_path_to_patient_folder)
-    abs_path_to_frame_dir = "{}/{}".format(
-        abs_path_to_patient_folder.rstrip("/"),
-        rel_path_to_frames_folder)
+        frame_record = found_text
+        frame_record[IMAGE_TYPE_LABEL] = image_type.value
 
-    abs_path_to_focus_output_dir = "{}/{}_{}".format(
-        abs_path_to_patient_folder.rstrip("/"),
-        rel_path_to_focus_output_folder,
-        timestamp)
+        # Only content derived fields are cached. Labels depend on where the frame lives
+        if frame_cache is not None:
+            frame_cache.put(cache_key, frame_record, image_focus)
 
-    # Create the focus output directory if it does not exist
-    if not os.path.isdir(abs_path_to_focus_output_dir):
-        os.mkdir(abs_path_to_focus_output_dir)
+        frame_record[FRAME_LABEL] = frame_label
+        frame_record[TUMOR_TYPE_LABEL] = patient_type_label
 
-    # Set up frame objects
-    individual_patient_frames = [name for name in os.listdir(abs_path_to_frame_dir)]
+        if image_focus is not None:
+            frame_record[FOCUS_HASH_LABEL] = save_focus(image_focus, abs_path_to_focus_output_dir)
 
-    # Create an array to store all found & cleared text patient records if building the records from scratch
-    if build_new_records_flag:
-        compiled_patient_records = []
+        compiled_patient_records[index] = frame_record
 
-    for frame_label in individual_patient_frames:
+    if frame_cache is not None:
+        LOGGER.info("Frame cache | patient: %s | hits: %d | misses: %d",
+                    patient, cache_hits, len(individual_patient_frames) - cache_hits)
 
-        path_to_frame = "{}/{}".format(abs_path_to_frame_dir, frame_label)
-        color_frame = cv2.imread(path_to_frame, cv2.IMREAD_COLOR)
+    return [frame_record for frame_record in compiled_patient_records if frame_record is not None]
 
-        try:
-            # Determine whether the frame is color or grayscale
-            image_type = determine_image_type(color_frame)
 
-            LOGGER.info("Attempting tumor segmentation for frame: %s", frame_label)
+def patient_interpolation(patient_records, interpolation_context):
+    """Resize the saved image focus of every patient frame
+
+    Only the (small) saved focus is decoded again, never the full frame. The resized focus is saved
+    alongside the original. Updates each frame record with the new focus path and the interpolation
+    factor used.
 
-            if interpolation_context is not None and not build_new_records_flag:
-                LOGGER.info("Segmentation | Upscaling frame: %s", frame_label)
-                # Get the reference to the current frame record
-                frame_record = [rec for rec in composite_records[patient] if rec[FRAME_LABEL] == frame_label]
+    Arguments:
+        patient_records                      array of patient frame records with saved focus paths
+        interpolation_context                (float, float) containing the minimum scale to be used
+                                                 and the average in case of missing scale for a frame
 
-                if not frame_record:
-                    LOGGER.error("Segmentation | Frame record not in composite records: %s", frame_label)
-                    continue
+    Returns:
+        Reference to patient_records
+    """
+    for frame_record in patient_records:
 
-                frame_record = frame_record[0]
+        hash_path = frame_record.get(FOCUS_HASH_LABEL, None)
 
-                # If the scale is undefined, use the global average frame scale
-                found_scale = frame_record.get(RA.SCALE, interpolation_context[1])
-                found_scale = found_scale if found_scale is not None else interpolation_context[1]
+        if hash_path is None:
+            continue
 
-                interpolation_factor = found_scale / interpolation_context[0]
+        try:
+            interpolation_factor = frame_interpolation_factor(frame_record, interpolation_context)
 
-                # Sanity check
-                if interpolation_factor > 5:
-                    LOGGER.warning("Segmentation | Factor: %f exceeds limit for frame: %s",
-                                   interpolation_factor, frame_label)
+            LOGGER.info("Segmentation | Interpolation factor: %f | frame: %s",
+                        interpolation_factor, frame_record[FRAME_LABEL])
 
-                LOGGER.info("Segmentation | Interpolation factor: %f | frame: %s", interpolation_factor, frame_label)
+            image_focus = cv2.imread(hash_path, cv2.IMREAD_UNCHANGED)
 
-                # Get the tumor segmentation from the patient frame
-                hash_path = frame_segmentation(
-                    path_to_frame,
-                    abs_path_to_focus_output_dir,
-                    image_type,
-                    interpolation_factor=interpolation_factor)
-            else:
-                # Get the tumor segmentation from the patient frame
-                hash_path = frame_segmentation(
-                    path_to_frame,
-                    abs_path_to_focus_output_dir,
-                    image_type)
+            # Save to a new path so the un-interpolated focus survives a crash mid-pass
+            interpolated_hash_path = save_focus(
+                interpolate_focus(image_focus, interpolation_factor),
+                os.path.dirname(hash_path))
 
         except Exception as exc:
-            LOGGER.error("Failed tumor segmentation for frame: %s. %s", frame_label, str(exc))
+            LOGGER.error("Failed focus interpolation for frame: %s. %s", frame_record[FRAME_LABEL], str(exc))
             continue
 
-        if build_new_records_flag:
+        frame_record[FOCUS_HASH_LABEL] = interpolated_hash_path
+        frame_record[INTERPOLATION_FACTOR_LABEL] = interpolation_factor
 
-            new_record = {}
+    return patient_records
 
-            new_record[FRAME_LABEL] = frame_label
-            new_record[TUMOR_TYPE_LABEL] = patient_type_label
-            new_record[IMAGE_TYPE_LABEL] = image_type.value
 
-            # Use the found text as a basis for a new frame record
-            new_record[FOCUS_HASH_LABEL] = hash_path
+def remove_unreferenced_focuses(abs_path_to_focus_output_dir, frame_records):
+    """Remove the focuses of a focus output directory that no frame record refers to
 
-            if interpolation_context is not None:
-                new_record[INTERPOLATION_FACTOR_LABEL] = interpolation_factor
+    The directory belongs to a single run (timestamp). Unreferenced focuses were superseded by the interpolation
+    pass or written before the run was interrupted, e.g. by an interpolation pass that did not complete
+    """
+    if not os.path.isdir(abs_path_to_focus_output_dir):
+        return
 
-            compiled_patient_records.append(new_record)
+    referenced_paths = set(os.path.abspath(frame[FOCUS_HASH_LABEL])
+                           for frame in frame_records if FOCUS_HASH_LABEL in frame)
 
-        else:
-            # Get the reference to the current frame record
-            frame_record = [rec for rec in composite_records[patient] if rec[FRAME_LABEL] == frame_label]
+    for filename in os.listdir(abs_path_to_focus_output_dir):
+        focus_path = os.path.abspath(os.path.join(abs_path_to_focus_output_dir, filename))
+
+        if filename.endswith(".png") and focus_path not in referenced_paths:
+            os.remove(focus_path)
+
+
+def configure_worker_logging(path_to_log_dir, timestamp):
+    """Attach a per-process log file to the processing logger
+
+    Each pool worker writes to its own file so that log lines from concurrently processed
+    patients are not interleaved. Log files are named processing_{timestamp}_{pid}.log
+    """
+    log_path = "{}/processing_{}_{}.log".format(
+        path_to_log_dir.rstrip("/"),
+        timestamp,
+        os.getpid())
+
+    handler = logging.FileHandler(log_path)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    LOGGER.addHandler(handler)
+    LOGGER.setLevel(logging.INFO)
 
-            if not frame_record:
-                LOGGER.error("Frame record not in composite records: %s", frame_label)
-                continue
 
-            frame_record = frame_record[0]
+def patient_frame_pipeline_task(task):
+    """Pool worker entry point. Run the fused OCR + segmentation pass for a single patient
+
+    Returns (patient_label, records)
+    """
+    (patient_label, patient_type_label, path, rel_path_to_frames_folder, rel_path_to_focus_output_folder,
+     timestamp, frame_cache) = task
+
+    LOGGER.info("OCR + SEGMENTATION | Processing patient: %s", patient_label)
+
+    patient_directory_absolute_path = "{}/{}".format(path.rstrip("/"), patient_label)
+
+    acquired_records = patient_frame_pipeline(
+        patient_directory_absolute_path,
+        patient_label,
+        rel_path_to_frames_folder,
+        rel_path_to_focus_output_folder,
+        timestamp,
+        patient_type_label=patient_type_label,
+        frame_cache=frame_cache)
+
+    return patient_label, acquired_records
+
+
+def patient_interpolation_task(task):
+    """Pool worker entry point. Interpolate the saved focuses of a single patient
+
+    The worker receives only the records of its own patient, updates them in-place and sends them
+    back to the parent process to be merged into the composite records.
+    """
+    patient_label, patient_records, interpolation_context = task
+
+    LOGGER.info("INTERPOLATION | Processing patient: %s", patient_label)
+
+    return patient_label, patient_interpolation(patient_records, interpolation_context)
 
-            if interpolation_context is not None:
-                frame_record[INTERPOLATION_FACTOR_LABEL] = interpolation_factor
 
-            # Augment the existing record with new frame information
-            frame_record[FOCUS_HASH_LABEL] = hash_path
+def map_patients(task_function, tasks, description, workers=1, path_to_log_dir=None, timestamp=None):
+    """Apply a patient task to every task tuple, optionally fanned out to a process pool
 
-    # Either return the new records or reference to the composite records
-    return compiled_patient_records if build_new_records_flag else composite_records
+    Arguments:
+        task_function                        module level function taking a task tuple, returning (patient_label, value)
+        tasks                                list of task tuples. One per patient
+        description                          progress bar description
+
+    Optional:
+        workers                              number of worker processes. Values <= 1 run serially in-process
+        path_to_log_dir                      directory for per-worker log files. Required if workers > 1
+        timestamp                            timestamp to postfix to the per-worker log files
+
+    Returns:
+        List of (patient_label, value) in the same order as tasks regardless of worker scheduling
+    """
+    if workers <= 1:
+        return [task_function(task) for task in tqdm(tasks, desc=description)]
 
+    with Pool(processes=workers,
+              initializer=configure_worker_logging,
+              initargs=(path_to_log_dir, timestamp)) as pool:
+
+        # imap yields results in submission order, keeping the merged manifest deterministic
+        return list(tqdm(pool.imap(task_function, tasks), total=len(tasks), desc=description))
 
 
 def process_patient_set(
@@ -328,7 +484,9 @@ def process_patient_set(
         rel_path_to_focus_output_folder,
         path_to_manifest_output_dir,
         timestamp=None,
-        upscale_to_maximum=False):
+        upscale_to_maximum=False,
+        workers=1,
+        path_to_cache_dir=None):
 
     """Processes a set of patients from a top level directory.
 
@@ -352,32 +510,58 @@ def process_patient_set(
                                              scale on a new frame is 3.0 cm. We then upscale the focus by a factor of
                                              4.8 / 3.0. If the scale has no frame, the scale factor will be
                                              4.8 / average(all_frames)
+
+        workers                              number of worker processes used for the frame and interpolation passes.
+                                             Each worker logs to processing_{timestamp}_{pid}.log in the manifest
+                                             output directory. Default 1 (serial)
+
+        path_to_cache_dir                    directory of the frame content-hash cache. Frames already in the cache
+                                             skip decoding, OCR and segmentation. Default no cache
+
+    Resuming:
+        Completed patients are checkpointed to manifest_{timestamp}.checkpoint.jsonl in the manifest output
+        directory. Rerunning with the same timestamp skips every checkpointed patient. The checkpoint holds
+        the records before interpolation, so the interpolation pass is always run again. The checkpoint is
+        removed once the final manifest is written, along with every focus of the run the manifest does not
+        refer to (e.g. written by an interrupted interpolation pass). Without -t, the command line resumes the
+        latest checkpoint in the manifest output directory.
     """
 
     patient_records = {}
 
 
+    # Sort patients so that the manifest ordering does not depend on directory listing order
     all_patients = [(patient_label, patient_type_label, path)
                     for path, patient_type_label in [(path_to_benign_dir, TUMOR_BENIGN), (path_to_malignant_dir, TUMOR_MALIGNANT)]
-                    for patient_label in [name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name))]]
+                    for patient_label in sorted([name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name))])]
+
+    checkpoint_path = manifest_checkpoint_path(path_to_manifest_output_dir, timestamp)
+
+    patient_records.update(load_manifest_checkpoint(checkpoint_path))
 
-    # Process each individual patient
-    for patient_label, patient_type_label, path in tqdm(all_patients, desc="OCR"):
+    if patient_records:
+        LOGGER.info("Resuming from checkpoint: %s. %d patients complete", checkpoint_path, len(patient_records))
 
-        LOGGER.info("OCR | Processing patient: %s", patient_label)
+    frame_cache = FrameCache(path_to_cache_dir) if path_to_cache_dir is not None else None
 
-        patient_directory_absolute_path = "{}/{}".format(path.rstrip("/"), patient_label)
+    # Decode each frame once for OCR and segmentation. Interpolation is deferred until the
+    # corpus-wide scale statistics are known
+    frame_tasks = [(patient_label, patient_type_label, path, rel_path_to_frames_folder,
+                    rel_path_to_focus_output_folder, timestamp, frame_cache)
+                   for patient_label, patient_type_label, path in all_patients
+                   if patient_label not in patient_records]
 
-        acquired_records = patient_ocr(
-            patient_directory_absolute_path,
-            patient_label,
-            rel_path_to_frames_folder,
-            rel_path_to_focus_output_folder,
-            timestamp,
-            composite_records=None,
-            patient_type_label=patient_type_label)
+    with open(checkpoint_path, "a") as checkpoint_file:
+        for patient_label, acquired_records in map_patients(
+                patient_frame_pipeline_task,
+                frame_tasks,
+                "OCR + Segmentation",
+                workers=workers,
+                path_to_log_dir=path_to_manifest_output_dir,
+                timestamp=timestamp):
 
-        patient_records[patient_label] = acquired_records
+            patient_records[patient_label] = acquired_records
+            append_manifest_checkpoint(checkpoint_file, patient_label, acquired_records)
 
     # Handle upscale to the maximum scale found in the corpus
     if upscale_to_maximum:
@@ -424,34 +608,113 @@ def process_patient_set(
         print("Scale to minimum. minimum: %f. Average: %f", scale_minimum, scale_average)
         LOGGER.info("Scale to minimum. minimum: %f. Average: %f", scale_minimum, scale_average)
 
+        interpolation_context = (scale_minimum, scale_average)
 
-    for patient_label, patient_type_label, path in tqdm(all_patients, desc="Segmentation"):
+        interpolation_tasks = [(patient_label, patient_records[patient_label], interpolation_context)
+                               for patient_label, _, _ in all_patients]
 
-        LOGGER.info("SEGMENTATION | Processing patient: %s", patient_label)
+        # Workers update their own copy of the patient records. Merge back into the composite records
+        for patient_label, interpolated_records in map_patients(
+                patient_interpolation_task,
+                interpolation_tasks,
+                "Interpolation",
+                workers=workers,
+                path_to_log_dir=path_to_manifest_output_dir,
+                timestamp=timestamp):
 
-        patient_directory_absolute_path = "{}/{}".format(path.rstrip("/"), patient_label)
+            patient_records[patient_label] = interpolated_records
 
-        interpolation_context = (scale_minimum, scale_average) if upscale_to_maximum else None
-
-        # Pass in complete records to update records in-place
-        patient_segmentation(
-            patient_directory_absolute_path,
-            patient_label,
-            rel_path_to_frames_folder,
-            rel_path_to_focus_output_folder,
-            timestamp,
-            composite_records=patient_records,
-            patient_type_label=patient_type_label,
-            interpolation_context=interpolation_context)
-
-    # Dump the patient records to file
+    # Dump the patient records to file in patient order
     manifest_absolute_path = "{}/manifest_{}.json".format(
         path_to_manifest_output_dir.rstrip("/"),
         timestamp)
 
-    manifest_file = open(manifest_absolute_path, "a")
-
-    json.dump(patient_records, manifest_file)
+    with open(manifest_absolute_path, "w") as manifest_file:
+        json.dump({patient_label: patient_records[patient_label] for patient_label, _, _ in all_patients},
+                  manifest_file)
 
     # Cleanup
-    manifest_file.close()
+    os.remove(checkpoint_path)
+
+    # Un-interpolated focuses superseded by the interpolation pass, and focuses written by an interrupted run
+    for patient_label, patient_type_label, path in all_patients:
+        remove_unreferenced_focuses(
+            "{}/{}/{}_{}".format(path.rstrip("/"), patient_label, rel_path_to_focus_output_folder, timestamp),
+            patient_records[patient_label])
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "benign_dir",
+        help="Absolute path to top level directory containing benign patient folders")
+
+    parser.add_argument(
+        "malignant_dir",
+        help="Absolute path to top level directory containing malignant patient folders")
+
+    parser.add_argument(
+        "-f",
+        "--frames-folder",
+        help="Relative path from each patient folder to the patient frames folder",
+        required=True)
+
+    parser.add_argument(
+        "-o",
+        "--focus-folder",
+        help="Relative path from each patient folder to the frame focus output folder",
+        required=True)
+
+    parser.add_argument(
+        "-m",
+        "--manifest-dir",
+        help="Absolute path to manifest output directory",
+        required=True)
+
+    parser.add_argument(
+        "-t",
+        "--timestamp",
+        help="Timestamp to use instead of generating using the current time. Resuming a crashed run needs its "
+             "timestamp. Default: the timestamp of the latest checkpoint in the manifest directory if there is one "
+             "(resume), else the current time",
+        default=None)
+
+    parser.add_argument(
+        "-u",
+        "--upscale-to-maximum",
+        action="store_true",
+        help="Resize all focuses with respect to the scale found in the corpus")
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes. Each worker keeps its own log file in the manifest directory")
+
+    parser.add_argument(
+        "-c",
+        "--cache-dir",
+        help="Directory of the frame content-hash cache. Reruns skip frames already in the cache",
+        default=None)
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+
+    # Resume the latest interrupted run unless a timestamp is given
+    timestamp = args.timestamp or latest_checkpoint_timestamp(args.manifest_dir)
+    if args.timestamp is None and timestamp is not None:
+        LOGGER.info("Found checkpoint of run: %s. Pass -t to start another run", timestamp)
+
+    process_patient_set(
+        args.benign_dir,
+        args.malignant_dir,
+        args.frames_folder,
+        args.focus_folder,
+        args.manifest_dir,
+        timestamp=timestamp or datetime.now().strftime("%Y_%m_%d_%H_%M_%S"),
+        upscale_to_maximum=args.upscale_to_maximum,
+        workers=args.workers,
+        path_to_cache_dir=args.cache_dir)
@@ -7,7 +7,7 @@ from constants.ultrasound import (
     FRAME_DEFAULT_ROW_CROP_FOR_SCAN_SELECTION,
     FRAME_DEFAULT_COL_CROP_FOR_SCAN_SELECTION)
 
-from utilities.segmentation.brute.grayscale import select_scan_window_from_frame
+from dataset_preparation.segmentation.brute.grayscale import select_scan_window_from_frame
 
 # TODO: [#48] Add argument to support grayscale vs. color
 # Only supports grayscale a.t.m
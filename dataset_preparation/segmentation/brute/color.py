@@ -4,38 +4,28 @@ import uuid
 import numpy as np
 
 from constants.ultrasound import HSV_COLOR_THRESHOLD
-from utilities.image.image import center_crop_to_target_padding
+from utilities.image.image import apply_single_crop, center_crop_to_target_padding, rectangle_outline
 
 
-def get_color_image_focus(
-    image,
-    HSV_lower_bound, 
-    HSV_upper_bound,
-    crop_inside_boundary_radius=3):
+def find_color_image_focus_bounds(image, HSV_lower_bound, HSV_upper_bound):
     """
-    Determines the "focus" of an ultrasound frame in Color/CPA. 
-
-    Ultrasound frames in Color/CPA mode highlight the tumor under examination to 
-    focus the direction of the scan. This function extracts the highlighted region, which
-    is surrounded by a bright rectangle and saves it to file. 
+    Determines the bounds of the highlight box and the "focus" inside it for a Color/CPA frame
 
     Arguments:
         image                               The input image in BGR format    
         HSV_lower_bound                     np.array([1, 3], uint8) lower HSV threshold to find highlight box
         HSV_upper_bound                     np.array([1, 3], uint8) upper HSV threshold to find highlight box
 
-    Optional:
-        crop_inside_boundary_radius         Crop center of found image focus creating boundary of radius pixels.
-                                                Default is 2px boundary radius.
     Returns:
-        image_focus                         The found color image focus
+        highlight_bounds                    (x, y, w, h) of the highlight box including its border
+        focus_bounds                        (x, y, w, h) of the region inside the border. Frame coordinates
     """
     hsv_image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
     mask = cv2.inRange(hsv_image, HSV_lower_bound, HSV_upper_bound)
 
     # Determine contours of the masked image
 
-    contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)[1]
+    contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)[-2]
 
     if len(contours) == 0:
             raise Exception("Unable to find any matching contours.")
@@ -45,18 +35,12 @@ def get_color_image_focus(
     max_contour = max(contours, key = cv2.contourArea)
     x, y, w, h = cv2.boundingRect(max_contour)
 
-    # Crop the image to the bounding rectangle
-
-    focus_image = image[y:y+h, x:x+w]
-
     # The bounding box includes the border. Remove the border by masking on the same 
     # thresholds as the initial mask, then flip the mask and draw a bounding box. 
 
-    focus_hsv = cv2.cvtColor(focus_image, cv2.COLOR_BGR2HSV)
-    mask = cv2.inRange(focus_hsv, HSV_lower_bound, HSV_upper_bound)
-    mask = cv2.bitwise_not(mask)
+    mask = cv2.bitwise_not(mask[y:y+h, x:x+w])
 
-    contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)[1]
+    contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)[-2]
 
     if len(contours) == 0:
         raise Exception("Unable to find any matching contours.")
@@ -64,20 +48,104 @@ def get_color_image_focus(
     #find the biggest area
     max_contour = max(contours, key = cv2.contourArea)
 
-    x, y, w, h = cv2.boundingRect(max_contour)
+    x_f, y_f, w_f, h_f = cv2.boundingRect(max_contour)
 
-    # Crop the image to the bounding rectangle
+    return (x, y, w, h), (x + x_f, y + y_f, w_f, h_f)
 
-    image_focus = focus_image[y: y + h, x: x + w]
+
+def crop_color_image_focus(image, focus_bounds, crop_inside_boundary_radius=3):
+    """Crop the focus bounds out of the frame, then crop inwards by the boundary radius"""
+    x, y, w, h = focus_bounds
+
+    image_focus = image[y: y + h, x: x + w]
 
     # As conservative measure, crop inwards by small radius to guarantee no boundary
-    image_focus, _ = center_crop_to_target_padding(
+    return apply_single_crop(image_focus, center_crop_to_target_padding(
         image_focus,
         crop_inside_boundary_radius,
         crop_inside_boundary_radius
-    )
+    ))
+
+
+def get_color_image_focus(
+    image,
+    HSV_lower_bound, 
+    HSV_upper_bound,
+    crop_inside_boundary_radius=3):
+    """
+    Determines the "focus" of an ultrasound frame in Color/CPA. 
+
+    Ultrasound frames in Color/CPA mode highlight the tumor under examination to 
+    focus the direction of the scan. This function extracts the highlighted region, which
+    is surrounded by a bright rectangle and saves it to file. 
+
+    Arguments:
+        image                               The input image in BGR format    
+        HSV_lower_bound                     np.array([1, 3], uint8) lower HSV threshold to find highlight box
+        HSV_upper_bound                     np.array([1, 3], uint8) upper HSV threshold to find highlight box
+
+    Optional:
+        crop_inside_boundary_radius         Crop center of found image focus creating boundary of radius pixels.
+                                                Default is 2px boundary radius.
+    Returns:
+        image_focus                         The found color image focus
+    """
+    _, focus_bounds = find_color_image_focus_bounds(image, HSV_lower_bound, HSV_upper_bound)
+
+    return crop_color_image_focus(image, focus_bounds, crop_inside_boundary_radius)
+
+
+def highlight_outline_agreement(image, highlight_bounds, HSV_lower_bound, HSV_upper_bound):
+    """Fraction of the highlight box outline that is within the highlight HSV thresholds"""
+    outline = rectangle_outline(image, highlight_bounds)
+    outline_hsv = cv2.cvtColor(outline[np.newaxis, :, :], cv2.COLOR_BGR2HSV)
+
+    return np.count_nonzero(cv2.inRange(outline_hsv, HSV_lower_bound, HSV_upper_bound)) / outline.shape[0]
+
+
+def get_color_image_focus_batch(
+    images,
+    HSV_lower_bound,
+    HSV_upper_bound,
+    crop_inside_boundary_radius=3,
+    minimum_outline_agreement=0.9):
+    """
+    Determines the "focus" of a stack of Color/CPA frames sharing scanner geometry (e.g. a patient clip)
+
+    The contour search runs once and its bounds are reused for following frames. Reuse is validated
+    per frame by checking that the highlight box outline is still present at the same place, which
+    only touches the outline pixels. Frames failing validation run the full search and their bounds
+    are reused from then on.
+
+    Arguments:
+        images                              Iterable of input images in BGR format
+        HSV_lower_bound                     np.array([1, 3], uint8) lower HSV threshold to find highlight box
+        HSV_upper_bound                     np.array([1, 3], uint8) upper HSV threshold to find highlight box
+
+    Optional:
+        crop_inside_boundary_radius         Crop center of found image focus creating boundary of radius pixels.
+        minimum_outline_agreement           Fraction of the highlight outline required to reuse bounds. Default 0.9
+
+    Returns:
+        List with one entry per frame. Either the image focus or the exception raised for that frame
+    """
+    bounds = None
+    image_focuses = []
+
+    for image in images:
+        try:
+            if bounds is None or image.shape[:2] != bounds_shape or highlight_outline_agreement(
+                    image, bounds[0], HSV_lower_bound, HSV_upper_bound) < minimum_outline_agreement:
+
+                bounds = find_color_image_focus_bounds(image, HSV_lower_bound, HSV_upper_bound)
+                bounds_shape = image.shape[:2]
+
+            image_focuses.append(crop_color_image_focus(image, bounds[1], crop_inside_boundary_radius))
+
+        except Exception as e:
+            image_focuses.append(e)
 
-    return image_focus
+    return image_focuses
 
 
 def load_select_color_image_focus(
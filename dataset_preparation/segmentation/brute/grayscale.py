@@ -8,6 +8,7 @@ from constants.ultrasound import (
     HSV_COLOR_THRESHOLD,
     FRAME_DEFAULT_ROW_CROP_FOR_SCAN_SELECTION,
     FRAME_DEFAULT_COL_CROP_FOR_SCAN_SELECTION)
+from utilities.image.image import rectangle_outline
 
 def select_out_curvature_line(
     scan_window,
@@ -56,7 +57,7 @@ def select_out_curvature_line(
         np.ones(remain_slice_dilation_kernel_size, np.uint8))
 
     # Determine mask contours
-    contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)[1]
+    contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)[-2]
 
     if len(contours) == 0:
         raise Exception("Unable to find any matching contours")
@@ -113,13 +114,15 @@ def select_scan_window_from_frame(
 
     center_region = mask[slice(y_s, N - y_s), slice(x_s, M - x_s)] 
     
-    # Dilate the center slice of the mask to make contour search more effective
-    center_region[:] = cv2.dilate(
-        center_region, 
-        np.ones(center_slice_dilation_kernel_size, np.uint8))
+    # Dilate the center slice of the mask to make contour search more effective. The slice is empty
+    # if the percentage leaves no center. OpenCV 4+ does not dilate empty images
+    if center_region.size:
+        center_region[:] = cv2.dilate(
+            center_region, 
+            np.ones(center_slice_dilation_kernel_size, np.uint8))
 
     # Determine mask contours
-    contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)[1]
+    contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)[-2]
 
     if len(contours) == 0:
         raise Exception("Unable to find any matching contours")
@@ -148,6 +151,104 @@ def select_scan_window_from_frame(
         return (scan_window_removed_line, scan_contour)
 
 
+def find_scan_window_bounds(image):
+    """
+    Find the scan window bounds of a raw ultrasound frame
+
+    Arguments:
+        image                               raw ultrasound frame (GRAYSCALE)
+
+    Returns:
+        scan_bounds                         (x, y, w, h) of the scan window with the curvature line removed.
+                                                Frame coordinates
+    """
+    N, M = image.shape
+
+    scan_window, scan_bounds = select_scan_window_from_frame(
+        image,
+        5, 255,
+        select_bounds = (
+            slice(FRAME_DEFAULT_ROW_CROP_FOR_SCAN_SELECTION, N),
+            slice(FRAME_DEFAULT_COL_CROP_FOR_SCAN_SELECTION, M)))
+
+    x, y, _, _ = scan_bounds
+    h, w = scan_window.shape[:2]
+
+    return (x, y, w, h)
+
+
+def crop_scan_window(image, scan_bounds, cm=5):
+    """Crop the scan window bounds out of the frame with a margin of cm pixels"""
+    x, y, w, h = scan_bounds
+
+    # As conservative measure crop inwards to guarantee no boundary
+    return image[y + cm: y + h - cm, x + cm: x + w - cm]
+
+
+def select_scan_window(image, cm=5):
+    """
+    Select the scan window of an in-memory ultrasound frame
+
+    Arguments:
+        image                               raw ultrasound frame (GRAYSCALE)
+
+    Optional:
+        cm                                  Global inwards crop to create a margin ("crop margin"). Default 5px
+
+    Returns:
+        scan_window                         The found scan window of the frame
+    """
+    return crop_scan_window(image, find_scan_window_bounds(image), cm)
+
+
+def scan_window_outline(image, scan_bounds, mask_lower_bound=5):
+    """Foreground mask just inside and just outside the scan window bounds"""
+    x, y, w, h = scan_bounds
+
+    return np.concatenate((
+        rectangle_outline(image, (x + 1, y + 1, w - 2, h - 2)),
+        rectangle_outline(image, (x - 1, y - 1, w + 2, h + 2)))) >= mask_lower_bound
+
+
+def select_scan_window_batch(images, cm=5, minimum_outline_agreement=0.9):
+    """
+    Select the scan windows of a stack of frames sharing scanner geometry (e.g. a patient clip)
+
+    The contour search runs once and its bounds are reused for following frames. Reuse is validated
+    per frame by comparing the foreground mask just inside and just outside the window bounds with
+    the frame the bounds were found on. Frames failing validation run the full search and their
+    bounds are reused from then on.
+
+    Arguments:
+        images                              Iterable of raw ultrasound frames (GRAYSCALE)
+
+    Optional:
+        cm                                  Global inwards crop to create a margin ("crop margin"). Default 5px
+        minimum_outline_agreement           Fraction of matching outline pixels required to reuse bounds. Default 0.9
+
+    Returns:
+        List with one entry per frame. Either the scan window or the exception raised for that frame
+    """
+    scan_bounds = None
+    scan_windows = []
+
+    for image in images:
+        try:
+            if scan_bounds is None or image.shape != reference_shape or np.mean(
+                    scan_window_outline(image, scan_bounds) == reference_outline) < minimum_outline_agreement:
+
+                scan_bounds = find_scan_window_bounds(image)
+                reference_shape = image.shape
+                reference_outline = scan_window_outline(image, scan_bounds)
+
+            scan_windows.append(crop_scan_window(image, scan_bounds, cm))
+
+        except Exception as exception:
+            scan_windows.append(exception)
+
+    return scan_windows
+
+
 def load_select_scan_window(path_to_image, cm=5):
     """
     Load and Select the scan window of an ultrasound frame 
@@ -168,18 +269,7 @@ def load_select_scan_window(path_to_image, cm=5):
 
         image = cv2.imread(path_to_image, cv2.IMREAD_GRAYSCALE)
 
-        scan_window, scan_bounds = select_scan_window_from_frame(
-            image, 
-            5, 255, 
-            select_bounds = (
-                slice(FRAME_DEFAULT_ROW_CROP_FOR_SCAN_SELECTION, N), 
-                slice(FRAME_DEFAULT_COL_CROP_FOR_SCAN_SELECTION, M)))
-
-        # Crop the image to the bounding rectangle
-        # As conservative measure crop inwards 3 pixels to guarantee no boundary
-        scan_window = scan_window[y + cm: y + h - cm,   x + cm: x + w - cm] 
-
-        return scan_window
+        return select_scan_window(image, cm)
 
     except Exception as exception:
         raise IOError("Error isolating and saving image focus")
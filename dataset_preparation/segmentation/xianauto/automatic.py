@@ -83,22 +83,29 @@ def __enhance_hypoechoic_regions(image):
         0
     ])
     
+def __separable_weight(length, lower_bound, upper_bound):
+    """1D weighting function of the reference point search. Zero outside the shrinking window"""
+    ind = np.arange(length, dtype=float)
+
+    return np.where(
+        (ind > length - upper_bound) | (ind < lower_bound),
+        0.0,
+        ((ind - lower_bound) * (length - upper_bound - ind)) / (((length - upper_bound - lower_bound) / 2)**2))
+
 def __get_reference_point(image, max_iters=100, eps=2):
 
-    # Watch out that this doesn't blow up if max_iters >>> 
-    weight_dot_image_mat = np.empty((max_iters,) + image.shape)
-    
+    # The weighting at iteration i is the product of all previous weighted images. Keep a running
+    # product instead of the full history so memory is O(pixels) and each iteration is O(pixels)
+    w_multi_prod = np.array(image, dtype=float)
+
     C = np.empty((max_iters, 2))
 
     # X_L, X_R, Y_T, Y_D
     WB = np.empty((max_iters, 4))
     
     M, N = image.shape
-    ind = np.indices(image.shape)
-    row_ind = ind[0]
-    col_ind = ind[1]
-        
-    weight_dot_image_mat[0] = np.multiply(np.ones(image.shape), image)
+    row_ind = np.arange(M, dtype=float)
+    col_ind = np.arange(N, dtype=float)
 
     C[0] = np.array([M // 2, N // 2])
 
@@ -107,14 +114,13 @@ def __get_reference_point(image, max_iters=100, eps=2):
 
     for it in range(1, max_iters):
         # compute C_i. Update C[i] <- C_i
-        w_multi_prod = np.prod(weight_dot_image_mat[:it], axis=0)
 
         # Normalization constant
-        nc = np.sum(w_multi_prod.flatten())
-        
-        # This may be correct
-        C_i_c = np.sum(np.sum(np.multiply(col_ind, w_multi_prod).flatten() / nc))
-        C_i_r = np.sum(np.sum(np.multiply(row_ind, w_multi_prod).flatten() / nc))
+        nc = np.sum(w_multi_prod)
+
+        # Centroid of the weighted image from its row and column marginals
+        C_i_c = np.dot(np.sum(w_multi_prod, axis=0), col_ind) / nc
+        C_i_r = np.dot(np.sum(w_multi_prod, axis=1), row_ind) / nc
 
         C[it] = np.array([C_i_r, C_i_c])
 
@@ -137,27 +143,14 @@ def __get_reference_point(image, max_iters=100, eps=2):
             WB[it, 2] = WB[it-1, 2]
             WB[it, 3] = C[it-1][0] - C[it][0]
 
-        # Update weighting function
-        row_weight_update = np.piecewise(row_ind.astype(float), [
-            (row_ind > M - WB[it, 3])|(row_ind < WB[it, 2]) 
-        ], [
-            0.0,
-            lambda y: ((y - WB[it, 2])*(M - WB[it, 3] - y)) / (((M - WB[it, 3] - WB[it, 2]) / 2)**2)
-        ])
-
-        col_weight_update = np.piecewise(col_ind.astype(float), [
-            (col_ind > N - WB[it, 1])|(col_ind < WB[it, 0]) 
-        ], [
-            0.0,
-            lambda x: ((x - WB[it, 0])*(N - WB[it, 1] - x)) / (((N - WB[it, 1] - WB[it, 0]) / 2)**2)
-        ])
-
-        weight_dot_image_mat[it] = np.multiply(image, np.multiply(row_weight_update, col_weight_update))
+        # Update weighting function. Separable in rows and columns
+        row_weight_update = __separable_weight(M, WB[it, 2], WB[it, 3])
+        col_weight_update = __separable_weight(N, WB[it, 0], WB[it, 1])
 
-    return C[max_iters]
+        # Accumulate the new weighted image into the running product in-place
+        w_multi_prod *= np.multiply(image, np.outer(row_weight_update, col_weight_update))
 
-def __unit_flat_kernel(p_diff):
-    return 1.0 if p_diff <= 1.0 else 0.0
+    return C[max_iters - 1]
 
 def __get_surrounding_circular_points(center_point, number_directions, radius):
 
@@ -178,41 +171,67 @@ def __get_seed_point(
     stopping_criterion=FIND_SEED_POINT_STOPPING_CRITERION,
     maximum_iterations=FIND_SEED_POINT_MAXIMUM_ITERATIONS):
     
-    image_indices = np.indices(image.shape)
-
-    H_neg_sqrt = 1 / radius
-
-    flat_kernel_mask = np.vectorize(__unit_flat_kernel)
+    M, N = image.shape
 
-    # Dot product of the image with pixel indices
-    image_dot_indices = np.multiply(image, image_indices)
+    # The flat kernel is a disk of the given radius. Only evaluate it inside the disk bounding box.
+    # One extra pixel each side covers the fractional part of the (real valued) disk center
+    window_offsets = np.arange(-radius - 1, radius + 2)
 
     # Initial candidates for ROI search are circle surrounding reference reference point
-    pre_search_candidates = __get_surrounding_circular_points(
+    p = __get_surrounding_circular_points(
         reference_point, 
         number_directions, 
         radius)
 
-    post_search_candidates = np.empty(pre_search_candidates.shape)
-    max_crit = np.empty(number_directions)
-    
-    for direction in range(number_directions):
-        p = pre_search_candidates[direction].reshape(2, 1, 1)
-        for it in range(maximum_iterations):
-
-            K_h = flat_kernel_mask(np.linalg.norm(H_neg_sqrt * (image_indices - p), axis=0))
-            nc = np.sum(np.multiply(K_h, image).flatten())
-            p_new = np.sum(np.multiply(K_h, image_dot_indices), axis=(1,2)) / nc
-            
-            if np.linalg.norm(p-p_new < stopping_criterion):
-                p = p_new
-                break
-            
-            p = p_new
-        
-        max_crit[direction] = nc
-        post_search_candidates[direction] = p
-    
+    max_crit = np.zeros(number_directions)
+    active = np.ones(number_directions, dtype=bool)
+
+    # Mean shift all directions as a batch. Converged directions drop out of the batch
+    for it in range(maximum_iterations):
+        if not np.any(active):
+            break
+
+        p_active = p[active]
+
+        # (D, W) row and column coordinates of each direction's window
+        base = np.floor(p_active).astype(int)
+        rows = base[:, 0, np.newaxis] + window_offsets
+        cols = base[:, 1, np.newaxis] + window_offsets
+
+        row_distance = (rows - p_active[:, 0, np.newaxis])**2
+        col_distance = (cols - p_active[:, 1, np.newaxis])**2
+
+        # (D, W, W) disk mask restricted to the image bounds
+        K_h = (row_distance[:, :, np.newaxis] + col_distance[:, np.newaxis, :]) <= radius**2
+        K_h &= ((rows >= 0) & (rows < M))[:, :, np.newaxis]
+        K_h &= ((cols >= 0) & (cols < N))[:, np.newaxis, :]
+
+        window = image[
+            np.clip(rows, 0, M - 1)[:, :, np.newaxis],
+            np.clip(cols, 0, N - 1)[:, np.newaxis, :]]
+
+        weighted_window = np.where(K_h, window, 0.0)
+
+        nc = np.sum(weighted_window, axis=(1, 2))
+
+        # A disk with no weight cannot move. Keep the point and stop searching in that direction
+        has_weight = nc > 0
+        safe_nc = np.where(has_weight, nc, 1.0)
+
+        p_new = np.column_stack((
+            np.sum(np.sum(weighted_window, axis=2) * rows, axis=1) / safe_nc,
+            np.sum(np.sum(weighted_window, axis=1) * cols, axis=1) / safe_nc))
+        p_new[~has_weight] = p_active[~has_weight]
+
+        converged = (np.linalg.norm(p_new - p_active, axis=1) < stopping_criterion) | ~has_weight
+
+        active_indices = np.flatnonzero(active)
+        p[active_indices] = p_new
+        max_crit[active_indices] = nc
+        active[active_indices[converged]] = False
+
+    post_search_candidates = p
+
     # Point that maximizes the search criteria. Return as seed point
     seed_point = post_search_candidates[np.argmax(max_crit), :]
     
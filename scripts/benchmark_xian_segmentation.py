@@ -0,0 +1,223 @@
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import cv2
+import numpy as np
+
+# Benchmark the Xian automatic segmentation search routines against their original implementations.
+# dataset_preparation is imported from the repository root and the packages it uses (constants) from src
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [REPOSITORY_ROOT, os.path.join(REPOSITORY_ROOT, "src")]
+
+import dataset_preparation.segmentation.xianauto.automatic as automatic
+
+# Module level "private" functions are not name mangled. Look them up on the module
+gaussian_filter = getattr(automatic, "__gaussian_filter")
+linear_normalization = getattr(automatic, "__linear_normalization")
+enhance_hypoechoic_regions = getattr(automatic, "__enhance_hypoechoic_regions")
+get_reference_point = getattr(automatic, "__get_reference_point")
+get_seed_point = getattr(automatic, "__get_seed_point")
+get_surrounding_circular_points = getattr(automatic, "__get_surrounding_circular_points")
+
+
+def legacy_get_reference_point(image, max_iters=100, eps=2):
+    """Reference point search as originally written. Stores every weighted image (O(iters * pixels))
+    and recomputes the full product each iteration (O(iters^2 * pixels))"""
+    weight_dot_image_mat = np.empty((max_iters,) + image.shape)
+
+    C = np.empty((max_iters, 2))
+    WB = np.empty((max_iters, 4))
+
+    M, N = image.shape
+    ind = np.indices(image.shape)
+    row_ind = ind[0]
+    col_ind = ind[1]
+
+    weight_dot_image_mat[0] = np.multiply(np.ones(image.shape), image)
+
+    C[0] = np.array([M // 2, N // 2])
+    WB[0] = np.array([0.0, 0.0, 0.0, 0.0])
+
+    for it in range(1, max_iters):
+        w_multi_prod = np.prod(weight_dot_image_mat[:it], axis=0)
+
+        nc = np.sum(w_multi_prod.flatten())
+
+        C_i_c = np.sum(np.sum(np.multiply(col_ind, w_multi_prod).flatten() / nc))
+        C_i_r = np.sum(np.sum(np.multiply(row_ind, w_multi_prod).flatten() / nc))
+
+        C[it] = np.array([C_i_r, C_i_c])
+
+        if np.linalg.norm(C[it] - C[it-1]) < eps:
+            return C[it]
+
+        if C[it][1] - C[it-1][1] > 0:
+            WB[it, 0] = C[it][1] - C[it-1][1]
+            WB[it, 1] = WB[it-1, 1]
+        else:
+            WB[it, 0] = WB[it-1, 0]
+            WB[it, 1] = C[it-1][1] - C[it][1]
+
+        if C[it][0] - C[it-1][0] > 0:
+            WB[it, 2] = C[it][0] - C[it-1][0]
+            WB[it, 3] = WB[it-1, 3]
+        else:
+            WB[it, 2] = WB[it-1, 2]
+            WB[it, 3] = C[it-1][0] - C[it][0]
+
+        row_weight_update = np.piecewise(row_ind.astype(float), [
+            (row_ind > M - WB[it, 3]) | (row_ind < WB[it, 2])
+        ], [
+            0.0,
+            lambda y: ((y - WB[it, 2])*(M - WB[it, 3] - y)) / (((M - WB[it, 3] - WB[it, 2]) / 2)**2)
+        ])
+
+        col_weight_update = np.piecewise(col_ind.astype(float), [
+            (col_ind > N - WB[it, 1]) | (col_ind < WB[it, 0])
+        ], [
+            0.0,
+            lambda x: ((x - WB[it, 0])*(N - WB[it, 1] - x)) / (((N - WB[it, 1] - WB[it, 0]) / 2)**2)
+        ])
+
+        weight_dot_image_mat[it] = np.multiply(image, np.multiply(row_weight_update, col_weight_update))
+
+    return C[max_iters - 1]
+
+
+def legacy_get_seed_point(
+        image,
+        reference_point,
+        number_directions=12,
+        radius=12,
+        stopping_criterion=2,
+        maximum_iterations=100):
+    """Seed point search as originally written, evaluating the flat kernel with a Python call per pixel
+    over the full image. The candidate point is kept as a (2, 1, 1) column so the original does not
+    fail on broadcasting after the first iteration"""
+    image_indices = np.indices(image.shape)
+
+    H_neg_sqrt = 1 / radius
+
+    flat_kernel_mask = np.vectorize(lambda p_diff: 1.0 if p_diff <= 1.0 else 0.0)
+
+    image_dot_indices = np.multiply(image, image_indices)
+
+    pre_search_candidates = get_surrounding_circular_points(reference_point, number_directions, radius)
+
+    post_search_candidates = np.empty(pre_search_candidates.shape)
+    max_crit = np.empty(number_directions)
+
+    for direction in range(number_directions):
+        p = pre_search_candidates[direction]
+        for it in range(maximum_iterations):
+
+            K_h = flat_kernel_mask(np.linalg.norm(H_neg_sqrt * (image_indices - p.reshape(2, 1, 1)), axis=0))
+            nc = np.sum(np.multiply(K_h, image).flatten())
+            p_new = np.sum(np.multiply(K_h, image_dot_indices), axis=(1, 2)) / nc
+
+            if np.linalg.norm(p - p_new) < stopping_criterion:
+                p = p_new
+                break
+
+            p = p_new
+
+        max_crit[direction] = nc
+        post_search_candidates[direction] = p
+
+    seed_point = post_search_candidates[np.argmax(max_crit), :]
+
+    return seed_point, post_search_candidates
+
+
+def synthetic_scan_window(height, width, random_seed=0):
+    """Speckled scan window with a dark (hypoechoic) elliptical lesion"""
+    random_state = np.random.RandomState(random_seed)
+
+    image = random_state.rayleigh(scale=60, size=(height, width)).clip(0, 255).astype(np.uint8)
+
+    cv2.ellipse(
+        image,
+        (int(width * 0.55), int(height * 0.45)),
+        (width // 8, height // 10),
+        15, 0, 360, 10, -1)
+
+    return image
+
+
+def enhanced_scan_window(height, width):
+    blur = gaussian_filter(synthetic_scan_window(height, width))
+    return enhance_hypoechoic_regions(linear_normalization(blur.astype(float)))
+
+
+def peak_rss_megabytes():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_benchmark(routine, name, height, width, max_iters, eps, repeats, queue):
+    """Run in a fresh process so peak RSS is not polluted by other implementations"""
+    image = enhanced_scan_window(height, width)
+
+    if routine == "reference":
+        function = {"legacy": legacy_get_reference_point, "current": get_reference_point}[name]
+        arguments = (image,)
+        keyword_arguments = {"max_iters": max_iters, "eps": eps}
+    else:
+        function = {"legacy": legacy_get_seed_point, "current": get_seed_point}[name]
+        arguments = (image, get_reference_point(image, max_iters=max_iters, eps=eps))
+        keyword_arguments = {}
+
+    baseline_rss = peak_rss_megabytes()
+    timings = []
+
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(*arguments, **keyword_arguments)
+        timings.append(time.perf_counter() - start)
+
+    # The seed point search returns (seed_point, candidates)
+    point = result[0] if routine == "seed" else result
+
+    queue.put((name, min(timings), peak_rss_megabytes(), peak_rss_megabytes() - baseline_rss, point))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--height", type=int, default=600, help="Scan window height")
+    parser.add_argument("--width", type=int, default=800, help="Scan window width")
+    parser.add_argument("--max-iters", type=int, default=100, help="Maximum reference point iterations")
+    parser.add_argument("--eps", type=float, default=2, help="Reference point stopping criterion")
+    parser.add_argument("--repeats", type=int, default=3, help="Repeats per implementation. Best time reported")
+    parser.add_argument(
+        "--routines",
+        nargs="+",
+        choices=["reference", "seed"],
+        default=["reference", "seed"],
+        help="Search routines to benchmark")
+
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+
+    for routine in args.routines:
+        print("{0} point search | {1}x{2} | max_iters: {3} | eps: {4}".format(
+            routine.capitalize(), args.height, args.width, args.max_iters, args.eps))
+        print("{0:<10}{1:>12}{2:>16}{3:>18}  {4}".format(
+            "impl", "time (s)", "peak RSS (MB)", "RSS growth (MB)", "point"))
+
+        for name in ["legacy", "current"]:
+            process = context.Process(
+                target=run_benchmark,
+                args=(routine, name, args.height, args.width, args.max_iters, args.eps, args.repeats, queue))
+            process.start()
+            result = queue.get()
+            process.join()
+
+            print("{0:<10}{1:>12.4f}{2:>16.1f}{3:>18.1f}  {4}".format(*result))
@@ -6,6 +6,7 @@ from .affine_transformations import *
 from .dataframe_iterator import DataFrameIterator
 from .directory_iterator import DirectoryIterator
 from .image_data_generator import ImageDataGenerator
-from .iterator import Iterator
+from .iterator import Iterator, PrefetchIterator
 from .numpy_array_iterator import NumpyArrayIterator
+from .shard_iterator import ShardIterator
 from .utils import *
@@ -331,3 +331,132 @@ def apply_affine_transform(x, theta=0, tx=0, ty=0, shear=0, zx=1, zy=1,
         x = np.stack(channel_images, axis=0)
         x = np.rollaxis(x, 0, channel_axis + 1)
     return x
+
+
+def transform_matrices_offset_center(matrices, x, y):
+    """Batch version of `transform_matrix_offset_center`.
+
+    # Arguments
+        matrices: Array of shape `(n, 3, 3)`.
+        x: Image height.
+        y: Image width.
+
+    # Returns
+        Array of shape `(n, 3, 3)`, the matrices about the image center.
+    """
+    o_x = float(x) / 2 + 0.5
+    o_y = float(y) / 2 + 0.5
+    offset_matrix = np.array([[1, 0, o_x], [0, 1, o_y], [0, 0, 1]])
+    reset_matrix = np.array([[1, 0, -o_x], [0, 1, -o_y], [0, 0, 1]])
+    return np.matmul(np.matmul(offset_matrix, matrices), reset_matrix)
+
+
+def affine_transform_matrices(theta, tx, ty, shear, zx, zy):
+    """Composes the affine matrices of a batch in one vectorized operation.
+
+    Matrices are composed in the same order as by `apply_affine_transform`:
+    rotation, shift, shear and zoom.
+
+    # Arguments
+        theta: Array of rotation angles in degrees.
+        tx: Array of width shifts.
+        ty: Array of height shifts.
+        shear: Array of shear angles in degrees.
+        zx: Array of zooms in x direction.
+        zy: Array of zooms in y direction.
+
+    # Returns
+        Array of shape `(n, 3, 3)`.
+    """
+    theta = np.deg2rad(np.asarray(theta, dtype='float64'))
+    shear = np.deg2rad(np.asarray(shear, dtype='float64'))
+    n = len(theta)
+    zeros = np.zeros(n)
+    ones = np.ones(n)
+
+    def stack(rows):
+        return np.stack([np.stack(row, axis=-1) for row in rows], axis=-2)
+
+    rotation_matrices = stack([[np.cos(theta), -np.sin(theta), zeros],
+                               [np.sin(theta), np.cos(theta), zeros],
+                               [zeros, zeros, ones]])
+    shift_matrices = stack([[ones, zeros, np.asarray(tx, dtype='float64')],
+                            [zeros, ones, np.asarray(ty, dtype='float64')],
+                            [zeros, zeros, ones]])
+    shear_matrices = stack([[ones, -np.sin(shear), zeros],
+                            [zeros, np.cos(shear), zeros],
+                            [zeros, zeros, ones]])
+    zoom_matrices = stack([[np.asarray(zx, dtype='float64'), zeros, zeros],
+                           [zeros, np.asarray(zy, dtype='float64'), zeros],
+                           [zeros, zeros, ones]])
+    return np.matmul(np.matmul(np.matmul(rotation_matrices, shift_matrices),
+                               shear_matrices),
+                     zoom_matrices)
+
+
+def apply_affine_transform_batch(x, theta, tx, ty, shear, zx, zy,
+                                 row_axis=1, col_axis=2, channel_axis=3,
+                                 fill_mode='nearest', cval=0., order=1):
+    """Applies per-image affine transformations to a batch of images.
+
+    All matrices are composed at once and images with an identity
+    transformation are not resampled. The result is identical to calling
+    `apply_affine_transform` on every image.
+
+    # Arguments
+        x: 4D numpy array, batch of images.
+        theta: Array of rotation angles in degrees, one per image.
+        tx: Array of width shifts.
+        ty: Array of height shifts.
+        shear: Array of shear angles in degrees.
+        zx: Array of zooms in x direction.
+        zy: Array of zooms in y direction.
+        row_axis: Index of axis for rows in the input batch.
+        col_axis: Index of axis for columns in the input batch.
+        channel_axis: Index of axis for channels in the input batch.
+        fill_mode: Points outside the boundaries of the input
+            are filled according to the given mode
+            (one of `{'constant', 'nearest', 'reflect', 'wrap'}`).
+        cval: Value used for points outside the boundaries
+            of the input if `mode='constant'`.
+        order int: order of interpolation
+
+    # Returns
+        The transformed version of the input batch.
+    """
+    if scipy is None:
+        raise ImportError('Image transformations require SciPy. '
+                          'Install SciPy.')
+    theta, tx, ty, shear, zx, zy = [
+        np.asarray(p, dtype='float64') for p in (theta, tx, ty, shear, zx, zy)]
+    transformed = ((theta != 0) | (tx != 0) | (ty != 0) | (shear != 0) |
+                   (zx != 1) | (zy != 1))
+    if not np.any(transformed):
+        return x
+
+    h, w = x.shape[row_axis], x.shape[col_axis]
+    indices = np.flatnonzero(transformed)
+    transform_matrices = transform_matrices_offset_center(
+        affine_transform_matrices(theta[indices], tx[indices], ty[indices],
+                                  shear[indices], zx[indices], zy[indices]),
+        h, w)
+
+    # Channels are warped as contiguous (rows, columns) arrays, straight
+    # into a contiguous channels-first output batch
+    x = np.moveaxis(x, (channel_axis, row_axis, col_axis), (1, 2, 3))
+    transformed_x = np.ascontiguousarray(x)
+    if transformed_x is x:
+        transformed_x = x.copy()
+    x = np.ascontiguousarray(x[indices])
+    for k, (i, transform_matrix) in enumerate(zip(indices, transform_matrices)):
+        for c in range(x.shape[1]):
+            ndimage.interpolation.affine_transform(
+                x[k, c],
+                transform_matrix[:2, :2],
+                transform_matrix[:2, 2],
+                output=transformed_x[i, c],
+                order=order,
+                mode=fill_mode,
+                cval=cval)
+    return np.ascontiguousarray(
+        np.moveaxis(transformed_x, (1, 2, 3), (channel_axis, row_axis, col_axis)))
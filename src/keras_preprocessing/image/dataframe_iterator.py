@@ -9,7 +9,7 @@ import warnings
 
 import numpy as np
 
-from .iterator import BatchFromFilesMixin, Iterator
+from .iterator import BatchFromFilesMixin, Iterator, check_image_dtype
 from .utils import get_extension
 
 
@@ -80,6 +80,12 @@ class DataFrameIterator(BatchFromFilesMixin, Iterator):
             supported. If PIL version 3.4.0 or newer is installed, "box" and
             "hamming" are also supported. By default, "nearest" is used.
         drop_duplicates: Boolean, whether to drop duplicate rows based on filename.
+        num_threads: Optional number of threads loading and transforming the
+            images of a batch concurrently. By default, images are processed
+            serially.
+        image_dtype: Optional dtype of the generated images. Default: `dtype`.
+            With an integer dtype (e.g. `"uint8"`), images are only flipped
+            and not normalized. See `ImageDataGenerator.finalize_batch`.
     """
     allowed_class_modes = {
         'categorical', 'binary', 'sparse', 'input', 'other', None
@@ -106,7 +112,9 @@ class DataFrameIterator(BatchFromFilesMixin, Iterator):
                  subset=None,
                  interpolation='nearest',
                  dtype='float32',
-                 drop_duplicates=True):
+                 drop_duplicates=True,
+                 num_threads=None,
+                 image_dtype=None):
 
         super(DataFrameIterator, self).set_processing_attrs(image_data_generator,
                                                             target_size,
@@ -116,11 +124,14 @@ class DataFrameIterator(BatchFromFilesMixin, Iterator):
                                                             save_prefix,
                                                             save_format,
                                                             subset,
-                                                            interpolation)
+                                                            interpolation,
+                                                            num_threads)
         df = dataframe.copy()
         self.directory = directory
         self.class_mode = class_mode
         self.dtype = dtype
+        self.image_dtype = dtype if image_dtype is None else image_dtype
+        check_image_dtype(image_data_generator, self.image_dtype)
         # check that inputs match the required class_mode
         self._check_params(df, x_col, y_col, weight_col, classes)
         if drop_duplicates:
@@ -97,6 +97,7 @@ class DirectoryIterator(BatchFromFilesMixin, Iterator):
                              .format(class_mode, self.allowed_class_modes))
         self.class_mode = class_mode
         self.dtype = dtype
+        self.image_dtype = dtype
         # First, count the number of samples and classes.
         self.samples = 0
 
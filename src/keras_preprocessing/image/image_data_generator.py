@@ -8,23 +8,31 @@ import warnings
 from six.moves import range
 
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 
 try:
     import scipy
     # scipy.linalg cannot be accessed until explicitly imported
     from scipy import linalg
     # scipy.ndimage cannot be accessed until explicitly imported
+    from scipy import ndimage
 except ImportError:
     scipy = None
 
 from .dataframe_iterator import DataFrameIterator
 from .directory_iterator import DirectoryIterator
 from .numpy_array_iterator import NumpyArrayIterator
+from .shard_iterator import ShardIterator
 from .affine_transformations import (apply_affine_transform,
+                                     apply_affine_transform_batch,
                                      apply_brightness_shift,
                                      apply_channel_shift,
                                      flip_axis)
 
+# Largest ZCA input size (H * W * C) for which `fit_from_iterator` forms the
+# covariance even with `zca_rank`. Two such float64 matrices are held (256MB)
+ZCA_EXACT_MAX_FEATURES = 4096
+
 
 class ImageDataGenerator(object):
     """Generate batches of tensor image data with real-time data augmentation.
@@ -101,6 +109,26 @@ class ImageDataGenerator(object):
         validation_split: Float. Fraction of images reserved for validation
             (strictly between 0 and 1).
         dtype: Dtype to use for the generated arrays.
+        zca_rank: Int or None. Keep only the `zca_rank` principal
+            components of largest variance for ZCA whitening. Images are
+            whitened with two thin matrix products instead of one
+            `(H * W * C) ** 2` matrix. Default: None (all components).
+            `fit` finds the components exactly. `fit_from_iterator` does
+            too if `H * W * C` is at most `ZCA_EXACT_MAX_FEATURES`. For
+            larger images it approximates them with a randomized range
+            finder (`zca_rank + 10` columns, `zca_power_iterations` power
+            iterations). The approximation is close when the variance of
+            the components decays quickly beyond `zca_rank`. When it decays
+            slowly, the components found, and so the whitening, can differ
+            from `fit`. More power iterations reduce the difference.
+        zca_power_iterations: Int. Number of power iterations of the
+            randomized range finder of `fit_from_iterator` with `zca_rank`.
+            Each costs one pass over the iterator. Default: 2.
+        zca_patch_size: Tuple of two odd integers or None. Fit ZCA
+            whitening on image patches of this size instead of on whole
+            images. Images are whitened by correlation with the resulting
+            `(patch rows, patch columns)` filters, so any image size can be
+            whitened. Default: None (whole images).
 
     # Examples
     Example of using `.flow(x, y)`:
@@ -272,7 +300,10 @@ class ImageDataGenerator(object):
                  data_format='channels_last',
                  validation_split=0.0,
                  interpolation_order=1,
-                 dtype='float32'):
+                 dtype='float32',
+                 zca_rank=None,
+                 zca_patch_size=None,
+                 zca_power_iterations=2):
 
         self.featurewise_center = featurewise_center
         self.samplewise_center = samplewise_center
@@ -280,6 +311,8 @@ class ImageDataGenerator(object):
         self.samplewise_std_normalization = samplewise_std_normalization
         self.zca_whitening = zca_whitening
         self.zca_epsilon = zca_epsilon
+        self.zca_rank = zca_rank
+        self.zca_power_iterations = zca_power_iterations
         self.rotation_range = rotation_range
         self.width_shift_range = width_shift_range
         self.height_shift_range = height_shift_range
@@ -319,6 +352,8 @@ class ImageDataGenerator(object):
         self.mean = None
         self.std = None
         self.principal_components = None
+        # Basis the whitened components are mapped back with, if `zca_rank`
+        self.principal_axes = None
 
         if np.isscalar(zoom_range):
             self.zoom_range = [1 - zoom_range, 1 + zoom_range]
@@ -361,6 +396,46 @@ class ImageDataGenerator(object):
                     '`brightness_range should be tuple or list of two floats. '
                     'Received: %s' % (brightness_range,))
         self.brightness_range = brightness_range
+        if zca_patch_size is not None:
+            if (len(zca_patch_size) != 2 or
+                    any(size % 2 == 0 for size in zca_patch_size)):
+                raise ValueError(
+                    '`zca_patch_size` should be a tuple or list of two odd '
+                    'integers. Received: %s' % (zca_patch_size,))
+            zca_patch_size = tuple(zca_patch_size)
+        self.zca_patch_size = zca_patch_size
+
+        self._compile_transform_plan()
+
+    def _compile_transform_plan(self):
+        """Specialises batch transformations to the configuration.
+
+        The plan is compiled once at construction, so the configuration
+        should not be changed afterwards. Batches are identical to the
+        batches of the general path for the same seed:
+        - If no affine, channel or brightness augmentation is configured,
+            only the flips of a batch are drawn, in one call to the random
+            generator. Batches are then only flipped.
+        - If normalization is limited to `rescale`, batches are rescaled
+            with a single in-place multiplication.
+        """
+        def disabled(value):
+            return np.isscalar(value) and value == 0
+
+        self._flip_only = (disabled(self.rotation_range) and
+                           disabled(self.width_shift_range) and
+                           disabled(self.height_shift_range) and
+                           disabled(self.shear_range) and
+                           self.zoom_range[0] == 1 and
+                           self.zoom_range[1] == 1 and
+                           disabled(self.channel_shift_range) and
+                           self.brightness_range is None)
+        self._rescale_only = not (self.preprocessing_function or
+                                  self.samplewise_center or
+                                  self.samplewise_std_normalization or
+                                  self.featurewise_center or
+                                  self.featurewise_std_normalization or
+                                  self.zca_whitening)
 
     def flow(self,
              x,
@@ -557,6 +632,8 @@ class ImageDataGenerator(object):
                             subset=None,
                             interpolation='nearest',
                             drop_duplicates=True,
+                            num_threads=None,
+                            image_dtype=None,
                             **kwargs):
         """Takes the dataframe and the path to a directory
          and generates batches of augmented/normalized data.
@@ -632,6 +709,12 @@ class ImageDataGenerator(object):
                 `"hamming"` are also supported. By default, `"nearest"` is used.
             drop_duplicates: Boolean, whether to drop duplicate rows
                 based on filename.
+            num_threads: Optional number of threads loading and transforming
+                the images of a batch concurrently. By default, images are
+                processed serially.
+            image_dtype: Optional dtype of the generated images, e.g.
+                `"uint8"`. Default: `dtype`. Integer images are only flipped
+                and are normalized later by `finalize_batch`.
 
         # Returns
             A `DataFrameIterator` yielding tuples of `(x, y)`
@@ -667,7 +750,67 @@ class ImageDataGenerator(object):
             save_format=save_format,
             subset=subset,
             interpolation=interpolation,
-            drop_duplicates=drop_duplicates
+            dtype=self.dtype,
+            drop_duplicates=drop_duplicates,
+            num_threads=num_threads,
+            image_dtype=image_dtype
+        )
+
+    def flow_from_shards(self,
+                         directory,
+                         class_mode='categorical',
+                         batch_size=32,
+                         shuffle=True,
+                         seed=None,
+                         save_to_dir=None,
+                         save_prefix='',
+                         save_format='png',
+                         image_dtype=None):
+        """Takes the path to a compiled dataset directory,
+         and generates batches of augmented/normalized data.
+
+        The dataset is compiled once from a dataframe with
+        `utilities.dataset.dataset.compile_dataset`. Images are read from
+        memory-mapped shards instead of being decoded and resized every epoch.
+
+        # Arguments
+            directory: string, path to the compiled dataset directory.
+            class_mode: one of "binary", "categorical", "sparse" or None.
+                Default: "categorical". See `flow_from_dataframe`.
+            batch_size: size of the batches of data (default: 32).
+            shuffle: whether to shuffle the data (default: True)
+            seed: optional random seed for shuffling and transformations.
+            save_to_dir: None or str (default: None).
+                This allows you to optionally specify a directory
+                to which to save the augmented pictures being generated
+                (useful for visualizing what you are doing).
+            save_prefix: str. Prefix to use for filenames of saved pictures
+                (only relevant if `save_to_dir` is set).
+            save_format: one of "png", "jpeg"
+                (only relevant if `save_to_dir` is set). Default: "png".
+            image_dtype: Optional dtype of the generated images, e.g.
+                `"uint8"`. Default: `dtype`. Integer images are only flipped
+                and are normalized later by `finalize_batch`.
+
+        # Returns
+            A `ShardIterator` yielding tuples of `(x, y)`
+            where `x` is a numpy array containing a batch
+            of images with shape `(batch_size, *target_size, channels)`
+            and `y` is a numpy array of corresponding labels.
+        """
+        return ShardIterator(
+            directory,
+            self,
+            class_mode=class_mode,
+            batch_size=batch_size,
+            shuffle=shuffle,
+            seed=seed,
+            data_format=self.data_format,
+            save_to_dir=save_to_dir,
+            save_prefix=save_prefix,
+            save_format=save_format,
+            dtype=self.dtype,
+            image_dtype=image_dtype
         )
 
     def standardize(self, x):
@@ -715,9 +858,17 @@ class ImageDataGenerator(object):
                               'first by calling `.fit(numpy_data)`.')
         if self.zca_whitening:
             if self.principal_components is not None:
-                flatx = np.reshape(x, (-1, np.prod(x.shape[-3:])))
-                whitex = np.dot(flatx, self.principal_components)
-                x = np.reshape(whitex, x.shape)
+                if self.zca_patch_size is not None:
+                    x = self._whiten_patches(x)
+                elif self.principal_axes is not None:
+                    flatx = np.reshape(x, (-1, np.prod(x.shape[-3:])))
+                    whitex = np.dot(np.dot(flatx, self.principal_components),
+                                    self.principal_axes.T)
+                    x = np.reshape(whitex, x.shape)
+                else:
+                    flatx = np.reshape(x, (-1, np.prod(x.shape[-3:])))
+                    whitex = np.dot(flatx, self.principal_components)
+                    x = np.reshape(whitex, x.shape)
             else:
                 warnings.warn('This ImageDataGenerator specifies '
                               '`zca_whitening`, but it hasn\'t '
@@ -725,6 +876,127 @@ class ImageDataGenerator(object):
                               'first by calling `.fit(numpy_data)`.')
         return x
 
+    def _whiten_patches(self, x):
+        """Correlates an image, or a batch, with the patch ZCA filters."""
+        channel_axis = self.channel_axis - 4 + x.ndim
+        x = np.moveaxis(x, channel_axis, -1)
+        whitex = np.zeros_like(x)
+        filters = self.principal_components
+        for o in range(filters.shape[0]):
+            for i in range(filters.shape[-1]):
+                weights = np.reshape(filters[o, :, :, i],
+                                     (1,) * (x.ndim - 3) + self.zca_patch_size)
+                whitex[..., o] += ndimage.correlate(x[..., i], weights,
+                                                    mode='reflect')
+        return np.moveaxis(whitex, -1, channel_axis)
+
+    def _patches(self, x):
+        """All patches of size `zca_patch_size` of a batch.
+
+        # Arguments
+            x: Batch of images.
+
+        # Returns
+            2D array with one patch per row. Patch values are ordered as
+            (patch rows, patch columns, channels).
+        """
+        x = np.ascontiguousarray(np.moveaxis(x, self.channel_axis, -1))
+        n, h, w, c = x.shape
+        patch_rows, patch_cols = self.zca_patch_size
+        windows = as_strided(
+            x,
+            shape=(n, h - patch_rows + 1, w - patch_cols + 1,
+                   patch_rows, patch_cols, c),
+            strides=x.strides[:3] + x.strides[1:],
+            writeable=False)
+        return np.reshape(windows, (-1, patch_rows * patch_cols * c))
+
+    def _zca_channel_vector(self, channel_values, image_shape):
+        """Per-channel values laid out like a row of ZCA input."""
+        if self.zca_patch_size is not None:
+            return np.tile(channel_values, np.prod(self.zca_patch_size))
+        broadcast_shape = [1, 1, 1]
+        broadcast_shape[self.channel_axis - 1] = len(channel_values)
+        return np.reshape(
+            np.broadcast_to(np.reshape(channel_values, broadcast_shape),
+                            image_shape), -1)
+
+    def _set_principal_components(self, s, u):
+        """Sets the ZCA whitening from an eigendecomposition of the
+        covariance.
+
+        # Arguments
+            s: Eigenvalues, in any order.
+            u: Eigenvectors, as columns.
+        """
+        order = np.argsort(s)[::-1]
+        if self.zca_rank is not None:
+            order = order[:self.zca_rank]
+        u = u[:, order]
+        scales = 1. / np.sqrt(np.clip(s[order], 0, None) + self.zca_epsilon)
+        if self.zca_rank is not None and self.zca_patch_size is None:
+            self.principal_components = (u * scales).astype(self.dtype)
+            self.principal_axes = u.astype(self.dtype)
+            return
+        components = (u * scales).dot(u.T)
+        if self.zca_patch_size is None:
+            self.principal_components = components.astype(self.dtype)
+            return
+        # Rows whitening the channels of the center pixel of a patch
+        patch_rows, patch_cols = self.zca_patch_size
+        channels = len(components) // (patch_rows * patch_cols)
+        center = ((patch_rows // 2) * patch_cols + patch_cols // 2) * channels
+        self.principal_components = np.reshape(
+            components[center:center + channels],
+            (channels, patch_rows, patch_cols, channels)).astype(self.dtype)
+
+    def standardize_batch(self, x):
+        """Applies the normalization configuration in-place to every image
+        of a batch.
+
+        The result is identical to calling `standardize` on every image.
+        Batches of an integer dtype are returned unchanged, their
+        normalization is deferred to `finalize_batch`.
+
+        # Arguments
+            x: Batch of images.
+
+        # Returns
+            The images, normalized.
+        """
+        if np.issubdtype(x.dtype, np.integer):
+            return x
+        if self._rescale_only:
+            if self.rescale:
+                x *= self.rescale
+            return x
+        for i in range(len(x)):
+            x[i] = self.standardize(x[i])
+        return x
+
+    def finalize_batch(self, x):
+        """Converts a batch of integer images to `dtype` and normalizes it.
+
+        Iterators with an integer `image_dtype` keep batches as integers
+        through loading, flipping and cropping, which reduces the memory
+        and the transfer between worker processes by the size ratio of the
+        dtypes. The conversion and normalization are deferred to this call,
+        the last step before the batch is consumed. Per-pixel
+        normalization (`rescale`, featurewise center and std) commutes
+        with flips and crops, so the result is identical to normalizing
+        first. Batches of a floating point dtype were normalized by the
+        iterator and are returned unchanged.
+
+        # Arguments
+            x: Batch of images.
+
+        # Returns
+            The images as `dtype`, normalized.
+        """
+        if not np.issubdtype(x.dtype, np.integer):
+            return x
+        return self.standardize_batch(x.astype(self.dtype))
+
     def get_random_transform(self, img_shape, seed=None):
         """Generates random parameters for a transformation.
 
@@ -885,6 +1157,158 @@ class ImageDataGenerator(object):
         params = self.get_random_transform(x.shape, seed)
         return self.apply_transform(x, params)
 
+    def get_random_transform_batch(self, batch_shape, seed=None):
+        """Generates random parameters for the transformation of a batch.
+
+        Parameters are drawn image by image with `get_random_transform`, so
+        for the same seed they are identical to the parameters of a loop
+        over the batch.
+
+        # Arguments
+            batch_shape: Tuple of integers.
+                Shape of the batch that is transformed.
+            seed: Random seed.
+
+        # Returns
+            A dictionary containing, for every parameter of
+            `get_random_transform`, an array with one value per image.
+            `'channel_shift_intensity'` and `'brightness'` are None if
+            the corresponding augmentation is disabled.
+        """
+        if self._flip_only:
+            return self._get_random_flip_batch(batch_shape, seed)
+        params = [self.get_random_transform(batch_shape[1:],
+                                            seed if i == 0 else None)
+                  for i in range(batch_shape[0])]
+        transform_parameters = {}
+        for key in ['theta', 'tx', 'ty', 'shear', 'zx', 'zy']:
+            transform_parameters[key] = np.array(
+                [p[key] for p in params], dtype='float64').reshape(-1)
+        for key in ['flip_horizontal', 'flip_vertical']:
+            transform_parameters[key] = np.array(
+                [p[key] for p in params], dtype=bool).reshape(-1)
+        for key in ['channel_shift_intensity', 'brightness']:
+            if params and params[0][key] is not None:
+                transform_parameters[key] = np.array([p[key] for p in params])
+            else:
+                transform_parameters[key] = None
+        return transform_parameters
+
+    def _get_random_flip_batch(self, batch_shape, seed=None):
+        """`get_random_transform_batch` of a flip-only configuration.
+
+        `get_random_transform` draws exactly two uniform numbers per image,
+        the horizontal and the vertical flip, so the flips of a batch are
+        drawn at once from the same random sequence.
+        """
+        if seed is not None:
+            np.random.seed(seed)
+        n = batch_shape[0]
+        flips = np.random.random((n, 2)) < 0.5
+        return {'theta': np.zeros(n),
+                'tx': np.zeros(n),
+                'ty': np.zeros(n),
+                'shear': np.zeros(n),
+                'zx': np.ones(n),
+                'zy': np.ones(n),
+                'flip_horizontal': flips[:, 0] & bool(self.horizontal_flip),
+                'flip_vertical': flips[:, 1] & bool(self.vertical_flip),
+                'channel_shift_intensity': None,
+                'brightness': None}
+
+    def apply_transform_batch(self, x, transform_parameters):
+        """Applies per-image transformations to a batch of images.
+
+        The result is identical to calling `apply_transform` on every image,
+        but the affine matrices are composed for the whole batch, images
+        without an affine transformation are not resampled and flipped
+        images are copied once. `x` is not modified.
+
+        # Arguments
+            x: 4D tensor, batch of images.
+            transform_parameters: Dictionary with string - parameter pairs
+                describing the transformation of every image, as returned
+                by `get_random_transform_batch`. Values are arrays with one
+                entry per image. Missing parameters are not applied.
+
+        # Returns
+            A transformed version of the input (same shape).
+        """
+        n = len(x)
+
+        def parameter(key, default):
+            value = transform_parameters.get(key, default)
+            return np.broadcast_to(np.asarray(value), (n,))
+
+        img_channel_axis = self.channel_axis - 1
+        transformed_x = apply_affine_transform_batch(
+            x,
+            parameter('theta', 0),
+            parameter('tx', 0),
+            parameter('ty', 0),
+            parameter('shear', 0),
+            parameter('zx', 1),
+            parameter('zy', 1),
+            row_axis=self.row_axis,
+            col_axis=self.col_axis,
+            channel_axis=self.channel_axis,
+            fill_mode=self.fill_mode,
+            cval=self.cval,
+            order=self.interpolation_order)
+
+        channel_shift_intensity = transform_parameters.get('channel_shift_intensity')
+        brightness = transform_parameters.get('brightness')
+        flip_horizontal = parameter('flip_horizontal', False)
+        flip_vertical = parameter('flip_vertical', False)
+
+        if channel_shift_intensity is not None:
+            if transformed_x is x:
+                transformed_x = np.array(x, copy=True)
+            for i in range(n):
+                # As a Python float the shift keeps the precision of `x`
+                transformed_x[i] = apply_channel_shift(transformed_x[i],
+                                                       float(channel_shift_intensity[i]),
+                                                       img_channel_axis)
+
+        if np.any(flip_horizontal) or np.any(flip_vertical):
+            # Flipped images are copied as reversed views in a single pass.
+            # Other images are only copied if `x` would be returned
+            source_x = transformed_x
+            if transformed_x is x:
+                transformed_x = np.empty_like(x)
+                flipped = range(n)
+            else:
+                flipped = np.flatnonzero(flip_horizontal | flip_vertical)
+            for i in flipped:
+                image = source_x[i]
+                if flip_horizontal[i]:
+                    image = np.flip(image, self.col_axis - 1)
+                if flip_vertical[i]:
+                    image = np.flip(image, self.row_axis - 1)
+                transformed_x[i] = image
+
+        if brightness is not None:
+            if transformed_x is x:
+                transformed_x = np.array(x, copy=True)
+            for i in range(n):
+                transformed_x[i] = apply_brightness_shift(transformed_x[i],
+                                                          float(brightness[i]))
+
+        return transformed_x
+
+    def random_transform_batch(self, x, seed=None):
+        """Applies a random transformation to every image of a batch.
+
+        # Arguments
+            x: 4D tensor, batch of images.
+            seed: Random seed.
+
+        # Returns
+            A randomly transformed version of the input (same shape).
+        """
+        params = self.get_random_transform_batch(x.shape, seed)
+        return self.apply_transform_batch(x, params)
+
     def fit(self, x,
             augment=False,
             rounds=1,
@@ -957,9 +1381,205 @@ class ImageDataGenerator(object):
             if scipy is None:
                 raise ImportError('Using zca_whitening requires SciPy. '
                                   'Install SciPy.')
-            flat_x = np.reshape(
-                x, (x.shape[0], x.shape[1] * x.shape[2] * x.shape[3]))
-            sigma = np.dot(flat_x.T, flat_x) / flat_x.shape[0]
-            u, s, _ = linalg.svd(sigma)
-            s_inv = 1. / np.sqrt(s[np.newaxis] + self.zca_epsilon)
-            self.principal_components = (u * s_inv).dot(u.T)
+            if self.zca_patch_size is not None:
+                # Image by image, all patches of a batch may not fit in memory
+                sigma = 0.
+                patches = 0
+                for i in range(len(x)):
+                    flat_x = self._patches(x[i:i + 1])
+                    sigma = sigma + np.dot(flat_x.T, flat_x)
+                    patches += len(flat_x)
+                s, u = linalg.eigh(sigma / patches)
+                self._set_principal_components(s, u)
+            elif self.zca_rank is not None:
+                # Right singular vectors of the data are the eigenvectors
+                # of its covariance, without forming the covariance
+                flat_x = np.reshape(x, (x.shape[0], -1))
+                _, s, vt = linalg.svd(flat_x, full_matrices=False)
+                self._set_principal_components(s ** 2 / flat_x.shape[0], vt.T)
+            else:
+                flat_x = np.reshape(
+                    x, (x.shape[0], x.shape[1] * x.shape[2] * x.shape[3]))
+                sigma = np.dot(flat_x.T, flat_x) / flat_x.shape[0]
+                u, s, _ = linalg.svd(sigma)
+                s_inv = 1. / np.sqrt(s[np.newaxis] + self.zca_epsilon)
+                self.principal_components = (u * s_inv).dot(u.T)
+
+    def _iterate_batches(self, iterator, rounds):
+        """Batches of images of `rounds` passes over an iterator, as float64."""
+        for _ in range(rounds):
+            for i in range(len(iterator)):
+                x = iterator[i]
+                if isinstance(x, tuple):
+                    x = x[0]
+                yield np.asarray(x, dtype='float64')
+            iterator.on_epoch_end()
+
+    def _zca_rows(self, x):
+        """Rows of ZCA input of a batch: images, or patches image by image."""
+        if self.zca_patch_size is None:
+            yield np.reshape(x, (len(x), -1))
+        else:
+            for i in range(len(x)):
+                yield self._patches(x[i:i + 1])
+
+    def fit_from_iterator(self, iterator, rounds=1):
+        """Fits the data generator to the batches of an iterator.
+
+        Computes the same statistics as `fit`, without holding the sample
+        data in memory. Means, variances and, with `zca_whitening`, the
+        covariance matrix are accumulated batch by batch with pairwise
+        (Welford) updates. Memory is bounded by one batch plus, with
+        `zca_whitening`, two matrices of size `(H * W * C) ** 2`.
+
+        With `zca_patch_size`, the covariance is that of the patches, so
+        its size is `(patch rows * patch columns * C) ** 2`. With
+        `zca_rank` on whole images larger than `ZCA_EXACT_MAX_FEATURES`,
+        the covariance is never formed: the top components are approximated
+        with a randomized range finder, in `zca_power_iterations + 2`
+        passes over the iterator, with memory bounded by
+        `(H * W * C) * (zca_rank + 10)` values. See `zca_rank`.
+
+        # Arguments
+            iterator: Iterator yielding batches of images, or tuples whose
+                first element is a batch of images, e.g. a
+                `DataFrameIterator`. Statistics are computed on the batches
+                as yielded, so the iterator should apply `rescale` and any
+                augmentation, but no featurewise normalization.
+            rounds: Int (default: 1).
+                Number of passes over the iterator, e.g. to fit on several
+                randomly augmented versions of every sample.
+        """
+        if self.zca_whitening and scipy is None:
+            raise ImportError('Using zca_whitening requires SciPy. '
+                              'Install SciPy.')
+        randomized = False
+        samples = 0
+        rows = 0
+        image_shape = None
+        channel_mean = channel_m2 = None
+        feature_mean = feature_m2 = None
+        feature_sum = sketch = basis = None
+
+        for x in self._iterate_batches(iterator, rounds):
+            if image_shape is None:
+                image_shape = x.shape[1:]
+                channels = x.shape[self.channel_axis]
+                channel_mean = np.zeros(channels)
+                channel_m2 = np.zeros(channels)
+                if self.zca_patch_size is not None:
+                    features = int(np.prod(self.zca_patch_size)) * channels
+                else:
+                    features = int(np.prod(image_shape))
+                randomized = (self.zca_whitening and
+                              self.zca_rank is not None and
+                              self.zca_patch_size is None and
+                              features > ZCA_EXACT_MAX_FEATURES)
+                if randomized:
+                    # Fixed random basis, so that fitting is deterministic
+                    basis = np.random.RandomState(0).standard_normal(
+                        (features, min(self.zca_rank + 10, features)))
+                    feature_sum = np.zeros(features)
+                    sketch = np.zeros(basis.shape)
+                elif self.zca_whitening:
+                    feature_mean = np.zeros(features)
+                    # Fortran order so that BLAS updates it in-place.
+                    # Only the upper triangle is accumulated
+                    feature_m2 = np.zeros((features, features), order='F')
+            elif x.shape[1:] != image_shape:
+                raise ValueError('All batches should have images of shape ' +
+                                 str(image_shape) + '. Got a batch with shape ' +
+                                 str(x.shape))
+
+            # Per channel, over all pixels of all images
+            pixels = samples * x.size // (len(x) * channels)
+            batch_pixels = x.size // channels
+            axis = (0, self.row_axis, self.col_axis)
+            batch_mean = np.mean(x, axis=axis)
+            broadcast_shape = [1, 1, 1, 1]
+            broadcast_shape[self.channel_axis] = channels
+            batch_m2 = np.sum(
+                (x - np.reshape(batch_mean, broadcast_shape)) ** 2, axis=axis)
+            delta = batch_mean - channel_mean
+            total = pixels + batch_pixels
+            channel_mean += delta * batch_pixels / total
+            channel_m2 += batch_m2 + delta ** 2 * pixels * batch_pixels / total
+
+            # Per feature, over all rows of ZCA input
+            if self.zca_whitening:
+                for flat_x in self._zca_rows(x):
+                    if randomized:
+                        feature_sum += np.sum(flat_x, axis=0)
+                        sketch += np.dot(flat_x.T, np.dot(flat_x, basis))
+                    else:
+                        batch_mean = np.mean(flat_x, axis=0)
+                        # Not in-place, the rows may be a view of the
+                        # batch of the iterator
+                        flat_x = flat_x - batch_mean
+                        delta = batch_mean - feature_mean
+                        total = rows + len(flat_x)
+                        feature_m2 = linalg.blas.dsyrk(
+                            1., flat_x, beta=1., c=feature_m2, trans=1,
+                            overwrite_c=1)
+                        feature_m2 = linalg.blas.dsyr(
+                            float(rows) * len(flat_x) / total, delta,
+                            a=feature_m2, overwrite_a=1)
+                        feature_mean += delta * len(flat_x) / total
+                    rows += len(flat_x)
+
+            samples += len(x)
+
+        if not samples:
+            raise ValueError('The iterator passed to `.fit_from_iterator()` '
+                             'yielded no samples.')
+
+        broadcast_shape = [1, 1, 1]
+        broadcast_shape[self.channel_axis - 1] = channels
+        if self.featurewise_center:
+            self.mean = np.reshape(channel_mean, broadcast_shape).astype(self.dtype)
+
+        if self.featurewise_std_normalization:
+            pixels = samples * int(np.prod(image_shape)) // channels
+            self.std = np.reshape(np.sqrt(channel_m2 / pixels),
+                                  broadcast_shape).astype(self.dtype)
+
+        if not self.zca_whitening:
+            return
+
+        # Covariance about the channel means subtracted by `standardize`
+        channel_vector = self._zca_channel_vector(channel_mean, image_shape)
+
+        if randomized:
+            def covariance_product(sketch, basis):
+                # sum((x - m)(x - m)^T) basis from sum(x x^T basis)
+                return (sketch -
+                        np.outer(feature_sum, np.dot(channel_vector, basis)) -
+                        np.outer(channel_vector, np.dot(feature_sum, basis)) +
+                        rows * np.outer(channel_vector,
+                                        np.dot(channel_vector, basis))) / rows
+
+            # Power iterations, then the projection on the range found
+            for _ in range(self.zca_power_iterations + 1):
+                basis, _ = linalg.qr(covariance_product(sketch, basis),
+                                     mode='economic')
+                sketch = np.zeros(basis.shape)
+                for x in self._iterate_batches(iterator, rounds):
+                    for flat_x in self._zca_rows(x):
+                        sketch += np.dot(flat_x.T, np.dot(flat_x, basis))
+            s, v = linalg.eigh(np.dot(basis.T, covariance_product(sketch, basis)))
+            self._set_principal_components(s, np.dot(basis, v))
+            return
+
+        centered_mean = feature_mean - channel_vector
+        sigma = linalg.blas.dsyr(float(rows), centered_mean,
+                                 a=feature_m2, overwrite_a=1)
+        sigma /= rows
+        s, u = linalg.eigh(sigma, lower=False, overwrite_a=True,
+                           check_finite=False)
+        del sigma, feature_m2
+        if self.zca_patch_size is not None or self.zca_rank is not None:
+            self._set_principal_components(s, u)
+        else:
+            # u * s_inv ** 0.5 times its transpose is (u * s_inv).dot(u.T)
+            u *= 1. / np.sqrt(np.sqrt(np.clip(s, 0, None) + self.zca_epsilon))
+            self.principal_components = u.dot(u.T).astype(self.dtype)
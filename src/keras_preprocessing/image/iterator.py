@@ -4,9 +4,17 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import multiprocessing
 import os
 import threading
 import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+from six.moves import queue
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
 from keras_preprocessing import get_keras_submodule
 
 try:
@@ -15,8 +23,52 @@ except ImportError:
     IteratorType = object
 
 from .utils import (array_to_img,
-                    img_to_array,
-                    load_img)
+                    load_img_array)
+
+# Serializes seeded random draws of prefetcher threads, which share the
+# global numpy random state
+_random_lock = threading.Lock()
+
+# Shared memory segments of closed prefetchers that are still referenced
+# by yielded batches
+_pending_segments = []
+
+
+def _release_segments(segments):
+    """Unmaps shared memory segments that are no longer referenced.
+
+    Referenced segments are kept, and released by a later call.
+    """
+    pending = _pending_segments + list(segments)
+    del _pending_segments[:]
+    for segment in pending:
+        try:
+            segment.close()
+        except BufferError:
+            _pending_segments.append(segment)
+
+
+def check_image_dtype(image_data_generator, image_dtype):
+    """Checks that batches of `image_dtype` can be transformed.
+
+    Integer batches are only flipped, since interpolation and intensity
+    shifts would be rounded to integers. Their normalization is deferred
+    to `ImageDataGenerator.finalize_batch`.
+
+    # Arguments
+        image_data_generator: Instance of `ImageDataGenerator` or None.
+        image_dtype: Dtype of the generated images.
+
+    # Raises
+        ValueError: in case of an integer `image_dtype` and an
+            augmentation other than flips.
+    """
+    if (image_data_generator and np.issubdtype(image_dtype, np.integer) and
+            not image_data_generator._flip_only):
+        raise ValueError('Images of dtype %s can only be flipped. Use a '
+                         'floating point dtype for rotations, shifts, shears, '
+                         'zooms, channel shifts and brightness changes.'
+                         % (np.dtype(image_dtype).name,))
 
 
 class Iterator(IteratorType):
@@ -43,6 +95,8 @@ class Iterator(IteratorType):
         self.lock = threading.Lock()
         self.index_array = None
         self.index_generator = self._flow_index()
+        # Seed of the batch produced by the current thread, see `_get_seeded_batch`
+        self._batch_seed = threading.local()
 
     def _set_index_array(self):
         self.index_array = np.arange(self.n)
@@ -73,9 +127,10 @@ class Iterator(IteratorType):
     def reset(self):
         self.batch_index = 0
 
-    def _flow_index(self):
-        # Ensure self.batch_index is 0.
-        self.reset()
+    def _flow_index(self, resume=False):
+        # Ensure self.batch_index is 0, unless a saved position is resumed.
+        if not resume:
+            self.reset()
         while 1:
             if self.seed is not None:
                 np.random.seed(self.seed + self.total_batches_seen)
@@ -91,6 +146,39 @@ class Iterator(IteratorType):
             yield self.index_array[current_index:
                                    current_index + self.batch_size]
 
+    def get_state(self):
+        """Returns the position of the iterator.
+
+        The position is the permutation of the current epoch, the index
+        of the next batch in the epoch and the number of batches drawn.
+        If the iterator has a seed, the batches drawn after `set_state`
+        are identical to the batches that followed `get_state`. Batches
+        drawn ahead by prefetchers count as drawn.
+
+        # Returns
+            A JSON serializable dictionary.
+        """
+        with self.lock:
+            return {'index_array': (None if self.index_array is None
+                                    else self.index_array.tolist()),
+                    'batch_index': self.batch_index,
+                    'total_batches_seen': self.total_batches_seen}
+
+    def set_state(self, state):
+        """Resumes the iterator at a position returned by `get_state`.
+
+        # Arguments
+            state: Dictionary, position of the iterator.
+        """
+        with self.lock:
+            self.index_array = (None if state['index_array'] is None
+                                else np.asarray(state['index_array']))
+            self.batch_index = state['batch_index']
+            self.total_batches_seen = state['total_batches_seen']
+            if self.index_array is None:
+                self.batch_index = 0
+            self.index_generator = self._flow_index(resume=True)
+
     def __iter__(self):
         # Needed if we want to do something like:
         # for x, y in data_gen.flow(...):
@@ -122,6 +210,334 @@ class Iterator(IteratorType):
         """
         raise NotImplementedError
 
+    def _get_seeded_batch(self, index_array, seed):
+        """Gets a batch whose random transformations are drawn from `seed`.
+
+        # Arguments
+            index_array: Array of sample indices to include in batch.
+            seed: Integer, random seed of the batch.
+
+        # Returns
+            A batch of transformed samples.
+        """
+        self._batch_seed.seed = seed
+        try:
+            return self._get_batches_of_transformed_samples(index_array)
+        finally:
+            self._batch_seed.seed = None
+
+    def _get_random_transform_batch(self, batch_shape):
+        """Draws the random transformation parameters of a batch.
+
+        Inside `_get_seeded_batch`, the parameters are drawn from the seed of
+        the batch while holding the random lock, so they do not depend on
+        other threads drawing at the same time.
+
+        # Arguments
+            batch_shape: Tuple of integers, shape of the batch.
+
+        # Returns
+            The parameters returned by `get_random_transform_batch`.
+        """
+        seed = getattr(self._batch_seed, 'seed', None)
+        if seed is None:
+            return self.image_data_generator.get_random_transform_batch(batch_shape)
+        with _random_lock:
+            return self.image_data_generator.get_random_transform_batch(batch_shape, seed)
+
+    def prefetch(self, max_prefetch=8, workers=1):
+        """Returns an iterator producing batches ahead in background threads.
+
+        See `PrefetchIterator`.
+
+        # Arguments
+            max_prefetch: Integer, maximum number of batches produced ahead.
+            workers: Integer, number of producer threads.
+
+        # Returns
+            A `PrefetchIterator` over this iterator.
+        """
+        return PrefetchIterator(self, max_prefetch=max_prefetch, workers=workers)
+
+    def shared_memory_prefetch(self, max_prefetch=8, workers=1, max_held=12):
+        """Returns an iterator producing batches ahead in worker processes.
+
+        See `SharedMemoryPrefetchIterator`.
+
+        # Arguments
+            max_prefetch: Integer, maximum number of batches produced ahead.
+            workers: Integer, number of producer processes.
+            max_held: Integer, number of yielded batches that stay valid.
+
+        # Returns
+            A `SharedMemoryPrefetchIterator` over this iterator.
+        """
+        return SharedMemoryPrefetchIterator(self,
+                                            max_prefetch=max_prefetch,
+                                            workers=workers,
+                                            max_held=max_held)
+
+
+class PrefetchIterator(object):
+    """Produces the batches of an `Iterator` ahead in background threads.
+
+    Batches are yielded in the same order as by the wrapped iterator. At
+    most `max_prefetch` batches are produced ahead of the consumer. Image
+    decoding and the affine transformations release the GIL, so producer
+    threads run concurrently with each other and with the model.
+
+    The random transformations of every batch are drawn from a seed drawn
+    by the thread claiming the batch, so the batches do not depend on the
+    number of workers or on the order in which they run, and are
+    reproducible if the iterator has a seed. Producer threads share the
+    global numpy random state: it is reseeded before every batch.
+
+    The prefetcher is a plain Python iterator, so it can be wrapped by
+    other generators (e.g. `utilities.image.image.crop_generator`). Use it
+    with `fit_generator(..., workers=1, use_multiprocessing=False)`: the
+    prefetcher provides the parallelism.
+
+    # Arguments
+        iterator: Instance of `Iterator`.
+        max_prefetch: Integer, maximum number of batches produced ahead.
+        workers: Integer, number of producer threads.
+    """
+
+    def __init__(self, iterator, max_prefetch=8, workers=1):
+        if max_prefetch < 1 or workers < 1:
+            raise ValueError('max_prefetch and workers must be positive. '
+                             'Got max_prefetch={}, workers={}'
+                             .format(max_prefetch, workers))
+        self.iterator = iterator
+        self.max_prefetch = max_prefetch
+        self.workers = workers
+        self.condition = threading.Condition()
+        # Producers take a slot before claiming the next batch
+        self.slots = threading.Semaphore(max_prefetch)
+        self.batches = {}
+        self.next_claimed = 0
+        self.next_yielded = 0
+        self.stopped = False
+        self.threads = [threading.Thread(target=self._produce)
+                        for _ in range(workers)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def _produce(self):
+        while True:
+            while not self.slots.acquire(timeout=0.1):
+                if self.stopped:
+                    return
+            if self.stopped:
+                return
+            # Claim the batch number together with its indices and seed so
+            # that batches can be put back in order by the consumer. The
+            # iterator reseeds the random state before the indices are drawn
+            with self.iterator.lock, _random_lock:
+                index_array = next(self.iterator.index_generator)
+                seed = np.random.randint(2 ** 31 - 1)
+                with self.condition:
+                    batch_number = self.next_claimed
+                    self.next_claimed += 1
+            try:
+                batch = self.iterator._get_seeded_batch(index_array, seed)
+            except Exception as e:
+                batch = e
+            with self.condition:
+                self.batches[batch_number] = batch
+                self.condition.notify_all()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self, *args, **kwargs):
+        return self.next(*args, **kwargs)
+
+    def __len__(self):
+        return len(self.iterator)
+
+    def next(self):
+        """For python 2.x.
+
+        # Returns
+            The next batch.
+        """
+        with self.condition:
+            while self.next_yielded not in self.batches:
+                self.condition.wait()
+            batch = self.batches.pop(self.next_yielded)
+            self.next_yielded += 1
+        self.slots.release()
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
+
+    def close(self):
+        """Stops the producer threads."""
+        self.stopped = True
+        for thread in self.threads:
+            thread.join()
+
+
+class SharedMemoryPrefetchIterator(object):
+    """Produces the batches of an `Iterator` ahead in worker processes.
+
+    Worker processes write batches into a ring of shared memory slots and
+    only the slot numbers are sent back, so batches are not pickled. The
+    yielded batches are views of the slots: the batch yielded last and the
+    `max_held - 1` batches before it stay valid, older batches are
+    overwritten. `max_held` must exceed the number of batches the consumer
+    holds at once (e.g. the Keras queue size plus two).
+
+    Batches are yielded in the same order as by the wrapped iterator. The
+    random transformations of every batch are seeded by the consumer, so
+    the batches do not depend on the number of workers and are
+    reproducible if the iterator has a seed.
+
+    The slots are sized by producing one batch of the first samples at
+    construction. Workers are forked, so the iterator is not pickled. Use
+    the prefetcher with `fit_generator(..., workers=1,
+    use_multiprocessing=False)` and call `close` to release the shared
+    memory. Requires Python 3.8 or newer.
+
+    # Arguments
+        iterator: Instance of `Iterator`.
+        max_prefetch: Integer, maximum number of batches produced ahead.
+        workers: Integer, number of producer processes.
+        max_held: Integer, number of yielded batches that stay valid.
+    """
+
+    def __init__(self, iterator, max_prefetch=8, workers=1, max_held=12):
+        if shared_memory is None:
+            raise ImportError('SharedMemoryPrefetchIterator requires '
+                              '`multiprocessing.shared_memory` (Python 3.8+).')
+        if max_prefetch < 1 or workers < 1 or max_held < 1:
+            raise ValueError('max_prefetch, workers and max_held must be '
+                             'positive. Got max_prefetch={}, workers={}, '
+                             'max_held={}'.format(max_prefetch, workers, max_held))
+        self.iterator = iterator
+        self.max_prefetch = max_prefetch
+        self.workers = workers
+        self.max_held = max_held
+        self.slot_count = max_prefetch + max_held
+
+        batch = iterator._get_batches_of_transformed_samples(
+            np.arange(min(iterator.batch_size, iterator.n)))
+        self.single_array = not isinstance(batch, tuple)
+        arrays = [batch] if self.single_array else list(batch)
+        if any(array.dtype.hasobject for array in arrays):
+            raise ValueError('Batches with object arrays can not be shared.')
+
+        # One segment per array of the batch, holding that array of every slot
+        self.segments = []
+        self.buffers = []
+        for array in arrays:
+            shape = (self.slot_count,) + array.shape
+            segment = shared_memory.SharedMemory(
+                create=True, size=max(int(np.prod(shape)) * array.itemsize, 1))
+            self.segments.append(segment)
+            # Unlike `np.ndarray(buffer=...)`, the views keep the mapping
+            # exported, so it is not unmapped while batches are referenced
+            self.buffers.append(np.frombuffer(
+                segment.buf, array.dtype, int(np.prod(shape))).reshape(shape))
+
+        context = multiprocessing.get_context('fork')
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.processes = [context.Process(target=self._produce)
+                          for _ in range(workers)]
+        for process in self.processes:
+            process.daemon = True
+            process.start()
+
+        self.batches = {}
+        self.next_dispatched = 0
+        self.next_yielded = 0
+        for _ in range(max_prefetch):
+            self._dispatch()
+
+    def _dispatch(self):
+        # Batch b is written to slot b % slot_count, last used by the batch
+        # yielded max_held batches before the one that triggers the dispatch
+        with self.iterator.lock:
+            index_array = next(self.iterator.index_generator)
+            seed = np.random.randint(2 ** 31 - 1)
+        self.tasks.put((self.next_dispatched, index_array, seed))
+        self.next_dispatched += 1
+
+    def _produce(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            batch_number, index_array, seed = task
+            slot = batch_number % self.slot_count
+            try:
+                np.random.seed(seed)
+                batch = self.iterator._get_batches_of_transformed_samples(index_array)
+                arrays = [batch] if self.single_array else batch
+                for buffer, array in zip(self.buffers, arrays):
+                    buffer[slot, :len(array)] = array
+                result = len(arrays[0])
+            except Exception as e:
+                result = e
+            try:
+                self.results.put((batch_number, result))
+            except Exception as e:
+                self.results.put((batch_number, RuntimeError(repr(e))))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self, *args, **kwargs):
+        return self.next(*args, **kwargs)
+
+    def __len__(self):
+        return len(self.iterator)
+
+    def next(self):
+        """For python 2.x.
+
+        # Returns
+            The next batch.
+        """
+        while self.next_yielded not in self.batches:
+            try:
+                batch_number, result = self.results.get(timeout=1)
+            except queue.Empty:
+                if not all(process.is_alive() for process in self.processes):
+                    raise RuntimeError('A worker process of the prefetcher died.')
+                continue
+            self.batches[batch_number] = result
+        batch_number = self.next_yielded
+        result = self.batches.pop(batch_number)
+        self.next_yielded += 1
+        self._dispatch()
+        if isinstance(result, Exception):
+            raise result
+        slot = batch_number % self.slot_count
+        arrays = tuple(buffer[slot, :result] for buffer in self.buffers)
+        return arrays[0] if self.single_array else arrays
+
+    def close(self):
+        """Stops the worker processes and releases the shared memory.
+
+        The memory of batches that are still referenced is released with
+        them.
+        """
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.buffers = []
+        for segment in self.segments:
+            segment.unlink()
+        _release_segments(self.segments)
+        self.segments = []
+
 
 class BatchFromFilesMixin():
     """Adds methods related to getting batches from filenames
@@ -138,7 +554,8 @@ class BatchFromFilesMixin():
                              save_prefix,
                              save_format,
                              subset,
-                             interpolation):
+                             interpolation,
+                             num_threads=None):
         """Sets attributes to use later for processing files into a batch.
 
         # Arguments
@@ -164,6 +581,10 @@ class BatchFromFilesMixin():
                 If PIL version 1.1.3 or newer is installed, "lanczos" is also
                 supported. If PIL version 3.4.0 or newer is installed, "box" and
                 "hamming" are also supported. By default, "nearest" is used.
+            num_threads: Optional number of threads loading and transforming
+                the images of a batch concurrently. Image decoding and the
+                affine transformations release the GIL. By default, images
+                are processed serially.
         """
         self.image_data_generator = image_data_generator
         self.target_size = tuple(target_size)
@@ -205,6 +626,53 @@ class BatchFromFilesMixin():
             split = None
         self.split = split
         self.subset = subset
+        self.num_threads = num_threads
+        self._thread_pool = None
+        self._thread_pool_pid = None
+
+    def _get_thread_pool(self):
+        # Threads do not survive a fork. Worker processes create their own pool
+        if self._thread_pool is None or self._thread_pool_pid != os.getpid():
+            self._thread_pool = ThreadPoolExecutor(max_workers=self.num_threads)
+            self._thread_pool_pid = os.getpid()
+        return self._thread_pool
+
+    def _load_sample(self, filepath):
+        """Loads a single image.
+
+        # Arguments
+            filepath: Path to the image file.
+
+        # Returns
+            The image array.
+        """
+        x = load_img_array(filepath,
+                           color_mode=self.color_mode,
+                           target_size=self.target_size,
+                           interpolation=self.interpolation)
+        # Same layout as `img_to_array`
+        x = np.asarray(x, dtype=self.image_dtype)
+        if x.ndim == 2:
+            x = np.expand_dims(x, -1 if self.data_format == 'channels_last' else 0)
+        elif self.data_format == 'channels_first':
+            x = x.transpose(2, 0, 1)
+        return x
+
+    def _transform_samples(self, batch_x, transform_parameters, chunk):
+        """Transforms and standardizes a slice of a batch in-place.
+
+        # Arguments
+            batch_x: Batch of images.
+            transform_parameters: Transformation parameters of the batch
+                drawn with `get_random_transform_batch`.
+            chunk: Slice of the batch to transform.
+        """
+        chunk_parameters = {
+            key: value[chunk] if value is not None else None
+            for key, value in transform_parameters.items()}
+        batch_x[chunk] = self.image_data_generator.apply_transform_batch(
+            batch_x[chunk], chunk_parameters)
+        self.image_data_generator.standardize_batch(batch_x[chunk])
 
     def _get_batches_of_transformed_samples(self, index_array):
         """Gets a batch of transformed samples.
@@ -215,25 +683,32 @@ class BatchFromFilesMixin():
         # Returns
             A batch of transformed samples.
         """
-        batch_x = np.zeros((len(index_array),) + self.image_shape, dtype=self.dtype)
+        batch_x = np.zeros((len(index_array),) + self.image_shape, dtype=self.image_dtype)
         # build batch of image data
         # self.filepaths is dynamic, is better to call it once outside the loop
         filepaths = self.filepaths
-        for i, j in enumerate(index_array):
-            img = load_img(filepaths[j],
-                           color_mode=self.color_mode,
-                           target_size=self.target_size,
-                           interpolation=self.interpolation)
-            x = img_to_array(img, data_format=self.data_format)
-            # Pillow images should be closed after `load_img`,
-            # but not PIL images.
-            if hasattr(img, 'close'):
-                img.close()
-            if self.image_data_generator:
-                params = self.image_data_generator.get_random_transform(x.shape)
-                x = self.image_data_generator.apply_transform(x, params)
-                x = self.image_data_generator.standardize(x)
+        batch_filepaths = [filepaths[j] for j in index_array]
+        if self.num_threads:
+            samples = self._get_thread_pool().map(self._load_sample, batch_filepaths)
+        else:
+            samples = map(self._load_sample, batch_filepaths)
+        for i, x in enumerate(samples):
             batch_x[i] = x
+        # Random parameters are drawn in sample order, so batches are
+        # identical with and without threads. With threads, the batch is
+        # transformed in one chunk per thread
+        if self.image_data_generator:
+            transform_parameters = self._get_random_transform_batch(batch_x.shape)
+            bounds = np.linspace(0, len(batch_x), (self.num_threads or 1) + 1).astype(int)
+            chunks = [slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])
+                      if stop > start]
+            if self.num_threads and len(chunks) > 1:
+                list(self._get_thread_pool().map(
+                    lambda chunk: self._transform_samples(batch_x, transform_parameters, chunk),
+                    chunks))
+            else:
+                for chunk in chunks:
+                    self._transform_samples(batch_x, transform_parameters, chunk)
         # optionally save augmented images to disk for debugging purposes
         if self.save_to_dir:
             for i, j in enumerate(index_array):
@@ -144,15 +144,10 @@ class NumpyArrayIterator(Iterator):
                                                  seed)
 
     def _get_batches_of_transformed_samples(self, index_array):
-        batch_x = np.zeros(tuple([len(index_array)] + list(self.x.shape)[1:]),
-                           dtype=self.dtype)
-        for i, j in enumerate(index_array):
-            x = self.x[j]
-            params = self.image_data_generator.get_random_transform(x.shape)
-            x = self.image_data_generator.apply_transform(
-                x.astype(self.dtype), params)
-            x = self.image_data_generator.standardize(x)
-            batch_x[i] = x
+        batch_x = self.x[index_array].astype(self.dtype)
+        params = self._get_random_transform_batch(batch_x.shape)
+        batch_x = self.image_data_generator.apply_transform_batch(batch_x, params)
+        batch_x = self.image_data_generator.standardize_batch(batch_x)
 
         if self.save_to_dir:
             for i, j in enumerate(index_array):
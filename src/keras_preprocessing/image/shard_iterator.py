@@ -0,0 +1,183 @@
+"""Utilities for real-time data augmentation on image data.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+
+import numpy as np
+
+from .iterator import Iterator, check_image_dtype
+from .utils import array_to_img
+
+# Version of the on-disk shard layout. Bump when the layout changes
+SHARD_FORMAT_VERSION = 1
+SHARD_INDEX_FILENAME = 'dataset.json'
+SHARD_IMAGES_FILENAME = 'images_{0:05d}.npy'
+
+
+def load_shard_index(directory):
+    """Loads the index of a compiled dataset directory.
+
+    # Arguments
+        directory: Path to a local directory written by
+            `utilities.dataset.dataset.compile_dataset`.
+
+    # Returns
+        The index dictionary, or None if the directory holds no
+        (complete) dataset of the current shard format.
+    """
+    path = os.path.join(directory, SHARD_INDEX_FILENAME)
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r') as stream:
+        index = json.load(stream)
+    if index.get('format_version') != SHARD_FORMAT_VERSION:
+        return None
+    return index
+
+
+class ShardIterator(Iterator):
+    """Iterator yielding data from a compiled dataset of image shards.
+
+    Images are stored decoded, cropped to `target_size` and as uint8 in
+    memory-mapped `.npy` shards, so no image file is opened or resized
+    while iterating. Batches are otherwise identical to the batches of a
+    `DataFrameIterator` over the same dataframe.
+
+    # Arguments
+        directory: Path to a local directory written by
+            `utilities.dataset.dataset.compile_dataset`.
+        image_data_generator: Instance of `ImageDataGenerator` to use for
+            random transformations and normalization. If None, no transformations
+            and normalizations are made.
+        class_mode: one of "categorical", "binary", "sparse" or None.
+            Default: "categorical".
+        batch_size: Integer, size of a batch.
+        shuffle: Boolean, whether to shuffle the data between epochs.
+        seed: Random seed for data shuffling.
+        data_format: String, one of `channels_first`, `channels_last`.
+        save_to_dir: Optional directory where to save the pictures
+            being yielded, in a viewable format. This is useful
+            for visualizing the random transformations being
+            applied, for debugging purposes.
+        save_prefix: String prefix to use for saving sample
+            images (if `save_to_dir` is set).
+        save_format: Format to use for saving sample images
+            (if `save_to_dir` is set).
+        dtype: Dtype to use for the generated arrays.
+        image_dtype: Optional dtype of the generated images. Default: `dtype`.
+            With an integer dtype (e.g. `"uint8"`), images are only flipped
+            and not normalized. See `ImageDataGenerator.finalize_batch`.
+    """
+    allowed_class_modes = {'categorical', 'binary', 'sparse', None}
+
+    def __init__(self,
+                 directory,
+                 image_data_generator=None,
+                 class_mode='categorical',
+                 batch_size=32,
+                 shuffle=True,
+                 seed=None,
+                 data_format='channels_last',
+                 save_to_dir=None,
+                 save_prefix='',
+                 save_format='png',
+                 dtype='float32',
+                 image_dtype=None):
+        if class_mode not in self.allowed_class_modes:
+            raise ValueError('Invalid class_mode: {}; expected one of: {}'
+                             .format(class_mode, self.allowed_class_modes))
+        index = load_shard_index(directory)
+        if index is None:
+            raise ValueError('No compiled dataset found in: {}'.format(directory))
+        if class_mode == 'binary' and len(index['classes']) != 2:
+            raise ValueError('If class_mode="binary" there must be 2 classes. '
+                             'Found {} classes.'.format(len(index['classes'])))
+
+        self.directory = directory
+        self.image_data_generator = image_data_generator
+        self.class_mode = class_mode
+        self.data_format = data_format
+        self.save_to_dir = save_to_dir
+        self.save_prefix = save_prefix
+        self.save_format = save_format
+        self.dtype = dtype
+        self.image_dtype = dtype if image_dtype is None else image_dtype
+        check_image_dtype(image_data_generator, self.image_dtype)
+
+        self.filenames = index['filenames']
+        self.patients = index['patients']
+        self.class_indices = dict(zip(index['classes'], range(len(index['classes']))))
+        self.classes = np.array(index['labels'], dtype='int32')
+        self.target_size = tuple(index['target_size'])
+
+        self.image_shape = self.target_size + (index['channels'],)
+        if self.data_format == 'channels_first':
+            self.image_shape = (index['channels'],) + self.target_size
+
+        self.shard_filenames = [shard['filename'] for shard in index['shards']]
+        # First global sample index of every shard
+        self.shard_offsets = np.cumsum(
+            [0] + [shard['samples'] for shard in index['shards']])[:-1]
+        # Memory maps are opened lazily so that every worker maps the shards itself
+        self._shards = None
+
+        self.samples = len(self.filenames)
+        print('Found {} images belonging to {} classes.'
+              .format(self.samples, len(self.class_indices)))
+        super(ShardIterator, self).__init__(self.samples,
+                                            batch_size,
+                                            shuffle,
+                                            seed)
+
+    @property
+    def shards(self):
+        if self._shards is None:
+            self._shards = [
+                np.load(os.path.join(self.directory, filename), mmap_mode='r')
+                for filename in self.shard_filenames]
+        return self._shards
+
+    def _get_sample(self, j):
+        shard = np.searchsorted(self.shard_offsets, j, side='right') - 1
+        x = self.shards[shard][j - self.shard_offsets[shard]]
+        if self.data_format == 'channels_first':
+            x = x.transpose(2, 0, 1)
+        return x
+
+    def _get_batches_of_transformed_samples(self, index_array):
+        # Samples are converted to the image dtype as they are copied out of the shards
+        batch_x = np.zeros((len(index_array),) + self.image_shape, dtype=self.image_dtype)
+        for i, j in enumerate(index_array):
+            batch_x[i] = self._get_sample(j)
+        if self.image_data_generator:
+            params = self._get_random_transform_batch(batch_x.shape)
+            batch_x = self.image_data_generator.apply_transform_batch(batch_x, params)
+            batch_x = self.image_data_generator.standardize_batch(batch_x)
+
+        if self.save_to_dir:
+            for i, j in enumerate(index_array):
+                img = array_to_img(batch_x[i], self.data_format, scale=True)
+                fname = '{prefix}_{index}_{hash}.{format}'.format(
+                    prefix=self.save_prefix,
+                    index=j,
+                    hash=np.random.randint(1e7),
+                    format=self.save_format)
+                img.save(os.path.join(self.save_to_dir, fname))
+        # build batch of labels
+        if self.class_mode in {'binary', 'sparse'}:
+            batch_y = self.classes[index_array].astype(self.dtype)
+        elif self.class_mode == 'categorical':
+            batch_y = np.zeros((len(batch_x), len(self.class_indices)),
+                               dtype=self.dtype)
+            batch_y[np.arange(len(batch_x)), self.classes[index_array]] = 1.
+        else:
+            return batch_x
+        return batch_x, batch_y
+
+    @property
+    def labels(self):
+        return self.classes
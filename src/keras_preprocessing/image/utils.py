@@ -4,6 +4,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import io
 import os
 import warnings
 
@@ -11,6 +12,7 @@ import numpy as np
 
 from tensorflow.python.lib.io import file_io
 from utilities.image.image import center_crop_auto_upscale
+from utilities.storage.storage import is_remote_path
 
 try:
     from PIL import ImageEnhance
@@ -36,6 +38,36 @@ if pil_image is not None:
         _PIL_INTERPOLATION_METHODS['lanczos'] = pil_image.LANCZOS
 
 
+# Local fork: optional read-through disk cache for remote (gs://) images. See `set_image_cache`
+_IMAGE_CACHE = None
+
+
+def set_image_cache(cache):
+    """Sets the read-through cache consulted by `load_img` for remote images.
+
+    # Arguments
+        cache: `utilities.storage.storage.ReadThroughCache` or None to
+            read remote images directly.
+    """
+    global _IMAGE_CACHE
+    _IMAGE_CACHE = cache
+
+
+# Local fork: optional in-process cache of decoded arrays. See `set_decoded_image_cache`
+_DECODED_IMAGE_CACHE = None
+
+
+def set_decoded_image_cache(cache):
+    """Sets the in-process cache consulted by `load_img_array`.
+
+    # Arguments
+        cache: `utilities.storage.storage.DecodedImageCache` or None to
+            decode every image on every load.
+    """
+    global _DECODED_IMAGE_CACHE
+    _DECODED_IMAGE_CACHE = cache
+
+
 def get_extension(filename):
     """Get extension of the filename
 
@@ -100,10 +132,50 @@ def load_img(path, grayscale=False, color_mode='rgb', target_size=None,
         warnings.warn('grayscale is deprecated. Please use '
                       'color_mode = "grayscale"')
         color_mode = 'grayscale'
+    return pil_image.fromarray(load_img_array(path,
+                                              color_mode=color_mode,
+                                              target_size=target_size,
+                                              interpolation=interpolation))
+
+
+def load_img_array(path, color_mode='rgb', target_size=None,
+                   interpolation='nearest'):
+    """Loads an image into a Numpy array, without converting it back to PIL.
+
+    The pixels are those of `load_img`. If a cache is set with
+    `set_decoded_image_cache`, the result is memoized per path,
+    `color_mode`, `target_size` and `interpolation`.
+
+    # Arguments
+        path: Path to image file.
+        color_mode: One of "grayscale", "rgb", "rgba". Default: "rgb".
+        target_size: Either `None` (default to original size)
+            or tuple of ints `(img_height, img_width)`.
+        interpolation: Interpolation method used to upscale the image if it
+            is smaller than `target_size`. See `load_img`.
+
+    # Returns
+        A read-only uint8 Numpy array of shape `(height, width)` for
+        grayscale images, `(height, width, channels)` otherwise.
+
+    # Raises
+        ImportError: if PIL is not available.
+        ValueError: if interpolation method is not supported.
+    """
     if pil_image is None:
         raise ImportError('Could not import PIL.Image. '
                           'The use of `array_to_img` requires PIL.')
-    img = pil_image.open(file_io.FileIO(path, mode='rb'))
+    if target_size is not None:
+        target_size = tuple(target_size)
+    key = (path, color_mode, target_size, interpolation)
+    if _DECODED_IMAGE_CACHE is not None:
+        x = _DECODED_IMAGE_CACHE.get(key)
+        if x is not None:
+            return x
+    if _IMAGE_CACHE is not None and is_remote_path(path):
+        img = pil_image.open(io.BytesIO(_IMAGE_CACHE.read(path)))
+    else:
+        img = pil_image.open(file_io.FileIO(path, mode='rb'))
     if color_mode == 'grayscale':
         if img.mode != 'L':
             img = img.convert('L')
@@ -115,6 +187,7 @@ def load_img(path, grayscale=False, color_mode='rgb', target_size=None,
             img = img.convert('RGB')
     else:
         raise ValueError('color_mode must be "grayscale", "rgb", or "rgba"')
+    x = None
     if target_size is not None:
         width_height_tuple = (target_size[1], target_size[0])
         if img.size != width_height_tuple:
@@ -125,13 +198,22 @@ def load_img(path, grayscale=False, color_mode='rgb', target_size=None,
                         interpolation,
                         ", ".join(_PIL_INTERPOLATION_METHODS.keys())))
             resample = _PIL_INTERPOLATION_METHODS[interpolation]
-            
-            # Run user-defined method to ONLY upscale the image if a crop of 
+
+            # Run user-defined method to ONLY upscale the image if a crop of
             # size target_size cannot be placed in the orginal image. Otherwise,
             # DO NOT upscale, only crop the center of the image
-            img = center_crop_auto_upscale(img, target_size, resample=resample)
-
-    return pil_image.fromarray(img)
+            x = np.ascontiguousarray(
+                center_crop_auto_upscale(img, target_size, resample=resample))
+    if x is None:
+        x = np.array(img)
+    # Pillow images should be closed, but not PIL images.
+    if hasattr(img, 'close'):
+        img.close()
+    if _DECODED_IMAGE_CACHE is not None:
+        _DECODED_IMAGE_CACHE.put(key, x)
+    else:
+        x.setflags(write=False)
+    return x
 
 
 def list_pictures(directory, ext=('jpg', 'jpeg', 'bmp', 'png', 'ppm', 'tif',
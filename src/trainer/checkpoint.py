@@ -0,0 +1,175 @@
+import io
+import json
+import os
+import uuid
+
+import numpy as np
+
+from keras.callbacks import Callback
+from tensorflow.python.lib.io import file_io
+
+# Files of a checkpoint: {identifier}_epoch_{epoch}.h5 (weights), _optimizer.npz and _state.json
+CHECKPOINT_PREFIX = "{0}_epoch_{1:04d}"
+# Name of the latest complete checkpoint, written after all of its files
+LATEST_CHECKPOINT_FILE = "{0}_latest.json"
+
+
+def write_json(path, data):
+    with file_io.FileIO(path, mode="w") as output_f:
+        output_f.write(json.dumps(data))
+
+
+def read_json(path):
+    with file_io.FileIO(path, mode="r") as input_f:
+        return json.loads(input_f.read())
+
+
+def load_checkpoint(path_to_checkpoint_dir, identifier, epoch=None):
+    """State of the checkpoint written after epoch, or of the latest checkpoint if epoch is None
+
+    Returns:
+        The checkpoint state (dictionary) or None if there is no such checkpoint
+    """
+    if epoch is None:
+        latest_path = "{0}/{1}".format(path_to_checkpoint_dir, LATEST_CHECKPOINT_FILE.format(identifier))
+
+        if not file_io.file_exists(latest_path):
+            return None
+
+        prefix = read_json(latest_path)["checkpoint"]
+    else:
+        prefix = CHECKPOINT_PREFIX.format(identifier, epoch)
+
+    state_path = "{0}/{1}_state.json".format(path_to_checkpoint_dir, prefix)
+
+    if not file_io.file_exists(state_path):
+        return None
+
+    return read_json(state_path)
+
+
+def restore_checkpoint(state, path_to_checkpoint_dir, weights_model, training_model):
+    """Load the weights and optimizer state of a checkpoint
+
+    The weights_model must have the trainable layers of the checkpointed stage and training_model must be
+    compiled, so that its optimizer state has the checkpointed layout
+
+    Arguments:
+        state                               Checkpoint state, as returned by load_checkpoint
+        path_to_checkpoint_dir              Directory (local or gs://) holding the checkpoint
+        weights_model                       Model the weights were saved from
+        training_model                      Model the optimizer state was saved from
+    """
+    # Keras reads weights from local files only
+    local_weights = "{0}.{1}.h5".format(state["prefix"], uuid.uuid4())
+    file_io.copy("{0}/{1}.h5".format(path_to_checkpoint_dir, state["prefix"]), local_weights, overwrite=True)
+    weights_model.load_weights(local_weights)
+    os.remove(local_weights)
+
+    with file_io.FileIO("{0}/{1}_optimizer.npz".format(path_to_checkpoint_dir, state["prefix"]), mode="rb") as input_f:
+        optimizer_weights = np.load(io.BytesIO(input_f.read()))
+
+    # The optimizer creates its state with the training function
+    training_model._make_train_function()
+    training_model.optimizer.set_weights(
+        [optimizer_weights["arr_{0}".format(i)] for i in range(len(optimizer_weights.files))])
+
+
+class TrainingCheckpoint(Callback):
+    """Write a checkpoint every period epochs so a preempted training can be resumed
+
+    A checkpoint holds the weights of weights_model, the optimizer state of the model being trained, the position
+    of the training iterator and the logs of the epochs of the stage. Only the most recent checkpoints are kept.
+    The iterator position is exact when batches are drawn in this process (e.g. by prefetch threads). Batches
+    drawn ahead but not trained on are skipped on resume
+
+    Arguments:
+        path_to_checkpoint_dir              Directory (local or gs://) to write the checkpoints to
+        identifier                          Base name of the checkpoint files
+        stage                               Name of the training stage, e.g. "train" or "fine_tune"
+        weights_model                       Model whose weights are saved. Shares the layers of the trained model
+
+    Optional:
+        iterator                            keras_preprocessing Iterator producing the training batches
+        history                             Logs of the epochs of the stage before the resumed epoch
+        period                              Number of epochs between checkpoints. Default 1
+        max_to_keep                         Number of checkpoints kept. Default 2
+    """
+
+    def __init__(
+            self,
+            path_to_checkpoint_dir,
+            identifier,
+            stage,
+            weights_model,
+            iterator=None,
+            history=None,
+            period=1,
+            max_to_keep=2):
+        super(TrainingCheckpoint, self).__init__()
+        self.path_to_checkpoint_dir = path_to_checkpoint_dir
+        self.identifier = identifier
+        self.stage = stage
+        self.weights_model = weights_model
+        self.iterator = iterator
+        self.history = {key: list(values) for key, values in (history or {}).items()}
+        self.period = period
+        self.max_to_keep = max_to_keep
+
+        if not file_io.is_directory(path_to_checkpoint_dir):
+            file_io.recursive_create_dir(path_to_checkpoint_dir)
+
+        # Checkpoints of the stage written before a resume are pruned like the ones written by this callback
+        self.prefixes = self.stage_prefixes()
+
+    def stage_prefixes(self):
+        """Prefixes of the checkpoints of the stage in the checkpoint directory, oldest first"""
+        states = [read_json(state_path) for state_path in file_io.get_matching_files(
+            "{0}/{1}_epoch_*_state.json".format(self.path_to_checkpoint_dir, self.identifier))]
+
+        return [state["prefix"] for state in sorted(states, key=lambda state: state["epoch"])
+                if state["stage"] == self.stage]
+
+    def on_epoch_end(self, epoch, logs=None):
+        for key, value in (logs or {}).items():
+            self.history.setdefault(key, []).append(float(value))
+
+        if self.period and (epoch + 1) % self.period == 0:
+            self.save(epoch + 1)
+
+    def save(self, epoch):
+        """Write the checkpoint of the epochs completed so far"""
+        prefix = CHECKPOINT_PREFIX.format(self.identifier, epoch)
+        path_prefix = "{0}/{1}".format(self.path_to_checkpoint_dir, prefix)
+
+        # Keras writes weights to local files only
+        local_weights = "{0}.{1}.h5".format(prefix, uuid.uuid4())
+        self.weights_model.save_weights(local_weights)
+        file_io.copy(local_weights, "{0}.h5".format(path_prefix), overwrite=True)
+        os.remove(local_weights)
+
+        optimizer_buffer = io.BytesIO()
+        np.savez(optimizer_buffer, *self.model.optimizer.get_weights())
+        with file_io.FileIO("{0}_optimizer.npz".format(path_prefix), mode="wb+") as output_f:
+            output_f.write(optimizer_buffer.getvalue())
+
+        write_json("{0}_state.json".format(path_prefix), {
+            "prefix": prefix,
+            "epoch": epoch,
+            "stage": self.stage,
+            "history": self.history,
+            "iterator": self.iterator.get_state() if self.iterator is not None else None
+        })
+
+        # The checkpoint is complete. Older checkpoints can go
+        write_json("{0}/{1}".format(self.path_to_checkpoint_dir, LATEST_CHECKPOINT_FILE.format(self.identifier)),
+                   {"checkpoint": prefix})
+
+        if prefix not in self.prefixes:
+            self.prefixes.append(prefix)
+
+        while len(self.prefixes) > self.max_to_keep:
+            old_path_prefix = "{0}/{1}".format(self.path_to_checkpoint_dir, self.prefixes.pop(0))
+            for suffix in [".h5", "_optimizer.npz", "_state.json"]:
+                if file_io.file_exists(old_path_prefix + suffix):
+                    file_io.delete_file(old_path_prefix + suffix)
@@ -1,4 +1,5 @@
 import argparse
+import io
 import json
 import yaml
 import os
@@ -15,17 +16,245 @@ import pandas as pd
 from tensorflow.python.lib.io import file_io
 from tensorflow.python.framework.errors_impl import NotFoundError
 
+from keras import backend as K
+from keras.layers import Input, Lambda
+from keras.models import Model
 from keras.optimizers import Adam
 from keras.callbacks import EarlyStopping, TensorBoard
-from keras_preprocessing.image import ImageDataGenerator
-
-from sklearn.metrics import roc_curve, precision_recall_curve, confusion_matrix, roc_auc_score
+from keras_preprocessing.image import ImageDataGenerator, set_image_cache, set_decoded_image_cache
 
 from constants.ultrasound import string_to_image_type, TUMOR_TYPES
 from utilities.partition.patient_partition import patient_train_test_split
 from utilities.general.general import default_none
 from utilities.manifest.manifest import patient_type_lists, patient_lists_to_dataframe
-from utilities.image.image import crop_generator
+from utilities.image.image import TTA_CROP_LAYOUTS, crop_generator, tta_crop_generator, tta_crop_origins
+from utilities.dataset.dataset import compile_dataset
+from utilities.features.features import compile_feature_cache, feature_batches, flip_variants
+from utilities.evaluation.evaluation import (
+    PATIENT_AGGREGATIONS,
+    aggregate_patients,
+    binary_classification_metrics,
+    frame_predictions,
+    prediction_frame,
+    reduce_crops,
+    write_prediction_store)
+from trainer.checkpoint import TrainingCheckpoint, load_checkpoint, restore_checkpoint
+from utilities.storage.storage import DecodedImageCache, ReadThroughCache, WeightsCache, set_weights_cache
+
+# Batches fit_generator queues ahead of training (the Keras default)
+FIT_MAX_QUEUE_SIZE = 10
+
+
+def flow_from_dataframe_or_dataset(
+        data_generator,
+        dataframe,
+        config,
+        shuffle,
+        path_to_dataset_dir=None,
+        num_threads=None,
+        image_dtype=None,
+        batch_size=None):
+    """Flow from a compiled dataset if a dataset directory is given. Otherwise flow from the image files
+
+    The dataset is compiled from the dataframe on first use and reused while the frames and
+    config.target_shape are unchanged. See utilities.dataset.dataset.compile_dataset. Image files
+    of a batch are loaded by num_threads threads if given. Batches are image_dtype (e.g. uint8) if
+    given, in which case they are not normalized. Batches hold batch_size images (default config.batch_size)
+    """
+    batch_size = default_none(batch_size, config.batch_size)
+
+    if path_to_dataset_dir is None:
+        return data_generator.flow_from_dataframe(
+            dataframe=dataframe,
+            directory=None,
+            x_col="filename",
+            y_col="class",
+            target_size=config.target_shape,
+            color_mode="rgb",
+            class_mode="binary",
+            classes=TUMOR_TYPES,
+            batch_size=batch_size,
+            shuffle=shuffle,
+            seed=config.random_seed,
+            drop_duplicates=False,
+            num_threads=num_threads,
+            image_dtype=image_dtype
+        )
+
+    compile_dataset(
+        dataframe,
+        path_to_dataset_dir,
+        config.target_shape,
+        TUMOR_TYPES,
+        color_mode="rgb")
+
+    return data_generator.flow_from_shards(
+        path_to_dataset_dir,
+        class_mode="binary",
+        batch_size=batch_size,
+        shuffle=shuffle,
+        seed=config.random_seed,
+        image_dtype=image_dtype
+    )
+
+
+def prefetch(iterator, args):
+    """Produce the batches of the iterator ahead in --num-workers threads, or in worker processes writing
+    to shared memory with --shared-memory-prefetch
+
+    Yielded shared memory batches stay valid while Keras holds them: its queue (FIT_MAX_QUEUE_SIZE), the
+    batch being trained on and the batch waiting to enter the queue
+    """
+    if args.shared_memory_prefetch:
+        return iterator.shared_memory_prefetch(
+            max_prefetch=args.prefetch_batches,
+            workers=args.num_workers,
+            max_held=FIT_MAX_QUEUE_SIZE + 2)
+
+    return iterator.prefetch(
+        max_prefetch=args.prefetch_batches,
+        workers=args.num_workers)
+
+
+def predict_frames(
+        model,
+        data_generator,
+        dataframe,
+        split,
+        config,
+        path_to_dataset_dir=None,
+        num_threads=None,
+        image_dtype=None,
+        crop_shape=None,
+        crop_layout="center",
+        flips=((False, False),),
+        crop_aggregation="mean",
+        crop_batch_size=None):
+    """Predict every unique frame of the dataframe once
+
+    Duplicate rows are dropped before predicting and exactly one epoch of the unshuffled iterator is predicted, so
+    no frame is predicted twice. The unique frames of a dataframe with duplicates are compiled into their own
+    dataset ({path_to_dataset_dir}_eval), so that the dataset of the dataframe (e.g. the training dataset) is kept
+
+    With a crop_shape, every frame is expanded into the crop_layout crops (see utilities.image.image.tta_crop_origins)
+    in every flip and the crop predictions of a frame are reduced by crop_aggregation (test-time augmentation).
+    The crops of many frames are predicted together in batches of about crop_batch_size (default
+    config.batch_size frames)
+
+    Returns:
+        Prediction store rows of the frames (see utilities.evaluation.evaluation.prediction_frame)
+    """
+    if dataframe["filename"].duplicated().any():
+        dataframe = dataframe.drop_duplicates("filename")
+
+        if path_to_dataset_dir is not None:
+            path_to_dataset_dir = "{0}_eval".format(path_to_dataset_dir)
+
+    number_crops = None
+    batch_size = None
+    if crop_shape is not None:
+        # Frames are loaded at config.target_shape
+        number_crops = len(flips) * len(tta_crop_origins(config.target_shape, crop_shape, crop_layout))
+        batch_size = max(1, crop_batch_size // number_crops) if crop_batch_size else None
+
+    iterator = flow_from_dataframe_or_dataset(
+        data_generator,
+        dataframe,
+        config,
+        shuffle=False,
+        path_to_dataset_dir=path_to_dataset_dir,
+        num_threads=num_threads,
+        image_dtype=image_dtype,
+        batch_size=batch_size)
+
+    if number_crops is None:
+        predictions = model.predict_generator(
+            iterator,
+            steps=len(iterator),
+            use_multiprocessing=True,
+            verbose=1
+        )
+    else:
+        # The crops are ordered. A single generator thread keeps them so; images are loaded by num_threads
+        crop_predictions = model.predict_generator(
+            tta_crop_generator(iterator, crop_shape, crop_layout, flips),
+            steps=len(iterator),
+            workers=1,
+            use_multiprocessing=False,
+            verbose=1
+        )
+        predictions = reduce_crops(crop_predictions, number_crops, crop_aggregation)
+
+    return prediction_frame(dataframe, iterator.filenames, predictions, split)
+
+
+def split_frozen_base(model):
+    """Split the model into its frozen base and its head
+
+    The base ends at the layer feeding the first layer with trainable weights (e.g. the pooling layer). The head
+    applies the remaining layers, which must form a chain, to the output of the base. Its layers are shared
+    with the model, so training the head trains the model
+    """
+    first_trainable = next(i for i, layer in enumerate(model.layers) if layer.trainable_weights)
+    bottleneck = model.layers[first_trainable - 1]
+
+    base_model = Model(inputs=model.input, outputs=bottleneck.output)
+
+    features = Input(shape=K.int_shape(bottleneck.output)[1:])
+    x = features
+    for layer in model.layers[first_trainable:]:
+        x = layer(x)
+
+    return base_model, Model(inputs=features, outputs=x)
+
+
+def compile_features(
+        base_model,
+        data_generator,
+        dataframe,
+        config,
+        preprocessing,
+        path_to_cache_dir,
+        path_to_dataset_dir=None,
+        num_threads=None):
+    """Compile the cache of the frozen base model features of every image of the dataframe and every flip
+    enabled in the data generator. See utilities.features.features.compile_feature_cache
+
+    The cache is reused while the images, the model and the preprocessing configuration are unchanged
+    """
+    iterator = flow_from_dataframe_or_dataset(
+        ImageDataGenerator(),
+        dataframe,
+        config,
+        shuffle=False,
+        path_to_dataset_dir=path_to_dataset_dir,
+        num_threads=num_threads)
+
+    description = {
+        "model": config.model,
+        "input_shape": list(base_model.input_shape[1:]),
+        "filenames": list(iterator.filenames),
+        "preprocessing": preprocessing
+    }
+
+    return compile_feature_cache(
+        path_to_cache_dir,
+        iterator,
+        data_generator,
+        base_model.predict_on_batch,
+        description)
+
+
+def rescale_inputs(model, rescale):
+    """Prepend the conversion of uint8 batches to float32 and their rescaling to the model
+
+    The batches stay uint8 through loading, flipping, cropping and the transfer from the worker processes.
+    The layers are shared with the given model, which keeps its layer names and weights file layout
+    """
+    inputs = Input(shape=model.input_shape[1:], dtype='uint8')
+    x = Lambda(lambda images: K.cast(images, 'float32') * (rescale or 1.))(inputs)
+    return Model(inputs=inputs, outputs=model(x))
+
 
 def train_model(args):
 
@@ -42,6 +271,9 @@ def train_model(args):
     HISTORY_DF_FILE = "{0}_history.csv".format(args.identifier)
     TEST_PREDICTIONS_DF_FILE = "{0}_test_predictions.csv".format(args.identifier)
     TRAIN_PREDICTIONS_DF_FILE = "{0}_train_predictions.csv".format(args.identifier)
+    PREDICTION_STORE_FILE = "{0}_predictions.npz".format(args.identifier)
+    PATIENT_SCORES_DF_FILE = "{0}_patient_scores.csv".format(args.identifier)
+    PATIENT_PREDICTIONS_DF_FILE = "{0}_patient_predictions.csv".format(args.identifier)
 
     GC_MODEL_SAVE_PATH = "{0}/model/{1}".format(JOB_DIR, MODEL_FILE)
     GC_TRAIN_DF_SAVE_PATH = "{0}/data/{1}".format(JOB_DIR, TRAIN_DF_FILE)
@@ -52,6 +284,18 @@ def train_model(args):
     GC_SCORES_DF_SAVE_PATH = "{0}/data/{1}".format(JOB_DIR, SCORES_DF_FILE)
     GC_TEST_PREDICTIONS_DF_SAVE_PATH = "{0}/data/{1}".format(JOB_DIR, TEST_PREDICTIONS_DF_FILE)
     GC_TRAIN_PREDICTIONS_DF_SAVE_PATH = "{0}/data/{1}".format(JOB_DIR, TRAIN_PREDICTIONS_DF_FILE)
+    GC_PREDICTION_STORE_SAVE_PATH = "{0}/data/{1}".format(JOB_DIR, PREDICTION_STORE_FILE)
+    GC_PATIENT_SCORES_DF_SAVE_PATH = "{0}/data/{1}".format(JOB_DIR, PATIENT_SCORES_DF_FILE)
+    GC_PATIENT_PREDICTIONS_DF_SAVE_PATH = "{0}/data/{1}".format(JOB_DIR, PATIENT_PREDICTIONS_DF_FILE)
+    GC_CHECKPOINT_DIR = "{0}/checkpoints".format(JOB_DIR)
+
+    # Optional: compiled datasets (decoded, cropped images) on local disk. See utilities.dataset
+    TRAIN_DATASET_DIR = None if args.dataset_dir is None else "{0}/{1}_train".format(args.dataset_dir, args.identifier)
+    VALIDATION_DATASET_DIR = None if args.dataset_dir is None else "{0}/{1}_validation".format(args.dataset_dir, args.identifier)
+
+    # Optional: features of the frozen base model on local disk. See utilities.features
+    TRAIN_FEATURES_DIR = None if args.feature_cache_dir is None else "{0}/{1}_train".format(args.feature_cache_dir, args.identifier)
+    VALIDATION_FEATURES_DIR = None if args.feature_cache_dir is None else "{0}/{1}_validation".format(args.feature_cache_dir, args.identifier)
 
     print("Saving all training run outputs to: {0}".format(JOB_DIR))
 
@@ -82,6 +326,24 @@ def train_model(args):
     np.random.seed(config.random_seed)
     tf.set_random_seed(config.random_seed)
 
+    # Optional: keep a local copy of every gs:// image read so that only the first epoch downloads
+    if args.image_cache_dir:
+        print("Caching images in: {0}".format(args.image_cache_dir))
+        set_image_cache(ReadThroughCache(
+            args.image_cache_dir,
+            maximum_bytes=int(args.image_cache_size * 1024 ** 3)))
+
+    # Optional: keep the pretrained weights in a directory of choice. By default in DEFAULT_WEIGHTS_CACHE_DIR
+    if args.weights_cache_dir:
+        print("Caching pretrained weights in: {0}".format(args.weights_cache_dir))
+        set_weights_cache(WeightsCache(args.weights_cache_dir))
+
+    # Optional: keep decoded, cropped images in memory. Shared by the training and prediction iterators
+    if args.decoded_cache_size:
+        print("Caching up to {0}GB of decoded images in memory".format(args.decoded_cache_size))
+        set_decoded_image_cache(DecodedImageCache(
+            maximum_bytes=int(args.decoded_cache_size * 1024 ** 3)))
+
     tb_callback = TensorBoard(
         log_dir=LOGS_PATH,
         batch_size=config.batch_size,
@@ -124,27 +386,73 @@ def train_model(args):
     test_data_generator = ImageDataGenerator(
         **config.image_preprocessing_test.toDict())
 
-    train_generator = train_data_generator.flow_from_dataframe(
-        dataframe=train_df,
-        directory=None,
-        x_col="filename",
-        y_col="class",
-        target_size=config.target_shape,
-        color_mode="rgb",
-        class_mode="binary",
-        classes=TUMOR_TYPES,
-        batch_size=config.batch_size,
+    # Optional: uint8 batches, converted and rescaled by the model. Other normalization is per image
+    # (or depends on the crop) and must be done in float before the batches leave the iterators
+    IMAGE_DTYPE = None
+    if args.uint8_pipeline:
+        if not (train_data_generator._rescale_only and test_data_generator._rescale_only
+                and train_data_generator.rescale == test_data_generator.rescale):
+            print("The uint8 pipeline requires the same rescale and no other normalization in training and test")
+            return
+        IMAGE_DTYPE = "uint8"
+
+    # Optional: train the head from cached features. Only flips (a finite set of variants) can be cached
+    if args.feature_cache_dir and (config.subsample.subsample_shape or not train_data_generator._flip_only):
+        print("The feature cache requires flip-only augmentation and no subsampling")
+        return
+
+    # Optional: resume a preempted training from the checkpoint of an epoch, or from the latest checkpoint
+    checkpoint = None
+    if args.resume or args.checkpoint > 0:
+        checkpoint = load_checkpoint(
+            GC_CHECKPOINT_DIR,
+            args.identifier,
+            epoch=args.checkpoint if args.checkpoint > 0 else None)
+
+        if checkpoint is not None:
+            print("Resuming {0} stage from checkpoint at epoch: {1}".format(checkpoint["stage"], checkpoint["epoch"]))
+        elif args.checkpoint > 0:
+            print("Checkpoint not found: epoch {0} in {1}".format(args.checkpoint, GC_CHECKPOINT_DIR))
+            return
+        else:
+            print("No checkpoint found in {0}. Starting from scratch".format(GC_CHECKPOINT_DIR))
+
+    train_iterator = flow_from_dataframe_or_dataset(
+        train_data_generator,
+        train_df,
+        config,
         shuffle=True,
-        seed=config.random_seed,
-        drop_duplicates=False
-    )
+        path_to_dataset_dir=TRAIN_DATASET_DIR,
+        num_threads=args.loader_threads,
+        image_dtype=IMAGE_DTYPE)
+
+    # Restored before any batch is drawn ahead
+    if checkpoint is not None and checkpoint["iterator"] is not None:
+        train_iterator.set_state(checkpoint["iterator"])
+
+    train_generator = train_iterator
+
+    # The prefetchers provide the parallelism. Keras must not fork copies of them
+    FIT_WORKERS = 1 if args.prefetch_batches else args.num_workers
+    FIT_USE_MULTIPROCESSING = not args.prefetch_batches
+
+    # Optional: produce training batches ahead in background threads (or worker processes writing to
+    # shared memory). Done before the crop generator wraps the iterator so that loading and augmentation
+    # stay parallel
+    prefetchers = []
+    if args.prefetch_batches:
+        train_generator = prefetch(train_generator, args)
+        prefetchers.append(train_generator)
 
     # Optional: subsample each input to batch of randomly placed crops
     if config.subsample.subsample_shape:
+        # Crops are written to reused buffers. A buffer is overwritten once Keras no longer holds its
+        # batch: the queue, the batch being trained on and the batch each worker waits to enqueue
         train_generator = crop_generator(
             train_generator,
             config.subsample.subsample_shape,
-            config.subsample.subsample_batch_size)
+            config.subsample.subsample_batch_size,
+            buffer_count=FIT_MAX_QUEUE_SIZE + FIT_WORKERS + 1)
 
     # Optional: assemble validation DataFrame and validation generator
     if config.validation_split:
@@ -158,20 +466,18 @@ def train_model(args):
         print("Validation DataFrame class breakdown")
         print(validation_df["class"].value_counts())
 
-        validation_generator = test_data_generator.flow_from_dataframe(
-            dataframe=validation_df,
-            directory=None,
-            x_col="filename",
-            y_col="class",
-            target_size=config.target_shape,
-            color_mode="rgb",
-            class_mode="binary",
-            classes=TUMOR_TYPES,
-            batch_size=config.batch_size,
+        validation_generator = flow_from_dataframe_or_dataset(
+            test_data_generator,
+            validation_df,
+            config,
             shuffle=True,
-            seed=config.random_seed,
-            drop_duplicates=False
-        )
+            path_to_dataset_dir=VALIDATION_DATASET_DIR,
+            num_threads=args.loader_threads,
+            image_dtype=IMAGE_DTYPE)
+
+        if args.prefetch_batches:
+            validation_generator = prefetch(validation_generator, args)
+            prefetchers.append(validation_generator)
     else:
         # Config does not specify validation split
         validation_generator = None
@@ -188,32 +494,117 @@ def train_model(args):
     with tf.device('/device:GPU:0'):
 
         # Load the model specified in config
-        model = import_module("models.{0}".format(
+        classifier = import_module("models.{0}".format(
             config.model)).get_model(config)
 
+        model = classifier
+        if args.uint8_pipeline:
+            model = rescale_inputs(classifier, train_data_generator.rescale)
+
         model.compile(
             optimizer=Adam(lr=config.learning_rate),
             loss=config.loss,
             metrics=['accuracy'])
 
-        # Train the classifier on top of the base model
-        history = model.fit_generator(
-            train_generator,
-            steps_per_epoch=len(train_df) // config.batch_size,
-            epochs=config.training_epochs,
-            validation_data=validation_generator,
-            validation_steps=len(validation_df) // config.batch_size,
-            verbose=2,
-            use_multiprocessing=True,
-            workers=args.num_workers
-        )
+        # Epochs are numbered across stages. Fine-tuning continues at epoch training_epochs
+        CHECKPOINT_EPOCH = checkpoint["epoch"] if checkpoint is not None else 0
+        RESUME_FINE_TUNE = checkpoint is not None and checkpoint["stage"] == "fine_tune"
+
+        if RESUME_FINE_TUNE:
+            print("Skipping training stage. Completed before the checkpoint")
+
+        elif args.feature_cache_dir:
+            # Run the frozen base once per image and flip, then train the classifier on the cached features
+            base_model, head_model = split_frozen_base(classifier)
+
+            head_model.compile(
+                optimizer=Adam(lr=config.learning_rate),
+                loss=config.loss,
+                metrics=['accuracy'])
+
+            if checkpoint is not None:
+                restore_checkpoint(checkpoint, GC_CHECKPOINT_DIR, classifier, head_model)
+
+            train_index, train_features = compile_features(
+                base_model,
+                train_data_generator,
+                train_df,
+                config,
+                config.image_preprocessing_train.toDict(),
+                TRAIN_FEATURES_DIR,
+                path_to_dataset_dir=TRAIN_DATASET_DIR,
+                num_threads=args.loader_threads)
+
+            validation_index, validation_features = compile_features(
+                base_model,
+                test_data_generator,
+                validation_df,
+                config,
+                config.image_preprocessing_test.toDict(),
+                VALIDATION_FEATURES_DIR,
+                path_to_dataset_dir=VALIDATION_DATASET_DIR,
+                num_threads=args.loader_threads)
+
+            checkpoint_callback = TrainingCheckpoint(
+                GC_CHECKPOINT_DIR,
+                args.identifier,
+                "train",
+                classifier,
+                history=checkpoint["history"] if checkpoint is not None else None,
+                period=args.checkpoint_period)
+
+            head_model.fit_generator(
+                feature_batches(
+                    train_features,
+                    train_index["labels"],
+                    config.batch_size,
+                    seed=config.random_seed + CHECKPOINT_EPOCH),
+                steps_per_epoch=len(train_df) // config.batch_size,
+                epochs=config.training_epochs,
+                initial_epoch=CHECKPOINT_EPOCH,
+                validation_data=feature_batches(
+                    validation_features,
+                    validation_index["labels"],
+                    config.batch_size,
+                    seed=config.random_seed),
+                validation_steps=len(validation_df) // config.batch_size,
+                verbose=2,
+                callbacks=[checkpoint_callback]
+            )
+        else:
+            if checkpoint is not None:
+                restore_checkpoint(checkpoint, GC_CHECKPOINT_DIR, classifier, model)
+
+            checkpoint_callback = TrainingCheckpoint(
+                GC_CHECKPOINT_DIR,
+                args.identifier,
+                "train",
+                classifier,
+                iterator=train_iterator,
+                history=checkpoint["history"] if checkpoint is not None else None,
+                period=args.checkpoint_period)
+
+            # Train the classifier on top of the base model
+            model.fit_generator(
+                train_generator,
+                steps_per_epoch=len(train_df) // config.batch_size,
+                epochs=config.training_epochs,
+                initial_epoch=CHECKPOINT_EPOCH,
+                validation_data=validation_generator,
+                validation_steps=len(validation_df) // config.batch_size,
+                verbose=2,
+                max_queue_size=FIT_MAX_QUEUE_SIZE,
+                use_multiprocessing=FIT_USE_MULTIPROCESSING,
+                workers=FIT_WORKERS,
+                callbacks=[checkpoint_callback]
+            )
 
         # Fine tune the base model if specified in config
         if config.fine_tune:
             for layer_name in config.fine_tune.layers:                
                 print("Setting layer {0} trainable".format(layer_name))
                 # Set the next layer down as Trainable
-                model.get_layer(layer_name).trainable = True
+                classifier.get_layer(layer_name).trainable = True
                        
             # Recompile the model to reflect new trainable layer
             model.compile(
@@ -221,103 +612,97 @@ def train_model(args):
                 loss=config.loss,
                 metrics=['accuracy'])
 
-            start_epoch = history.params['epochs']
+            if RESUME_FINE_TUNE:
+                restore_checkpoint(checkpoint, GC_CHECKPOINT_DIR, classifier, model)
+
+            start_epoch = max(config.training_epochs, CHECKPOINT_EPOCH)
             print("Starting fine-tune training at epoch: {0}".format(start_epoch))
 
-            # Fit the generator with this number of epochs
-            history = model.fit_generator(
+            checkpoint_callback = TrainingCheckpoint(
+                GC_CHECKPOINT_DIR,
+                args.identifier,
+                "fine_tune",
+                classifier,
+                iterator=train_iterator,
+                history=checkpoint["history"] if RESUME_FINE_TUNE else None,
+                period=args.checkpoint_period)
+
+            # Fit the generator for fine_tune.epochs more epochs
+            model.fit_generator(
                 train_generator,
                 steps_per_epoch=len(train_df) // config.batch_size,
-                epochs=config.fine_tune.epochs,
+                epochs=config.training_epochs + config.fine_tune.epochs,
+                initial_epoch=start_epoch,
                 validation_data=validation_generator,
                 validation_steps=len(validation_df) // config.batch_size,
                 verbose=2,
-                use_multiprocessing=True,
-                workers=args.num_workers,
-                callbacks=[tb_callback]
+                max_queue_size=FIT_MAX_QUEUE_SIZE,
+                use_multiprocessing=FIT_USE_MULTIPROCESSING,
+                workers=FIT_WORKERS,
+                callbacks=[tb_callback, checkpoint_callback]
             )
 
+        # Logs of every epoch of the last stage, including the epochs before a resume
+        history = checkpoint_callback.history
+
+    for prefetcher in prefetchers:
+        prefetcher.close()
+
     '''
     Evaluate
     '''
 
-    test_generator = test_data_generator.flow_from_dataframe(
-        dataframe=validation_df,
-        directory=None,
-        x_col="filename",
-        y_col="class",
-        target_size=config.target_shape,
-        color_mode="rgb",
-        class_mode="binary",
-        classes=TUMOR_TYPES,
-        batch_size=config.batch_size,
-        shuffle=False,
-        seed=config.random_seed,
-        drop_duplicates=False
-    )
-
-    train_prediction_generator = test_data_generator.flow_from_dataframe(
-        dataframe=train_df,
-        directory=None,
-        x_col="filename",
-        y_col="class",
-        target_size=config.target_shape,
-        color_mode="rgb",
-        class_mode="binary",
-        classes=TUMOR_TYPES,
-        batch_size=config.batch_size,
-        shuffle=False,
-        seed=config.random_seed,
-        drop_duplicates=False
-    )
-
-    test_predictions = model.predict_generator(
-        test_generator,
-        steps=(len(validation_df) // config.batch_size) + 1,
-        use_multiprocessing=True,
-        verbose=1
-    )
-
-    training_predictions = model.predict_generator(
-        train_prediction_generator,
-        steps=(len(train_df) // config.batch_size) + 1,
-        use_multiprocessing=True,
-        verbose=1
-    )
-
-    # Compute AUC score
-    auc_score = roc_auc_score(validation_df['class'].astype('category').cat.codes, test_predictions)
-    # ROC curve 
-    fpr, tpr, roc_thresholds = roc_curve(validation_df['class'], test_predictions, pos_label='MALIGNANT')
-    # Precision-Recall curve
-    precision, recall, pr_thresholds = precision_recall_curve(validation_df['class'], test_predictions, pos_label='MALIGNANT')
-    # Confusion matrix based metrics    
-    cm = confusion_matrix(validation_df['class'].astype('category').cat.codes, test_predictions.round())               
-    TP = cm[0][0]
-    FP = cm[0][1]
-    FN = cm[1][0]
-    TN = cm[1][1]
-    TPR = TP/(TP+FN) # Sensitivity, hit rate, recall
-    TNR = TN/(TN+FP) # Specificity or true negative rate
-    PPV = TP/(TP+FP) # Precision or positive predictive value
-    NPV = TN/(TN+FN) # Negative predictive value
-    FNR = FN/(TP+FN) # False negative rate
-
-    roc_df = pd.DataFrame(data={'fpr':fpr, 'tpr':tpr, 'thresholds':roc_thresholds})
-
-    pr_df = pd.DataFrame(data={'recall':recall[:-1], 'precision':precision[:-1], 'thresholds':pr_thresholds})
-
-    scores_df = pd.DataFrame(data={'AUC':auc_score, 'Sensitivity': TPR, 'Specificity':TNR, 'PPV': PPV, 'NPV':NPV, 'FNR':FNR, 'TP':TP, 'FP':FP, 'FN':FN, 'TN':TN}, index=[0])
-    
-    # Enforce column headers
-    scores_df = scores_df[['AUC', 'Sensitivity', 'Specificity', 'PPV', 'NPV', 'FNR', 'TP', 'FP', 'FN', 'TN']]
-
-    test_predictions_df = pd.DataFrame(test_predictions, columns=["predictions"])
-    training_predictions_df = pd.DataFrame(training_predictions, columns=["predictions"])
+    # Optional: test-time augmentation. Every frame is predicted as the crops the model was trained on, in every
+    # flip of the training augmentation
+    TTA_OPTIONS = {}
+    if args.tta:
+        TTA_OPTIONS = {
+            "crop_shape": config.subsample.subsample_shape or config.target_shape,
+            "crop_layout": args.tta,
+            "flips": flip_variants(train_data_generator),
+            "crop_aggregation": args.tta_aggregation,
+            "crop_batch_size": args.tta_batch_size
+        }
+
+    # Every unique frame is predicted once. The scores are computed from the prediction store, which is saved so
+    # that other patient aggregations can be scored without the network (python -m utilities.evaluation)
+    prediction_store = pd.concat([
+        predict_frames(
+            model,
+            test_data_generator,
+            validation_df,
+            "validation",
+            config,
+            path_to_dataset_dir=VALIDATION_DATASET_DIR,
+            num_threads=args.loader_threads,
+            image_dtype=IMAGE_DTYPE,
+            **TTA_OPTIONS),
+        predict_frames(
+            model,
+            test_data_generator,
+            train_df,
+            "train",
+            config,
+            path_to_dataset_dir=TRAIN_DATASET_DIR,
+            num_threads=args.loader_threads,
+            image_dtype=IMAGE_DTYPE,
+            **TTA_OPTIONS)
+    ], ignore_index=True)
+
+    validation_store = prediction_store[prediction_store["split"] == "validation"]
+    roc_df, pr_df, scores_df = binary_classification_metrics(validation_store["class"], validation_store["prediction"])
+
+    patient_predictions_df = aggregate_patients(prediction_store, args.patient_aggregation)
+    validation_patients = patient_predictions_df[patient_predictions_df["split"] == "validation"]
+    _, _, patient_scores_df = binary_classification_metrics(validation_patients["class"], validation_patients["prediction"])
+
+    # One prediction per dataframe row
+    test_predictions_df = pd.DataFrame(frame_predictions(prediction_store, validation_df), columns=["predictions"])
+    training_predictions_df = pd.DataFrame(frame_predictions(prediction_store, train_df), columns=["predictions"])
 
     if not IN_LOCAL_TRAINING_MODE:
         # Save the model
-        model.save_weights(MODEL_FILE)
+        classifier.save_weights(MODEL_FILE)
 
         # Save the model on GC storage
         with file_io.FileIO(MODEL_FILE, mode="rb") as input_f:
@@ -326,7 +711,7 @@ def train_model(args):
 
         # Save the training history on GC storage
         with file_io.FileIO(GC_HISTORY_DF_SAVE_PATH, mode="wb+") as output_f:
-            pd.DataFrame(history.history).to_csv(output_f, index=False)
+            pd.DataFrame(history).to_csv(output_f, index=False)
 
         # Save the ROC curve on GC storage
         with file_io.FileIO(GC_ROC_DF_SAVE_PATH, mode="wb+") as output_f:
@@ -348,6 +733,22 @@ def train_model(args):
         with file_io.FileIO(GC_TRAIN_PREDICTIONS_DF_SAVE_PATH, mode="wb+") as output_f:
             training_predictions_df.to_csv(output_f, index=False)
 
+        # Save the patient scores and predictions on GC storage
+        with file_io.FileIO(GC_PATIENT_SCORES_DF_SAVE_PATH, mode="wb+") as output_f:
+            patient_scores_df.to_csv(output_f, index=False)
+
+        with file_io.FileIO(GC_PATIENT_PREDICTIONS_DF_SAVE_PATH, mode="wb+") as output_f:
+            patient_predictions_df.to_csv(output_f, index=False)
+
+    # Save the prediction store, also in local mode, so the predictions can be scored again without the network
+    if not file_io.is_directory("{0}/data".format(JOB_DIR)):
+        file_io.recursive_create_dir("{0}/data".format(JOB_DIR))
+
+    prediction_store_buffer = io.BytesIO()
+    write_prediction_store(prediction_store, prediction_store_buffer)
+    with file_io.FileIO(GC_PREDICTION_STORE_SAVE_PATH, mode="wb+") as output_f:
+        output_f.write(prediction_store_buffer.getvalue())
+
 
 if __name__ == "__main__":
 
@@ -382,6 +783,48 @@ if __name__ == "__main__":
         help="checkpoint (epoch id) that will be loaded. If a negative value is passed, default to zero"
     )
 
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume from the latest checkpoint of the job if there is one. e.g. after a preemption"
+    )
+
+    parser.add_argument(
+        "--checkpoint-period",
+        type=int,
+        default=1,
+        help="Number of epochs between checkpoints (weights, optimizer state, data position). 0 disables checkpoints"
+    )
+
+    parser.add_argument(
+        "--patient-aggregation",
+        choices=sorted(PATIENT_AGGREGATIONS.keys()),
+        default="mean",
+        help="Rule reducing the frame predictions of a patient to the patient prediction of the patient scores"
+    )
+
+    parser.add_argument(
+        "--tta",
+        choices=TTA_CROP_LAYOUTS,
+        default=None,
+        help="Test-time augmentation for the evaluation. Every frame is predicted as the center crop ('center') or "
+             "the center and four corner crops ('corners') of the training crop shape, in every training flip"
+    )
+
+    parser.add_argument(
+        "--tta-aggregation",
+        choices=sorted(PATIENT_AGGREGATIONS.keys()),
+        default="mean",
+        help="Rule reducing the crop predictions of a frame to the frame prediction with --tta"
+    )
+
+    parser.add_argument(
+        "--tta-batch-size",
+        type=int,
+        default=None,
+        help="Number of crops per prediction batch with --tta. Default: the crops of batch_size frames"
+    )
+
     parser.add_argument(
         "-j",
         "--job-dir",
@@ -396,8 +839,58 @@ if __name__ == "__main__":
         default=None
     )
 
+    parser.add_argument(
+        "-D",
+        "--dataset-dir",
+        help="Local directory for compiled (decoded and cropped) datasets. Images are decoded once instead of every epoch",
+        default=None
+    )
+
+    parser.add_argument(
+        "--feature-cache-dir",
+        help="Local directory for the features of the frozen base model. The base runs once per image and flip "
+             "and the classifier is trained from the features",
+        default=None
+    )
+
+    parser.add_argument(
+        "--image-cache-dir",
+        help="Local directory caching images read from Google Cloud Storage",
+        default=None
+    )
+
+    parser.add_argument(
+        "--image-cache-size",
+        type=float,
+        default=10,
+        help="Size bound of the image cache in GB. Least recently used images are evicted"
+    )
+
+    parser.add_argument(
+        "--weights-cache-dir",
+        help="Local directory caching the pretrained weights read from Google Cloud Storage. Default ~/.keras/weights_cache",
+        default=None
+    )
+
+    parser.add_argument(
+        "--decoded-cache-size",
+        type=float,
+        default=0,
+        help="Size bound in GB of the in-memory cache of decoded, cropped images. 0 disables the cache"
+    )
+
+    parser.add_argument('--loader-threads', type=int, default=None,
+                        help='number of threads loading the images of a batch')
     parser.add_argument('--num-workers', type=int, default=1,
                         help='number of data loading workers')
+    parser.add_argument('--prefetch-batches', type=int, default=0,
+                        help='number of batches produced ahead by --num-workers threads. 0 disables prefetching')
+    parser.add_argument('--shared-memory-prefetch', action='store_true',
+                        help='prefetch in --num-workers processes writing batches to shared memory instead of '
+                             'threads. Requires --prefetch-batches')
+    parser.add_argument('--uint8-pipeline', action='store_true',
+                        help='keep batches uint8 until the model converts and rescales them. Requires flip-only '
+                             'augmentation and rescale-only normalization')
     parser.add_argument('--disp-step', type=int, default=200,
                         help='display step during training')
     parser.add_argument('--cuda', type=bool, default=True, help='enable CUDA')
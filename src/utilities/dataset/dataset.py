@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from keras_preprocessing.image.utils import load_img_array
+from keras_preprocessing.image.shard_iterator import (
+    SHARD_FORMAT_VERSION,
+    SHARD_IMAGES_FILENAME,
+    SHARD_INDEX_FILENAME,
+    load_shard_index)
+
+# Images per shard. 4096 RGB images of 224x224 are ~600MB
+DEFAULT_SHARD_SIZE = 4096
+
+COLOR_MODE_CHANNELS = {
+    'grayscale': 1,
+    'rgb': 3,
+    'rgba': 4
+}
+
+
+def dataset_fingerprint(filenames, labels, target_size, color_mode, interpolation):
+    """Hash of everything that determines the content of a compiled dataset"""
+    description = json.dumps({
+        "format_version": SHARD_FORMAT_VERSION,
+        "filenames": list(filenames),
+        "labels": list(labels),
+        "target_size": list(target_size),
+        "color_mode": color_mode,
+        "interpolation": interpolation
+    }, sort_keys=True)
+
+    return hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+
+def load_image_array(path, target_size, color_mode='rgb', interpolation='nearest'):
+    """Load, auto upscale and center crop an image exactly as the DataFrameIterator does. Returns uint8 HxWxC"""
+    image_array = load_img_array(path, color_mode=color_mode, target_size=target_size, interpolation=interpolation)
+
+    if image_array.ndim == 2:
+        image_array = image_array[:, :, np.newaxis]
+
+    return image_array
+
+
+def compile_dataset(
+        dataframe,
+        path_to_dataset_dir,
+        target_size,
+        classes,
+        color_mode='rgb',
+        interpolation='nearest',
+        x_col="filename",
+        y_col="class",
+        patient_col="patient",
+        shard_size=DEFAULT_SHARD_SIZE):
+    """Decode and crop every image of a dataframe once into memory-mappable shards
+
+    The dataset directory holds uint8 image shards (images_XXXXX.npy) and an index (dataset.json) with the
+    labels, patient ids and filenames of every sample. The index is written last so a directory is only
+    considered compiled once every shard is complete. If the directory already holds a dataset compiled from
+    the same frames and parameters, nothing is done. Iterate the dataset with ImageDataGenerator.flow_from_shards
+
+    Arguments:
+        dataframe                           DataFrame with absolute image paths, classes and patient ids
+                                                (see patient_lists_to_dataframe)
+        path_to_dataset_dir                 Local directory to write the dataset to. Shards are memory-mapped so
+                                                the directory must be on a local disk
+        target_size                         (height, width) of the images in the dataset. e.g. config.target_shape
+        classes                             List of class names. Index in the list is the integer label
+
+    Optional:
+        color_mode                          One of "grayscale", "rgb", "rgba". Default "rgb"
+        interpolation                       Interpolation used to upscale images smaller than target_size
+        x_col                               Column containing the image paths
+        y_col                               Column containing the class names
+        patient_col                         Column containing the patient ids
+        shard_size                          Maximum number of images in a shard
+
+    Returns:
+        The dataset index (dictionary)
+    """
+    target_size = tuple(target_size)
+    class_indices = dict(zip(classes, range(len(classes))))
+
+    filenames = dataframe[x_col].tolist()
+    labels = [class_indices[label] for label in dataframe[y_col]]
+    patients = dataframe[patient_col].tolist()
+
+    fingerprint = dataset_fingerprint(filenames, labels, target_size, color_mode, interpolation)
+
+    existing_index = load_shard_index(path_to_dataset_dir)
+
+    if existing_index is not None and existing_index["fingerprint"] == fingerprint:
+        print("Dataset up to date: {0}".format(path_to_dataset_dir))
+        return existing_index
+
+    if not os.path.isdir(path_to_dataset_dir):
+        os.makedirs(path_to_dataset_dir)
+
+    # Invalidate any previous dataset before overwriting its shards
+    if existing_index is not None:
+        os.remove(os.path.join(path_to_dataset_dir, SHARD_INDEX_FILENAME))
+
+    image_shape = target_size + (COLOR_MODE_CHANNELS[color_mode],)
+    shards = []
+
+    for shard_start in range(0, len(filenames), shard_size):
+        shard_filenames = filenames[shard_start: shard_start + shard_size]
+        shard_filename = SHARD_IMAGES_FILENAME.format(len(shards))
+
+        print("Compiling shard {0} ({1} images)".format(shard_filename, len(shard_filenames)))
+
+        # Written through a memory map so a shard is never held in memory as a whole
+        shard = np.lib.format.open_memmap(
+            os.path.join(path_to_dataset_dir, shard_filename),
+            mode="w+",
+            dtype=np.uint8,
+            shape=(len(shard_filenames),) + image_shape)
+
+        for i, filename in enumerate(shard_filenames):
+            image_array = load_image_array(filename, target_size, color_mode, interpolation)
+
+            if image_array.shape != image_shape:
+                raise ValueError("Image {0} has shape {1} after cropping. Expected {2}".format(
+                    filename, image_array.shape, image_shape))
+
+            shard[i] = image_array
+
+        shard.flush()
+        del shard
+
+        shards.append({"filename": shard_filename, "samples": len(shard_filenames)})
+
+    index = {
+        "format_version": SHARD_FORMAT_VERSION,
+        "fingerprint": fingerprint,
+        "target_size": list(target_size),
+        "channels": COLOR_MODE_CHANNELS[color_mode],
+        "color_mode": color_mode,
+        "interpolation": interpolation,
+        "classes": list(classes),
+        "filenames": filenames,
+        "labels": labels,
+        "patients": patients,
+        "shards": shards
+    }
+
+    with open(os.path.join(path_to_dataset_dir, SHARD_INDEX_FILENAME), "w") as f:
+        json.dump(index, f)
+
+    return index
@@ -0,0 +1,43 @@
+import argparse
+
+from utilities.evaluation.evaluation import (
+    PATIENT_AGGREGATIONS,
+    aggregate_patients,
+    binary_classification_metrics,
+    read_prediction_store)
+
+PARSER = argparse.ArgumentParser(
+    description="Frame and patient level scores of a prediction store. The network is not run")
+
+PARSER.add_argument(
+    "predictions",
+    type=str,
+    help="Path to a prediction store (<identifier>_predictions.npz) written by train_model")
+
+PARSER.add_argument(
+    "--aggregation",
+    choices=sorted(PATIENT_AGGREGATIONS.keys()),
+    default="mean",
+    help="Rule reducing the frame predictions of a patient to a patient prediction")
+
+PARSER.add_argument(
+    "--split",
+    type=str,
+    default="validation",
+    help="Split of the store to score")
+
+ARGS = PARSER.parse_args()
+
+with open(ARGS.predictions, "rb") as input_f:
+    STORE = read_prediction_store(input_f)
+
+STORE = STORE[STORE["split"] == ARGS.split]
+
+_, _, FRAME_SCORES = binary_classification_metrics(STORE["class"], STORE["prediction"])
+PATIENTS = aggregate_patients(STORE, ARGS.aggregation)
+_, _, PATIENT_SCORES = binary_classification_metrics(PATIENTS["class"], PATIENTS["prediction"])
+
+print("Frame scores ({0} frames)".format(len(STORE)))
+print(FRAME_SCORES.to_string(index=False))
+print("Patient scores ({0} patients, {1} of frame predictions)".format(len(PATIENTS), ARGS.aggregation))
+print(PATIENT_SCORES.to_string(index=False))
@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+
+from sklearn.metrics import roc_curve, precision_recall_curve, confusion_matrix, roc_auc_score
+
+# Columns of a prediction store. One row per unique frame
+PREDICTION_STORE_COLUMNS = ["filename", "patient", "class", "split", "prediction"]
+
+# Rules reducing the frame predictions of a patient to a patient prediction
+PATIENT_AGGREGATIONS = {
+    "mean": np.mean,
+    "median": np.median,
+    "max": np.max,
+    "min": np.min,
+    "vote": lambda predictions: np.mean(np.round(predictions))
+}
+
+SCORE_COLUMNS = ['AUC', 'Sensitivity', 'Specificity', 'PPV', 'NPV', 'FNR', 'TP', 'FP', 'FN', 'TN']
+
+
+def prediction_frame(dataframe, filenames, predictions, split, x_col="filename", y_col="class", patient_col="patient"):
+    """Prediction store rows of the frames predicted in one pass
+
+    Arguments:
+        dataframe                           DataFrame of the frames (see patient_lists_to_dataframe)
+        filenames                           Unique filenames in prediction order (e.g. iterator.filenames)
+        predictions                         Prediction of every filename
+        split                               Name of the split of the frames, e.g. "train" or "validation"
+
+    Optional:
+        x_col                               Column containing the image paths
+        y_col                               Column containing the class names
+        patient_col                         Column containing the patient ids
+
+    Returns:
+        DataFrame with the PREDICTION_STORE_COLUMNS, in prediction order
+    """
+    frames = dataframe.drop_duplicates(x_col).set_index(x_col).loc[list(filenames)]
+
+    return pd.DataFrame({
+        "filename": list(filenames),
+        "patient": frames[patient_col].values,
+        "class": frames[y_col].values,
+        "split": split,
+        "prediction": np.asarray(predictions, dtype=np.float32).reshape(-1)
+    }, columns=PREDICTION_STORE_COLUMNS)
+
+
+def reduce_crops(predictions, number_crops, aggregation="mean"):
+    """Frame predictions of consecutive crop predictions (e.g. of utilities.image.image.tta_crop_generator)
+
+    Arguments:
+        predictions                         Prediction of every crop, number_crops consecutive crops per frame
+        number_crops                        Number of crops per frame
+
+    Optional:
+        aggregation                         Name of a rule in PATIENT_AGGREGATIONS or a function reducing an array
+                                                of crop predictions. Default "mean"
+
+    Returns:
+        Array with the prediction of every frame
+    """
+    rule = PATIENT_AGGREGATIONS[aggregation] if isinstance(aggregation, str) else aggregation
+    predictions = np.asarray(predictions, dtype=np.float32).reshape((-1, number_crops))
+
+    return np.array([rule(crop_predictions) for crop_predictions in predictions], dtype=np.float32)
+
+
+def write_prediction_store(store, output_f):
+    """Write a prediction store to a binary file object. Every column is stored as its own array"""
+    np.savez(output_f, **{column: np.asarray(store[column].tolist(), dtype=np.float32 if column == "prediction" else str)
+                          for column in PREDICTION_STORE_COLUMNS})
+
+
+def read_prediction_store(input_f):
+    """Read a prediction store written by write_prediction_store from a binary file object"""
+    arrays = np.load(input_f)
+
+    return pd.DataFrame({column: arrays[column] for column in PREDICTION_STORE_COLUMNS},
+                        columns=PREDICTION_STORE_COLUMNS)
+
+
+def frame_predictions(store, dataframe, x_col="filename"):
+    """Prediction of every row of a dataframe, looked up by filename. Duplicate rows share a prediction"""
+    predictions = store.drop_duplicates("filename").set_index("filename")["prediction"]
+
+    return predictions.loc[dataframe[x_col].tolist()].values
+
+
+def aggregate_patients(store, aggregation="mean"):
+    """Patient predictions of a prediction store
+
+    Arguments:
+        store                               Prediction store (PREDICTION_STORE_COLUMNS)
+
+    Optional:
+        aggregation                         Name of a rule in PATIENT_AGGREGATIONS or a function reducing an array
+                                                of frame predictions. Default "mean"
+
+    Returns:
+        DataFrame with one row per split and patient: patient, class, split, prediction and frames (count)
+    """
+    rule = PATIENT_AGGREGATIONS[aggregation] if isinstance(aggregation, str) else aggregation
+
+    patients = store.groupby(["split", "patient"], sort=True).agg(
+        patient_class=("class", "first"),
+        prediction=("prediction", lambda predictions: rule(predictions.values)),
+        frames=("prediction", "size")).reset_index()
+
+    patients = patients.rename(columns={"patient_class": "class"})
+
+    return patients[["patient", "class", "split", "prediction", "frames"]]
+
+
+def binary_classification_metrics(classes, predictions, positive_class="MALIGNANT"):
+    """ROC curve, precision-recall curve and confusion matrix based scores of binary predictions
+
+    Arguments:
+        classes                             Class name of every sample
+        predictions                         Predicted probability of positive_class of every sample
+
+    Optional:
+        positive_class                      Name of the positive class. Default "MALIGNANT"
+
+    Returns:
+        (roc_df, pr_df, scores_df) DataFrames
+    """
+    classes = pd.Series(np.asarray(classes))
+    predictions = np.asarray(predictions, dtype=np.float32).reshape(-1)
+    class_codes = classes.astype('category').cat.codes
+
+    # Compute AUC score
+    auc_score = roc_auc_score(class_codes, predictions)
+    # ROC curve
+    fpr, tpr, roc_thresholds = roc_curve(classes, predictions, pos_label=positive_class)
+    # Precision-Recall curve
+    precision, recall, pr_thresholds = precision_recall_curve(classes, predictions, pos_label=positive_class)
+    # Confusion matrix based metrics
+    cm = confusion_matrix(class_codes, predictions.round())
+    TP = cm[0][0]
+    FP = cm[0][1]
+    FN = cm[1][0]
+    TN = cm[1][1]
+    TPR = TP/(TP+FN) # Sensitivity, hit rate, recall
+    TNR = TN/(TN+FP) # Specificity or true negative rate
+    PPV = TP/(TP+FP) # Precision or positive predictive value
+    NPV = TN/(TN+FN) # Negative predictive value
+    FNR = FN/(TP+FN) # False negative rate
+
+    roc_df = pd.DataFrame(data={'fpr':fpr, 'tpr':tpr, 'thresholds':roc_thresholds})
+
+    pr_df = pd.DataFrame(data={'recall':recall[:-1], 'precision':precision[:-1], 'thresholds':pr_thresholds})
+
+    scores_df = pd.DataFrame(data={'AUC':auc_score, 'Sensitivity': TPR, 'Specificity':TNR, 'PPV': PPV, 'NPV':NPV, 'FNR':FNR, 'TP':TP, 'FP':FP, 'FN':FN, 'TN':TN}, index=[0])
+
+    # Enforce column headers
+    scores_df = scores_df[SCORE_COLUMNS]
+
+    return roc_df, pr_df, scores_df
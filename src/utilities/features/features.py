@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# Version of the on-disk feature cache layout. Bump when the layout changes
+FEATURE_CACHE_FORMAT_VERSION = 1
+FEATURE_CACHE_INDEX_FILENAME = 'features.json'
+FEATURE_CACHE_FEATURES_FILENAME = 'features.npy'
+
+
+def flip_variants(image_data_generator):
+    """Every combination of the flips enabled in an ImageDataGenerator as (horizontal, vertical) pairs.
+    The identity comes first"""
+    horizontal_flips = [False, True] if image_data_generator.horizontal_flip else [False]
+    vertical_flips = [False, True] if image_data_generator.vertical_flip else [False]
+
+    return [(horizontal, vertical) for vertical in vertical_flips for horizontal in horizontal_flips]
+
+
+def feature_cache_fingerprint(description, labels, variants):
+    """Hash of everything that determines the content of a feature cache"""
+    description = json.dumps({
+        "format_version": FEATURE_CACHE_FORMAT_VERSION,
+        "description": description,
+        "labels": list(labels),
+        "variants": [list(variant) for variant in variants]
+    }, sort_keys=True)
+
+    return hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+
+def load_feature_cache(path_to_cache_dir):
+    """Index and memory-mapped features (variants, samples, ...) of a compiled feature cache. None if the
+    directory holds no complete cache"""
+    index_path = os.path.join(path_to_cache_dir, FEATURE_CACHE_INDEX_FILENAME)
+
+    if not os.path.isfile(index_path):
+        return None
+
+    with open(index_path) as f:
+        index = json.load(f)
+
+    if index.get("format_version") != FEATURE_CACHE_FORMAT_VERSION:
+        return None
+
+    features = np.load(os.path.join(path_to_cache_dir, FEATURE_CACHE_FEATURES_FILENAME), mmap_mode='r')
+
+    return index, features
+
+
+def compile_feature_cache(
+        path_to_cache_dir,
+        iterator,
+        image_data_generator,
+        extract_features,
+        description):
+    """Run a frozen feature extractor once over every image and deterministic augmentation of an iterator and
+    cache the features on disk
+
+    The deterministic augmentations are the combinations of the flips enabled in image_data_generator. Every
+    image is flipped and then normalized by image_data_generator, as ImageDataGenerator would, before the
+    features are extracted. The cache directory holds the features (features.npy) and an index (features.json)
+    with the labels and flip variants. The index is written last so a directory is only considered compiled
+    once the features are complete. If the directory already holds a cache with the same description, labels
+    and variants, nothing is done. Train from the cache with feature_batches
+
+    Arguments:
+        path_to_cache_dir                   Local directory to write the cache to
+        iterator                            Unshuffled iterator of batches of unnormalized, unaugmented images
+                                                (e.g. ImageDataGenerator().flow_from_dataframe(..., shuffle=False))
+                                                with a classes attribute
+        image_data_generator                ImageDataGenerator defining the flips and the normalization
+        extract_features                    Function from a batch of images to a batch of features. e.g. the
+                                                predict_on_batch method of the frozen base model
+        description                         JSON serializable description of everything else that determines
+                                                the features (e.g. images, model and preprocessing configuration)
+
+    Returns:
+        The cache index (dictionary) and the memory-mapped features (variants, samples, ...)
+    """
+    labels = np.asarray(iterator.classes).tolist()
+    variants = flip_variants(image_data_generator)
+    fingerprint = feature_cache_fingerprint(description, labels, variants)
+
+    existing_cache = load_feature_cache(path_to_cache_dir)
+
+    if existing_cache is not None and existing_cache[0]["fingerprint"] == fingerprint:
+        print("Feature cache up to date: {0}".format(path_to_cache_dir))
+        return existing_cache
+
+    if not os.path.isdir(path_to_cache_dir):
+        os.makedirs(path_to_cache_dir)
+
+    # Invalidate any previous cache before overwriting its features
+    if existing_cache is not None:
+        del existing_cache
+        os.remove(os.path.join(path_to_cache_dir, FEATURE_CACHE_INDEX_FILENAME))
+
+    print("Extracting features of {0} images in {1} variants".format(len(labels), len(variants)))
+
+    features = None
+    sample = 0
+
+    for batch_number in range(len(iterator)):
+        batch = iterator[batch_number]
+        images = batch[0] if isinstance(batch, tuple) else batch
+        batch_size = len(images)
+
+        for variant, (horizontal, vertical) in enumerate(variants):
+            flipped_images = image_data_generator.apply_transform_batch(images, {
+                "flip_horizontal": np.repeat(horizontal, batch_size),
+                "flip_vertical": np.repeat(vertical, batch_size)
+            })
+
+            # Unflipped images are returned as is. Normalization is in-place
+            if flipped_images is images:
+                flipped_images = images.copy()
+
+            batch_features = np.asarray(extract_features(image_data_generator.standardize_batch(flipped_images)))
+
+            # Written through a memory map so the features are never held in memory as a whole
+            if features is None:
+                features = np.lib.format.open_memmap(
+                    os.path.join(path_to_cache_dir, FEATURE_CACHE_FEATURES_FILENAME),
+                    mode="w+",
+                    dtype=np.float32,
+                    shape=(len(variants), len(labels)) + batch_features.shape[1:])
+
+            features[variant, sample: sample + batch_size] = batch_features
+
+        sample += batch_size
+
+    if sample != len(labels):
+        raise ValueError("Iterator produced {0} images for {1} labels".format(sample, len(labels)))
+
+    features.flush()
+    del features
+
+    index = {
+        "format_version": FEATURE_CACHE_FORMAT_VERSION,
+        "fingerprint": fingerprint,
+        "labels": labels,
+        "variants": [list(variant) for variant in variants]
+    }
+
+    with open(os.path.join(path_to_cache_dir, FEATURE_CACHE_INDEX_FILENAME), "w") as f:
+        json.dump(index, f)
+
+    return load_feature_cache(path_to_cache_dir)
+
+
+def feature_batches(features, labels, batch_size, shuffle=True, seed=None):
+    """Generate (features, labels) batches from a feature cache indefinitely
+
+    Every epoch (pass over the samples) each sample appears once, with the features of one of its cached
+    variants drawn at random. This is the cached equivalent of random flips
+
+    Arguments:
+        features                            Features (variants, samples, ...) as returned by compile_feature_cache
+        labels                              Labels of the samples
+        batch_size                          Number of samples in a batch. The last batch of an epoch may be smaller
+
+    Optional:
+        shuffle                             Whether to shuffle the samples every epoch. Default True
+        seed                                Random seed of the shuffling and of the variant draws
+    """
+    random_state = np.random.RandomState(seed)
+    labels = np.asarray(labels, dtype=np.float32)
+    variant_count, sample_count = features.shape[:2]
+
+    while True:
+        order = random_state.permutation(sample_count) if shuffle else np.arange(sample_count)
+        variants = random_state.randint(variant_count, size=sample_count)
+
+        for start in range(0, sample_count, batch_size):
+            samples = order[start: start + batch_size]
+            yield np.asarray(features[variants[samples], samples]), labels[samples]
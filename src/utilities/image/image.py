@@ -4,6 +4,8 @@ import math
 import uuid
 import numpy as np
 
+from numpy.lib.stride_tricks import as_strided
+
 from constants.ultrasound import IMAGE_TYPE
 from PIL import Image as pil_image
 
@@ -26,6 +28,28 @@ def apply_multiple_crops(image, crop_descriptions):
     return np.stack(map(lambda crop: apply_single_crop(image, crop), crop_descriptions), axis=0)
 
 
+def rectangle_outline(image, bounds):
+    """Pixels on the outline of a rectangle, clockwise from the top-left corner
+
+    Arguments:
+        image                               An image. Either single channel (grayscale) or multi-channel (color)
+        bounds                              Rectangle (x, y, w, h) in image coordinates. Clipped to the image
+
+    Returns:
+        Array of outline pixels. Shape (K,) for single channel or (K, C) for multi-channel images
+    """
+    x, y, w, h = bounds
+
+    x_start, x_end = max(x, 0), min(x + w, image.shape[1]) - 1
+    y_start, y_end = max(y, 0), min(y + h, image.shape[0]) - 1
+
+    return np.concatenate((
+        image[y_start, x_start:x_end],
+        image[y_start:y_end, x_end],
+        image[y_end, x_end:x_start:-1],
+        image[y_end:y_start:-1, x_start]))
+
+
 def determine_image_type(bgr_image, color_percentage_threshold=0.04):
     """Determines image type (Grayscale/Color) of image
 
@@ -273,30 +297,220 @@ def sample_to_batch(
         return pil_image.fromarray(sample_to_batch_random_origin(np.array(image), target_shape, batch_size))
 
 
-def crop_generator(image_data_generator, target_shape, number_crops):
+def batch_random_origins(image_shape, target_shape, number_crops, batch_size):
+    """Draw random crop origins for every image of a batch at once
+
+    Origins are drawn from the same range as sample_to_batch_random_origin
+
+    Returns:
+        (row_origins, column_origins), each of shape (batch_size, number_crops)
+    """
+    # Compute valid origin range. Fallback is "1" to support exclusive randint
+    row_origin_max = max(image_shape[0] - target_shape[0], 1)
+    column_origin_max = max(image_shape[1] - target_shape[1], 1)
+
+    row_origins = np.random.randint(0, row_origin_max, (batch_size, number_crops))
+    column_origins = np.random.randint(0, column_origin_max, (batch_size, number_crops))
+
+    return row_origins, column_origins
+
+
+def crop_windows(images, target_shape):
+    """Read-only strided view of every possible crop of a batch of images
+
+    Arguments:
+        images                              Array of images in channels_last format (batch, height, width[, channels])
+        target_shape                        Shape of each crop (height, width)
+
+    Returns:
+        View of shape (batch, row origin, column origin, height, width[, channels])
+
+    Raises:
+        ValueError: the target_shape is greater than the image shape in at least one dimension
+    """
+    batch_size = images.shape[0]
+    target_shape = extract_height_width(target_shape)
+
+    if not crop_in_bounds(extract_height_width(images.shape[1:]), target_shape):
+        raise ValueError("Crop shape {0} exceeds image shape {1}".format(target_shape, images.shape[1:3]))
+
+    strides = images.strides
+    return as_strided(
+        images,
+        shape=(batch_size,
+               images.shape[1] - target_shape[0] + 1,
+               images.shape[2] - target_shape[1] + 1) + target_shape + images.shape[3:],
+        strides=strides[:3] + strides[1:3] + strides[3:],
+        writeable=False)
+
+
+def batch_random_crops(images, target_shape, number_crops, out=None):
+    """Randomly placed crops of every image in a batch, gathered at once from a strided view of all crops
+
+    Arguments:
+        images                              Array of images in channels_last format (batch, height, width[, channels])
+        target_shape                        Shape of each crop (height, width)
+        number_crops                        Number of crops per image
+
+    Optional:
+        out                                 Array to write the crops to. Allocated if not given
+
+    Returns:
+        Array of crops (batch * number_crops, height, width[, channels]).
+            The crops of image i are at [i * number_crops: (i + 1) * number_crops]
+
+    Raises:
+        ValueError: the target_shape is greater than the image shape in at least one dimension
+    """
+    batch_size = images.shape[0]
+    target_shape = extract_height_width(target_shape)
+
+    windows = crop_windows(images, target_shape)
+    row_origins, column_origins = batch_random_origins(images.shape[1:], target_shape, number_crops, batch_size)
+
+    # Gather whole crops by origin
+    crops = windows[np.arange(batch_size)[:, np.newaxis], row_origins, column_origins]
+    crops = crops.reshape((batch_size * number_crops,) + crops.shape[2:])
+
+    if out is None:
+        return crops
+
+    out[...] = crops
+    return out
+
+
+# Crop placements of test-time augmentation. See tta_crop_origins
+TTA_CROP_LAYOUTS = ["center", "corners"]
+
+
+def tta_crop_origins(image_shape, target_shape, layout="center"):
+    """Fixed crop origins of test-time augmentation
+
+    Arguments:
+        image_shape                         Shape of the images (height, width[, channels])
+        target_shape                        Shape of each crop (height, width)
+
+    Optional:
+        layout                              "center" for the center crop (as center_crop_to_target_shape) or
+                                                "corners" for the center crop followed by the four corner crops.
+                                                Default "center"
+
+    Returns:
+        List of (row_origin, column_origin) tuples
+    """
+    row_max, column_max = np.subtract(extract_height_width(image_shape), extract_height_width(target_shape))
+    origins = [(row_max // 2, column_max // 2)]
+
+    if layout == "corners":
+        origins += [(0, 0), (0, column_max), (row_max, 0), (row_max, column_max)]
+    elif layout != "center":
+        raise ValueError("Unknown crop layout {0}. Expected one of {1}".format(layout, TTA_CROP_LAYOUTS))
+
+    return [(int(row), int(column)) for row, column in origins]
+
+
+def batch_fixed_crops(images, target_shape, origins, flips=((False, False),)):
+    """Crops of every image in a batch at fixed origins, each in every flip variant
+
+    Arguments:
+        images                              Array of images in channels_last format (batch, height, width[, channels])
+        target_shape                        Shape of each crop (height, width)
+        origins                             List of (row_origin, column_origin) tuples, e.g. from tta_crop_origins
+
+    Optional:
+        flips                               List of (horizontal, vertical) flip pairs applied to every crop.
+                                                Default no flip
+
+    Returns:
+        Array of crops (batch * number_crops, height, width[, channels]) with number_crops = len(flips) * len(origins).
+            The crops of image i are at [i * number_crops: (i + 1) * number_crops], by flip then origin
+
+    Raises:
+        ValueError: the target_shape is greater than the image shape in at least one dimension
+    """
+    batch_size = images.shape[0]
+    row_origins, column_origins = zip(*origins)
+
+    # (batch, origin, height, width[, channels])
+    crops = crop_windows(images, target_shape)[:, list(row_origins), list(column_origins)]
+
+    out = np.empty((batch_size, len(flips)) + crops.shape[1:], dtype=images.dtype)
+    for i, (horizontal, vertical) in enumerate(flips):
+        variant = crops[:, :, :, ::-1] if horizontal else crops
+        out[:, i] = variant[:, :, ::-1] if vertical else variant
+
+    return out.reshape((batch_size * len(flips) * len(origins),) + crops.shape[2:])
+
+
+def tta_crop_generator(iterator, target_shape, layout="center", flips=((False, False),)):
+    """Test-time augmentation crops of one epoch of an unshuffled Iterator, in order
+
+    Every batch of images is expanded at once into the crops of all of its images, so a prediction batch holds
+    the crops of many images. Batches keep the dtype of the iterator batches
+
+    Arguments:
+        iterator                            Iterator (keras Sequence) of (images, labels) batches
+        target_shape                        Shape of each crop (height, width)
+
+    Optional:
+        layout                              Crop placement, see tta_crop_origins. Default "center"
+        flips                               List of (horizontal, vertical) flip pairs. Default no flip
+
+    Yields:
+        (crops, labels) with number_crops = len(flips) * len(origins) consecutive crops per image
+    """
+    for index in range(len(iterator)):
+        images, labels = iterator[index]
+        origins = tta_crop_origins(images.shape[1:], target_shape, layout)
+        number_crops = len(flips) * len(origins)
+
+        yield (batch_fixed_crops(images, target_shape, origins, flips),
+               np.repeat(np.asarray(labels, dtype=np.float32), number_crops))
+
+
+def crop_generator(image_data_generator, target_shape, number_crops, buffer_count=None):
     """Take as input a Keras ImageGen (Iterator) and generate random
     crops from the image image_data_generator generated by the original iterator.
+
+    Crops of integer (e.g. uint8) batches keep the dtype of the batch, so that they can be converted to float
+    as the last step (see ImageDataGenerator.finalize_batch). Crops of float batches are float32
+
+    Arguments:
+        image_data_generator                Iterator yielding (images, labels) batches
+        target_shape                        Shape of each crop (height, width)
+        number_crops                        Number of crops per image
+
+    Optional:
+        buffer_count                        Number of output buffers to reuse in turn. Yielded batches
+                                                are views of these buffers so a batch is overwritten buffer_count
+                                                batches later. Must exceed the number of batches the consumer
+                                                holds at once (e.g. the Keras queue size). Default: allocate
+                                                every batch
     """
     target_shape = extract_height_width(target_shape)
 
+    buffers = [None] * (buffer_count or 0)
+    batch_number = 0
+
     while True:
         images, labels = next(image_data_generator)
         batch_size = len(labels)
+        output_shape = (batch_size * number_crops,) + target_shape + images.shape[3:]
+        output_dtype = images.dtype if np.issubdtype(images.dtype, np.integer) else np.float32
 
-        batch_crops = np.zeros((batch_size * number_crops, target_shape[0], target_shape[1], 3))
-        batch_labels = np.zeros(batch_size * number_crops)
-
-        # print("Images shape: {0}".format(images.shape))
-        # print("Labels shape: {0}".format(labels.shape))
-        # print("Output images shape: {0}".format(batch_crops.shape))
-        # print("Output labels shape: {0}".format(batch_labels.shape))
-
-        for i in range(batch_size):
+        out = None
+        if buffer_count:
+            slot = batch_number % buffer_count
+            batch_number += 1
 
-            # print("Sample to batch shape: {0}".format(sample_to_batch_random_origin(images[i], target_shape, number_crops).shape))
+            # A short (last) batch uses a leading view of a full sized buffer
+            if (buffers[slot] is None or buffers[slot].shape[0] < output_shape[0]
+                    or buffers[slot].shape[1:] != output_shape[1:] or buffers[slot].dtype != output_dtype):
+                buffers[slot] = np.empty(output_shape, output_dtype)
 
-            batch_crops[i*number_crops:(i+1)*number_crops] = sample_to_batch_random_origin(images[i], target_shape, number_crops)
+            out = buffers[slot][:output_shape[0]]
 
-            batch_labels[i*number_crops:(i+1)*number_crops] = labels[i]
+        batch_crops = batch_random_crops(images, target_shape, number_crops, out=out).astype(output_dtype, copy=False)
+        batch_labels = np.repeat(np.asarray(labels, dtype=np.float32), number_crops)
 
-        yield (batch_crops, batch_labels)
\ No newline at end of file
+        yield (batch_crops, batch_labels)
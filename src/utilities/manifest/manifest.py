@@ -72,10 +72,11 @@ def patient_lists_to_dataframe(patients, manifest, image_type, benign_prefix, ma
         for f in get_valid_frame_samples(manifest[p[0]], image_type):
             records.append({
                 "filename": "{0}/{1}/{2}".format(prefix, p[0], f[FRAME_LABEL]),
-                "class": p[1]
+                "class": p[1],
+                "patient": p[0]
             })
     
-    return pd.DataFrame.from_records(records, columns=["filename", "class"])
+    return pd.DataFrame.from_records(records, columns=["filename", "class", "patient"])
         
 
 def convert_old_manifest_to_new_format(path_to_manifest, path_to_images):
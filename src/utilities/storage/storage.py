@@ -0,0 +1,348 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+from collections import OrderedDict
+
+# Default size bound of the read-through cache. 10GB
+DEFAULT_CACHE_MAXIMUM_BYTES = 10 * 1024 ** 3
+
+# Default size bound of the in-process decoded image cache. 2GB
+DEFAULT_DECODED_CACHE_MAXIMUM_BYTES = 2 * 1024 ** 3
+
+# Default directory of the pretrained weights cache
+DEFAULT_WEIGHTS_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".keras", "weights_cache")
+
+# Size of the chunks objects are streamed in. 8MB
+DEFAULT_CHUNK_BYTES = 8 * 1024 ** 2
+
+REMOTE_PATH_PREFIX = "gs://"
+
+# Cache used by resolve_weights. See set_weights_cache
+_WEIGHTS_CACHE = None
+
+
+def is_remote_path(path):
+    return path.startswith(REMOTE_PATH_PREFIX)
+
+
+class GCSStorage(object):
+    """Google Cloud Storage accessed through TensorFlow's file_io"""
+
+    def __init__(self):
+        # Only required for remote storage. Imported lazily so local storage works without TensorFlow
+        from tensorflow.python.lib.io import file_io
+        self.file_io = file_io
+
+    def generation(self, path):
+        """Identifier that changes whenever the object is rewritten"""
+        statistics = self.file_io.stat(path)
+        return "{0}-{1}".format(statistics.mtime_nsec, statistics.length)
+
+    def read(self, path):
+        with self.file_io.FileIO(path, mode="rb") as f:
+            return f.read()
+
+    def open(self, path):
+        return self.file_io.FileIO(path, mode="rb")
+
+
+class LocalDirectoryStorage(object):
+    """Local directory standing in for a bucket. gs://bucket/object is read from {root}/bucket/object
+
+    Arguments:
+        path_to_root_dir                    directory holding one sub-directory per bucket
+    """
+
+    def __init__(self, path_to_root_dir):
+        self.path_to_root_dir = path_to_root_dir.rstrip("/")
+
+    def local_path(self, path):
+        return "{0}/{1}".format(self.path_to_root_dir, path[len(REMOTE_PATH_PREFIX):])
+
+    def generation(self, path):
+        statistics = os.stat(self.local_path(path))
+        return "{0}-{1}".format(statistics.st_mtime_ns, statistics.st_size)
+
+    def read(self, path):
+        with open(self.local_path(path), "rb") as f:
+            return f.read()
+
+    def open(self, path):
+        return open(self.local_path(path), "rb")
+
+
+class ReadThroughCache(object):
+    """Size-bounded local disk cache in front of remote (gs://) storage
+
+    Entries are content-addressed by the hash of the object path and generation, so a rewritten object
+    is never served stale. The generation of an object is looked up once per process. Afterwards reads of
+    a cached object only touch local disk. Least recently used entries are evicted once the cache exceeds
+    its size bound. Entries are written atomically so the cache can be shared by worker processes.
+
+    Arguments:
+        path_to_cache_dir                   directory holding the cache. Created if it does not exist
+
+    Optional:
+        maximum_bytes                       size bound of the cache. Default DEFAULT_CACHE_MAXIMUM_BYTES
+        storage                             remote storage. Default GCSStorage
+    """
+
+    def __init__(self, path_to_cache_dir, maximum_bytes=DEFAULT_CACHE_MAXIMUM_BYTES, storage=None):
+        self.path_to_cache_dir = path_to_cache_dir.rstrip("/")
+        self.maximum_bytes = maximum_bytes
+        self.storage = storage if storage is not None else GCSStorage()
+
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        # Object path -> entry key. Avoids a generation lookup per read
+        self.__keys = {}
+
+        if not os.path.isdir(self.path_to_cache_dir):
+            os.makedirs(self.path_to_cache_dir)
+
+        # Entry key -> size in bytes, least recently used first. Seeded from disk by modification time
+        entries = []
+        for filename in os.listdir(self.path_to_cache_dir):
+            if filename.endswith(".tmp"):
+                continue
+            statistics = os.stat(self.__entry_path(filename))
+            entries.append((statistics.st_mtime, filename, statistics.st_size))
+
+        self.__entries = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self.__total_bytes = sum(self.__entries.values())
+
+    def __entry_path(self, key):
+        return "{0}/{1}".format(self.path_to_cache_dir, key)
+
+    def key(self, path):
+        if path not in self.__keys:
+            description = "{0}@{1}".format(path, self.storage.generation(path))
+            self.__keys[path] = hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+        return self.__keys[path]
+
+    def __evict(self):
+        while self.__total_bytes > self.maximum_bytes and len(self.__entries) > 1:
+            key, size = self.__entries.popitem(last=False)
+            self.__total_bytes -= size
+
+            # Another worker may have evicted the entry already
+            try:
+                os.remove(self.__entry_path(key))
+            except FileNotFoundError:
+                pass
+
+    def read(self, path):
+        """Bytes of the object at path. Served from local disk when cached"""
+        key = self.key(path)
+        entry_path = self.__entry_path(key)
+
+        try:
+            with open(entry_path, "rb") as f:
+                data = f.read()
+
+        except FileNotFoundError:
+            data = self.storage.read(path)
+            self.misses += 1
+
+            temp_path = "{0}.{1}.tmp".format(entry_path, uuid.uuid4())
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, entry_path)
+
+        else:
+            self.hits += 1
+
+            # Record the use on disk so eviction order survives restarts and is shared by workers
+            try:
+                os.utime(entry_path)
+            except FileNotFoundError:
+                pass
+
+        with self.lock:
+            # Entries written by other workers are only accounted for once read
+            self.__total_bytes += len(data) - self.__entries.get(key, 0)
+            self.__entries[key] = len(data)
+            self.__entries.move_to_end(key)
+            self.__evict()
+
+        return data
+
+
+class DecodedImageCache(object):
+    """Size-bounded in-process cache of decoded image arrays
+
+    Holds the final uint8 array of an image (decoded, converted, upscaled and cropped) per path and decode
+    parameters, so images read by several iterators of a process (e.g. training, then predictions over the
+    same frames) are only decoded once. Cached arrays are read-only. Least recently used arrays are evicted
+    once the cache exceeds its size bound
+
+    Optional:
+        maximum_bytes                       size bound of the cache. Default DEFAULT_DECODED_CACHE_MAXIMUM_BYTES
+    """
+
+    def __init__(self, maximum_bytes=DEFAULT_DECODED_CACHE_MAXIMUM_BYTES):
+        self.maximum_bytes = maximum_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        # Key -> array, least recently used first
+        self.__entries = OrderedDict()
+        self.__total_bytes = 0
+
+    def get(self, key):
+        """Cached array of key, or None"""
+        with self.lock:
+            array = self.__entries.get(key)
+
+            if array is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.__entries.move_to_end(key)
+
+        return array
+
+    def put(self, key, array):
+        """Caches array under key. The array is made read-only"""
+        array.setflags(write=False)
+
+        # Never cached, it would evict everything else
+        if array.nbytes > self.maximum_bytes:
+            return
+
+        with self.lock:
+            if key in self.__entries:
+                self.__total_bytes -= self.__entries.pop(key).nbytes
+
+            self.__entries[key] = array
+            self.__total_bytes += array.nbytes
+
+            while self.__total_bytes > self.maximum_bytes:
+                _, evicted = self.__entries.popitem(last=False)
+                self.__total_bytes -= evicted.nbytes
+
+
+def file_sha256(path, chunk_size=DEFAULT_CHUNK_BYTES):
+    """Hex SHA-256 digest of the content of a local file, read in chunks"""
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class WeightsCache(object):
+    """Local cache of pretrained weight files stored in remote (gs://) storage
+
+    A weights file is streamed to local disk in chunks on first use, and its size and SHA-256 digest are recorded
+    next to it. Later uses verify the local copy against the record and the object generation, so a corrupted
+    copy or a rewritten object is downloaded again. If the generation cannot be looked up (e.g. offline), a
+    verified copy is used. Files and records are written atomically so the cache can be shared by jobs.
+
+    Optional:
+        path_to_cache_dir                   directory holding the cache. Created if it does not exist.
+                                                Default DEFAULT_WEIGHTS_CACHE_DIR
+        storage                             remote storage. Default GCSStorage
+        chunk_size                          size of the downloaded chunks in bytes. Default DEFAULT_CHUNK_BYTES
+    """
+
+    def __init__(self, path_to_cache_dir=DEFAULT_WEIGHTS_CACHE_DIR, storage=None, chunk_size=DEFAULT_CHUNK_BYTES):
+        self.path_to_cache_dir = path_to_cache_dir.rstrip("/")
+        self.storage = storage if storage is not None else GCSStorage()
+        self.chunk_size = chunk_size
+
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.isdir(self.path_to_cache_dir):
+            os.makedirs(self.path_to_cache_dir)
+
+    def local_path(self, path):
+        """Path of the local copy of the object at path. Keeps the file name for readability and extension checks"""
+        key = hashlib.sha1(path.encode("utf-8")).hexdigest()
+        return "{0}/{1}-{2}".format(self.path_to_cache_dir, key, os.path.basename(path))
+
+    def __record_path(self, path):
+        return "{0}.json".format(self.local_path(path))
+
+    def __verified(self, path, generation):
+        """Whether the local copy of path matches its record and, if known, the object generation"""
+        try:
+            with open(self.__record_path(path)) as f:
+                record = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+
+        local_path = self.local_path(path)
+
+        if generation is not None and record.get("generation") != generation:
+            return False
+
+        if not os.path.isfile(local_path) or os.path.getsize(local_path) != record.get("size"):
+            return False
+
+        return file_sha256(local_path, self.chunk_size) == record.get("sha256")
+
+    def __download(self, path, generation):
+        local_path = self.local_path(path)
+        digest = hashlib.sha256()
+        size = 0
+
+        temp_path = "{0}.{1}.tmp".format(local_path, uuid.uuid4())
+        with self.storage.open(path) as source, open(temp_path, "wb") as f:
+            for chunk in iter(lambda: source.read(self.chunk_size), b""):
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        os.replace(temp_path, local_path)
+
+        record = {"path": path, "generation": generation, "size": size, "sha256": digest.hexdigest()}
+
+        temp_path = "{0}.{1}.tmp".format(self.__record_path(path), uuid.uuid4())
+        with open(temp_path, "w") as f:
+            json.dump(record, f)
+        os.replace(temp_path, self.__record_path(path))
+
+    def resolve(self, path):
+        """Local path of a verified copy of the object at path. Downloaded if not cached"""
+        try:
+            generation = self.storage.generation(path)
+        except Exception:
+            generation = None
+
+        if self.__verified(path, generation):
+            self.hits += 1
+        else:
+            self.misses += 1
+            print("Downloading weights: {0}".format(path))
+            self.__download(path, generation)
+
+        return self.local_path(path)
+
+
+def set_weights_cache(cache):
+    """Sets the WeightsCache used by resolve_weights"""
+    global _WEIGHTS_CACHE
+    _WEIGHTS_CACHE = cache
+
+
+def resolve_weights(path):
+    """Local path of the weights file at path (e.g. gs://...). Remote files are resolved through the cache set
+    with set_weights_cache, by default a WeightsCache in DEFAULT_WEIGHTS_CACHE_DIR"""
+    if not is_remote_path(path):
+        return path
+
+    if _WEIGHTS_CACHE is None:
+        set_weights_cache(WeightsCache())
+
+    return _WEIGHTS_CACHE.resolve(path)
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from dataset_preparation.cache.frame_cache import (
+    FrameCache,
+    append_manifest_checkpoint,
+    default_pipeline_parameters,
+    latest_checkpoint_timestamp,
+    load_manifest_checkpoint,
+    manifest_checkpoint_path)
+
+
+class Test_FrameCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_hit_on_identical_bytes_under_another_filename(self):
+        frame_dir = tempfile.mkdtemp(dir=self.cache_dir)
+        frame_bytes = os.urandom(64)
+        for filename in ["frame_a.png", "copy_of_frame_a.png"]:
+            with open(os.path.join(frame_dir, filename), "wb") as f:
+                f.write(frame_bytes)
+
+        cache = FrameCache(self.cache_dir + "/cache")
+        with open(os.path.join(frame_dir, "frame_a.png"), "rb") as f:
+            cache.put(cache.key(f.read()), {"scale": 4.8}, np.full((4, 5), 7, dtype=np.uint8))
+
+        with open(os.path.join(frame_dir, "copy_of_frame_a.png"), "rb") as f:
+            frame_record, focus_path = cache.get(cache.key(f.read()))
+
+        self.assertEqual(frame_record, {"scale": 4.8})
+        self.assertTrue(os.path.isfile(focus_path))
+
+    def test_miss_when_pipeline_parameters_change(self):
+        frame_bytes = b"frame"
+        cache = FrameCache(self.cache_dir)
+        cache.put(cache.key(frame_bytes), {"scale": 4.8})
+
+        parameters = default_pipeline_parameters()
+        parameters["scan_selection_crop"] = [0, 0]
+        changed_cache = FrameCache(self.cache_dir, parameters)
+
+        self.assertIsNotNone(cache.get(cache.key(frame_bytes)))
+        self.assertIsNone(changed_cache.get(changed_cache.key(frame_bytes)))
+
+
+class Test_ManifestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.manifest_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.manifest_dir)
+
+    def test_truncated_last_line_ignored(self):
+        checkpoint_path = manifest_checkpoint_path(self.manifest_dir, "2019_01_01_00_00_00")
+
+        with open(checkpoint_path, "a") as checkpoint_file:
+            append_manifest_checkpoint(checkpoint_file, "P1", [{"frame": "a.png"}])
+            append_manifest_checkpoint(checkpoint_file, "P2", [{"frame": "b.png"}])
+            # Crash while writing the third patient
+            checkpoint_file.write('{"patient": "P3", "rec')
+
+        self.assertEqual(load_manifest_checkpoint(checkpoint_path), {
+            "P1": [{"frame": "a.png"}],
+            "P2": [{"frame": "b.png"}]
+        })
+
+        # The entry appended on resume is not glued to the truncated one
+        with open(checkpoint_path, "a") as checkpoint_file:
+            append_manifest_checkpoint(checkpoint_file, "P3", [{"frame": "c.png"}])
+
+        self.assertEqual(sorted(load_manifest_checkpoint(checkpoint_path)), ["P1", "P2", "P3"])
+
+    def test_latest_checkpoint_timestamp(self):
+        self.assertIsNone(latest_checkpoint_timestamp(self.manifest_dir))
+
+        for modified, timestamp in enumerate(["2019_01_02_00_00_00", "2019_01_01_00_00_00"]):
+            checkpoint_path = manifest_checkpoint_path(self.manifest_dir, timestamp)
+            open(checkpoint_path, "w").close()
+            os.utime(checkpoint_path, (modified, modified))
+
+        self.assertEqual(latest_checkpoint_timestamp(self.manifest_dir), "2019_01_01_00_00_00")
+
+if __name__ == '__main__':
+    unittest.main()
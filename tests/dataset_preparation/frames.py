@@ -0,0 +1,43 @@
+import numpy as np
+
+# Synthetic ultrasound frames with the layout of the scanner: readout text on the left, at the bottom left and
+# at the top right, a scan window in the middle and, in Color/CPA mode, a color bar at the top and a green
+# highlight box around the focus
+FRAME_SHAPE = (480, 640)
+SCAN_WINDOW_BOUNDS = (150, 110, 380, 300)
+HIGHLIGHT_BOUNDS = (250, 160, 160, 120)
+READOUT_REGIONS = [(slice(60, 70), slice(10, 60)), (slice(400, 410), slice(40, 80)), (slice(20, 30), slice(600, 630))]
+
+
+def grayscale_frame(seed, scan_window_bounds=SCAN_WINDOW_BOUNDS, readout=True):
+    """Grayscale frame. Every seed gives another scan texture"""
+    random_state = np.random.RandomState(seed)
+    frame = np.zeros(FRAME_SHAPE, np.uint8)
+
+    x, y, w, h = scan_window_bounds
+    frame[y: y + h, x: x + w] = random_state.randint(60, 200, (h, w))
+
+    if readout:
+        for region in READOUT_REGIONS:
+            frame[region] = 255
+
+    return frame
+
+
+def color_frame(seed, highlight_bounds=HIGHLIGHT_BOUNDS, highlight=True):
+    """BGR Color/CPA frame. Every seed gives another scan texture"""
+    frame = np.repeat(grayscale_frame(seed)[:, :, np.newaxis], 3, axis=2)
+
+    # Color bar, outside the HSV range of the highlight box
+    frame[:60, 150:250, 0] = 255
+    frame[:60, 150:250, 1] = 0
+    frame[:60, 150:250, 2] = np.arange(60)[:, np.newaxis] * 4
+
+    if highlight:
+        x, y, w, h = highlight_bounds
+        frame[y: y + h, x: x + w][:2] = (0, 255, 0)
+        frame[y: y + h, x: x + w][-2:] = (0, 255, 0)
+        frame[y: y + h, x: x + w][:, :2] = (0, 255, 0)
+        frame[y: y + h, x: x + w][:, -2:] = (0, 255, 0)
+
+    return frame
@@ -0,0 +1,191 @@
+import unittest
+
+from unittest import mock
+
+import numpy as np
+
+from constants.ultrasound import IMAGE_TYPE, READOUT_ABBREVS as RA
+from dataset_preparation.ocr import engine as ocr_engine
+from dataset_preparation.ocr.engine import (
+    TILE_GAP,
+    MemoizedEngine,
+    PytesseractEngine,
+    tile_crops,
+    words_to_text)
+from dataset_preparation.ocr.ocr import isolate_text_batch, recognize_crops
+
+
+class FakeEngine(object):
+    """Reads the first pixel of a crop as its text. Crops with a first pixel of 0 cannot be read"""
+
+    def __init__(self, batch_fails=False):
+        self.batch_fails = batch_fails
+        self.recognized = []
+
+    def image_to_string(self, crop, whitelist=None):
+        if crop[0, 0] == 0:
+            raise RuntimeError("unreadable crop")
+
+        self.recognized.append(int(crop[0, 0]))
+        return str(crop[0, 0])
+
+    def image_to_string_batch(self, crops, whitelist=None):
+        if self.batch_fails:
+            raise RuntimeError("batch failed")
+
+        return [self.image_to_string(crop, whitelist) for crop in crops]
+
+    def close(self):
+        pass
+
+
+def crop_of(value, shape=(4, 6)):
+    return np.full(shape, value, dtype=np.uint8)
+
+
+class Test_TileCrops(unittest.TestCase):
+    def test_crops_are_stacked_with_gaps(self):
+        crops = [crop_of(1, (3, 5)), crop_of(2, (4, 7)), crop_of(3, (2, 2))]
+
+        page, row_offsets = tile_crops(crops)
+
+        self.assertEqual(row_offsets, [0, 3 + TILE_GAP, 7 + 2 * TILE_GAP])
+        self.assertEqual(page.shape, (9 + 2 * TILE_GAP, 7))
+
+        for offset, crop in zip(row_offsets, crops):
+            np.testing.assert_array_equal(page[offset: offset + crop.shape[0], :crop.shape[1]], crop)
+
+        # Gaps and the padding right of narrow crops are background
+        self.assertFalse(page[3: 3 + TILE_GAP].any())
+        self.assertFalse(page[:3, 5:].any())
+
+
+class Test_WordsToText(unittest.TestCase):
+    def test_overlapping_words_share_a_line(self):
+        words = [
+            (40, 2, 10, "65%"),
+            (0, 0, 10, "CPA"),
+            (0, 20, 10, "WF"),
+            (30, 21, 10, "LOW")]
+
+        self.assertEqual(words_to_text(words), "CPA 65%\nWF LOW")
+
+    def test_no_words(self):
+        self.assertEqual(words_to_text([]), "")
+
+
+class Test_PytesseractEngine(unittest.TestCase):
+    def test_words_are_mapped_back_to_crops_by_row_center(self):
+        crops = [crop_of(255, (10, 20)), crop_of(255, (10, 20)), crop_of(255, (10, 20))]
+        _, row_offsets = tile_crops(crops)
+
+        data = {
+            "left": [0, 12, 0, 0, 5],
+            "top": [row_offsets[0], row_offsets[0] + 1, row_offsets[2] + 2, row_offsets[1] - 8, row_offsets[1]],
+            "height": [8, 8, 6, 4, 9],
+            "text": ["RAD", "4.0", "ARAD", "noise", " "]}
+
+        fake_pytesseract = mock.MagicMock()
+        fake_pytesseract.image_to_data.return_value = data
+
+        with mock.patch.object(ocr_engine, "pytesseract", fake_pytesseract):
+            texts = PytesseractEngine().image_to_string_batch(crops)
+
+        # The word centered in the gap and the blank word are dropped
+        self.assertEqual(texts, ["RAD 4.0", "", "ARAD"])
+        self.assertEqual(fake_pytesseract.image_to_data.call_count, 1)
+
+    def test_pages_are_split_at_maximum_height(self):
+        crops = [crop_of(255, (10, 20)) for _ in range(5)]
+
+        fake_pytesseract = mock.MagicMock()
+        fake_pytesseract.image_to_data.return_value = {"left": [], "top": [], "height": [], "text": []}
+
+        engine = PytesseractEngine(maximum_page_height=2 * 10 + TILE_GAP)
+        with mock.patch.object(ocr_engine, "pytesseract", fake_pytesseract):
+            texts = engine.image_to_string_batch(crops)
+
+        # Pages of two, two and a single crop read with image_to_string
+        self.assertEqual(len(texts), 5)
+        self.assertEqual(fake_pytesseract.image_to_data.call_count, 2)
+        self.assertEqual(fake_pytesseract.image_to_string.call_count, 1)
+
+
+class Test_MemoizedEngine(unittest.TestCase):
+    def test_hits_misses_and_in_batch_dedup(self):
+        fake = FakeEngine()
+        engine = MemoizedEngine(fake)
+
+        texts = engine.image_to_string_batch([crop_of(1), crop_of(2), crop_of(1)])
+
+        self.assertEqual(texts, ["1", "2", "1"])
+        self.assertEqual(fake.recognized, [1, 2])
+        self.assertEqual((engine.hits, engine.misses), (1, 2))
+
+        texts = engine.image_to_string_batch([crop_of(2), crop_of(3)])
+
+        self.assertEqual(texts, ["2", "3"])
+        self.assertEqual(fake.recognized, [1, 2, 3])
+        self.assertEqual((engine.hits, engine.misses), (2, 3))
+
+    def test_key_includes_shape_and_whitelist(self):
+        fake = FakeEngine()
+        engine = MemoizedEngine(fake)
+
+        engine.image_to_string(crop_of(1))
+        engine.image_to_string(crop_of(1, (6, 4)))
+        engine.image_to_string(crop_of(1), whitelist="0123456789.")
+
+        self.assertEqual(engine.misses, 3)
+        self.assertEqual(engine.hits, 0)
+
+    def test_least_recently_used_crop_is_evicted(self):
+        fake = FakeEngine()
+        engine = MemoizedEngine(fake, maximum_size=2)
+
+        engine.image_to_string_batch([crop_of(1), crop_of(2)])
+        engine.image_to_string(crop_of(1))
+        engine.image_to_string(crop_of(3))
+        engine.image_to_string(crop_of(1))
+        engine.image_to_string(crop_of(2))
+
+        self.assertEqual(fake.recognized, [1, 2, 3, 2])
+
+
+class Test_RecognizeCrops(unittest.TestCase):
+    def test_failed_batch_falls_back_to_single_crops(self):
+        texts = recognize_crops(FakeEngine(batch_fails=True), [crop_of(1), crop_of(0), crop_of(3)])
+
+        self.assertEqual(texts[0], "1")
+        self.assertIsInstance(texts[1], RuntimeError)
+        self.assertEqual(texts[2], "3")
+
+
+class Test_IsolateTextBatch(unittest.TestCase):
+    def test_unreadable_frame_does_not_fail_the_others(self):
+        engine = mock.MagicMock()
+        engine.image_to_string_batch.side_effect = RuntimeError("batch failed")
+
+        texts = {1: "RAD", 2: "ARAD", 3: "", 4: "4.0", 5: "2.5"}
+
+        def image_to_string(crop, whitelist=None):
+            if crop[0, 0] == 0:
+                raise RuntimeError("unreadable crop")
+            return texts[int(crop[0, 0])]
+
+        engine.image_to_string.side_effect = image_to_string
+
+        readout_regions = [
+            (crop_of(1), crop_of(3), crop_of(4)),
+            (crop_of(2), crop_of(0), crop_of(5)),
+            (crop_of(2), crop_of(3), crop_of(5))]
+
+        found_texts = isolate_text_batch(readout_regions, [IMAGE_TYPE.GRAYSCALE] * 3, engine=engine)
+
+        self.assertEqual(found_texts[0], {RA.SCALE: 4.0, RA.RADIALITY: RA.RAD})
+        self.assertIsInstance(found_texts[1], RuntimeError)
+        self.assertEqual(found_texts[2], {RA.SCALE: 2.5, RA.RADIALITY: RA.ARAD})
+
+
+if __name__ == '__main__':
+    unittest.main()
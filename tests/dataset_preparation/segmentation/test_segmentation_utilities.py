@@ -0,0 +1,135 @@
+import unittest
+
+from unittest import mock
+
+import numpy as np
+
+from constants.ultrasound import HSV_COLOR_THRESHOLD
+
+import dataset_preparation.segmentation.brute.color as color
+import dataset_preparation.segmentation.brute.grayscale as grayscale
+
+from tests.dataset_preparation.frames import HIGHLIGHT_BOUNDS, SCAN_WINDOW_BOUNDS, color_frame, grayscale_frame
+
+HSV_LOWER_BOUND = np.array(HSV_COLOR_THRESHOLD.LOWER.value, np.uint8)
+HSV_UPPER_BOUND = np.array(HSV_COLOR_THRESHOLD.UPPER.value, np.uint8)
+
+
+def shifted(bounds, offset):
+    x, y, w, h = bounds
+    return (x + offset, y + offset, w, h)
+
+
+class Test_SelectScanWindowBatch(unittest.TestCase):
+    def assert_matches_per_frame(self, frames, scan_windows):
+        self.assertEqual(len(scan_windows), len(frames))
+        for frame, scan_window in zip(frames, scan_windows):
+            np.testing.assert_array_equal(scan_window, grayscale.select_scan_window(frame, cm=0))
+
+    def test_bounds_reused_for_same_geometry(self):
+        frames = [grayscale_frame(seed) for seed in range(4)]
+
+        with mock.patch.object(grayscale, "find_scan_window_bounds", wraps=grayscale.find_scan_window_bounds) as find:
+            scan_windows = grayscale.select_scan_window_batch(frames, cm=0)
+
+        self.assertEqual(find.call_count, 1)
+        self.assert_matches_per_frame(frames, scan_windows)
+
+    def test_bounds_searched_again_when_window_moves(self):
+        frames = [grayscale_frame(0), grayscale_frame(1, shifted(SCAN_WINDOW_BOUNDS, 12)), grayscale_frame(2)]
+
+        with mock.patch.object(grayscale, "find_scan_window_bounds", wraps=grayscale.find_scan_window_bounds) as find:
+            scan_windows = grayscale.select_scan_window_batch(frames, cm=0)
+
+        self.assertEqual(find.call_count, 3)
+        self.assert_matches_per_frame(frames, scan_windows)
+
+    def test_reuse_gated_by_outline_agreement(self):
+        frames = [grayscale_frame(0), grayscale_frame(1, shifted(SCAN_WINDOW_BOUNDS, 12))]
+        bounds = grayscale.find_scan_window_bounds(frames[0])
+
+        agreement = np.mean(grayscale.scan_window_outline(frames[1], bounds) ==
+                            grayscale.scan_window_outline(frames[0], bounds))
+        self.assertLess(agreement, 0.9)
+
+        # Bounds are reused below the required agreement only
+        with mock.patch.object(grayscale, "find_scan_window_bounds", wraps=grayscale.find_scan_window_bounds) as find:
+            scan_windows = grayscale.select_scan_window_batch(frames, cm=0, minimum_outline_agreement=agreement)
+
+        self.assertEqual(find.call_count, 1)
+        np.testing.assert_array_equal(scan_windows[1], grayscale.crop_scan_window(frames[1], bounds, 0))
+
+    def test_failing_frame_does_not_affect_others(self):
+        frames = [grayscale_frame(0), np.zeros_like(grayscale_frame(1)), grayscale_frame(2)]
+
+        scan_windows = grayscale.select_scan_window_batch(frames, cm=0)
+
+        self.assertIsInstance(scan_windows[1], Exception)
+        self.assert_matches_per_frame([frames[0], frames[2]], [scan_windows[0], scan_windows[2]])
+
+    def test_failing_first_frame(self):
+        frames = [np.zeros_like(grayscale_frame(0)), grayscale_frame(1), grayscale_frame(2)]
+
+        scan_windows = grayscale.select_scan_window_batch(frames, cm=5)
+
+        self.assertIsInstance(scan_windows[0], Exception)
+        for frame, scan_window in zip(frames[1:], scan_windows[1:]):
+            np.testing.assert_array_equal(scan_window, grayscale.select_scan_window(frame, cm=5))
+
+
+class Test_GetColorImageFocusBatch(unittest.TestCase):
+    def focus_batch(self, frames, **kwargs):
+        return color.get_color_image_focus_batch(frames, HSV_LOWER_BOUND, HSV_UPPER_BOUND, **kwargs)
+
+    def assert_matches_per_frame(self, frames, image_focuses):
+        self.assertEqual(len(image_focuses), len(frames))
+        for frame, image_focus in zip(frames, image_focuses):
+            np.testing.assert_array_equal(
+                image_focus, color.get_color_image_focus(frame, HSV_LOWER_BOUND, HSV_UPPER_BOUND))
+
+    def test_bounds_reused_for_same_geometry(self):
+        frames = [color_frame(seed) for seed in range(4)]
+
+        with mock.patch.object(
+                color, "find_color_image_focus_bounds", wraps=color.find_color_image_focus_bounds) as find:
+            image_focuses = self.focus_batch(frames)
+
+        self.assertEqual(find.call_count, 1)
+        self.assert_matches_per_frame(frames, image_focuses)
+
+    def test_bounds_searched_again_when_highlight_moves(self):
+        frames = [color_frame(0), color_frame(1, shifted(HIGHLIGHT_BOUNDS, 20)), color_frame(2, shifted(HIGHLIGHT_BOUNDS, 20))]
+
+        with mock.patch.object(
+                color, "find_color_image_focus_bounds", wraps=color.find_color_image_focus_bounds) as find:
+            image_focuses = self.focus_batch(frames)
+
+        self.assertEqual(find.call_count, 2)
+        self.assert_matches_per_frame(frames, image_focuses)
+
+    def test_reuse_gated_by_outline_agreement(self):
+        frames = [color_frame(0), color_frame(1, shifted(HIGHLIGHT_BOUNDS, 1))]
+        highlight_bounds, focus_bounds = color.find_color_image_focus_bounds(
+            frames[0], HSV_LOWER_BOUND, HSV_UPPER_BOUND)
+
+        agreement = color.highlight_outline_agreement(frames[1], highlight_bounds, HSV_LOWER_BOUND, HSV_UPPER_BOUND)
+        self.assertLess(agreement, 0.9)
+
+        with mock.patch.object(
+                color, "find_color_image_focus_bounds", wraps=color.find_color_image_focus_bounds) as find:
+            image_focuses = self.focus_batch(frames, minimum_outline_agreement=agreement)
+
+        self.assertEqual(find.call_count, 1)
+        np.testing.assert_array_equal(image_focuses[1], color.crop_color_image_focus(frames[1], focus_bounds))
+
+    def test_failing_frame_does_not_affect_others(self):
+        frames = [color_frame(0), color_frame(1, highlight=False), color_frame(2)]
+
+        image_focuses = self.focus_batch(frames)
+
+        self.assertIsInstance(image_focuses[1], Exception)
+        self.assert_matches_per_frame([frames[0], frames[2]], [image_focuses[0], image_focuses[2]])
+
+
+if __name__ == '__main__':
+    unittest.main()
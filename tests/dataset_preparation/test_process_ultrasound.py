@@ -0,0 +1,207 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+
+import cv2
+import numpy as np
+
+from constants.ultrasound import (
+    FOCUS_HASH_LABEL,
+    FRAME_LABEL,
+    HSV_COLOR_THRESHOLD,
+    IMAGE_TYPE,
+    IMAGE_TYPE_LABEL,
+    READOUT_ABBREVS as RA,
+    TUMOR_BENIGN)
+
+import dataset_preparation.process_ultrasound as process
+
+from dataset_preparation.cache.frame_cache import FrameCache
+from dataset_preparation.ocr.engine import MemoizedEngine
+from dataset_preparation.segmentation.brute.color import get_color_image_focus
+from dataset_preparation.segmentation.brute.grayscale import select_scan_window
+
+from tests.dataset_preparation.frames import SCAN_WINDOW_BOUNDS, color_frame, grayscale_frame
+
+
+class FakeOCREngine(object):
+    """Reads the same Color/CPA readout from every crop with text. Crops without text cannot be read"""
+
+    hits = 0
+    misses = 0
+
+    def image_to_string(self, crop, whitelist=None):
+        if not crop.any():
+            raise RuntimeError("No text in crop")
+
+        return "4.0" if whitelist is not None else "CPA 85\nWF LOW\nPRF 1200"
+
+    def image_to_string_batch(self, crops, whitelist=None):
+        return [self.image_to_string(crop, whitelist) for crop in crops]
+
+
+def frame_without_scan_window(seed):
+    frame = grayscale_frame(seed)
+    x, y, w, h = SCAN_WINDOW_BOUNDS
+    frame[y: y + h, x: x + w] = 0
+    return frame
+
+
+def expected_focus(frame):
+    if frame.ndim == 3:
+        return get_color_image_focus(
+            frame,
+            np.array(HSV_COLOR_THRESHOLD.LOWER.value, np.uint8),
+            np.array(HSV_COLOR_THRESHOLD.UPPER.value, np.uint8))
+
+    return select_scan_window(frame, cm=0)
+
+
+class Test_RemoveUnreferencedFocuses(unittest.TestCase):
+    def setUp(self):
+        self.focus_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.focus_dir)
+
+    def test_only_referenced_focuses_kept(self):
+        for filename in ["kept.png", "superseded.png", "interrupted.png", "notes.txt"]:
+            open(os.path.join(self.focus_dir, filename), "w").close()
+
+        frame_records = [
+            {FRAME_LABEL: "a.png", FOCUS_HASH_LABEL: "{0}/kept.png".format(self.focus_dir)},
+            {FRAME_LABEL: "b.png"}
+        ]
+
+        process.remove_unreferenced_focuses(self.focus_dir, frame_records)
+
+        self.assertEqual(sorted(os.listdir(self.focus_dir)), ["kept.png", "notes.txt"])
+
+
+class Test_PatientFramePipeline(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.ocr_engine = mock.patch.object(process, "get_ocr_engine", return_value=FakeOCREngine())
+        self.ocr_engine.start()
+
+    def tearDown(self):
+        self.ocr_engine.stop()
+        shutil.rmtree(self.directory)
+
+    def write_patient(self, patient, frames):
+        frames_dir = os.path.join(self.directory, patient, "frames")
+        os.makedirs(frames_dir)
+        for frame_label, frame in frames.items():
+            cv2.imwrite(os.path.join(frames_dir, frame_label), frame)
+
+    def run_pipeline(self, patient, timestamp, frame_cache=None):
+        return process.patient_frame_pipeline(
+            os.path.join(self.directory, patient),
+            patient,
+            "frames",
+            "focus",
+            timestamp,
+            patient_type_label=TUMOR_BENIGN,
+            frame_cache=frame_cache)
+
+    def assert_focuses(self, records, frames):
+        for record in records:
+            focus = cv2.imread(record[FOCUS_HASH_LABEL], cv2.IMREAD_UNCHANGED)
+            np.testing.assert_array_equal(focus, expected_focus(frames[record[FRAME_LABEL]]))
+
+    def without_focus_paths(self, records):
+        return [{key: value for key, value in record.items() if key != FOCUS_HASH_LABEL} for record in records]
+
+    def test_focuses_match_per_frame_segmentation(self):
+        frames = {
+            "frame_0.png": grayscale_frame(0),
+            "frame_1.png": color_frame(1),
+            "frame_2.png": grayscale_frame(2),
+            "frame_3.png": color_frame(3)}
+        self.write_patient("P1", frames)
+
+        records = self.run_pipeline("P1", "t1")
+
+        self.assertEqual([record[FRAME_LABEL] for record in records], sorted(frames))
+        self.assertEqual(
+            [record[IMAGE_TYPE_LABEL] for record in records],
+            [IMAGE_TYPE.GRAYSCALE.value, IMAGE_TYPE.COLOR.value, IMAGE_TYPE.GRAYSCALE.value, IMAGE_TYPE.COLOR.value])
+        self.assertEqual(records[1][RA.COLOR_LEVEL], 85)
+        self.assertTrue(all(record[RA.SCALE] == 4.0 for record in records))
+        self.assert_focuses(records, frames)
+
+    def test_failing_frames_do_not_affect_others(self):
+        frames = {
+            "frame_0.png": grayscale_frame(0),
+            "frame_1.png": np.zeros_like(grayscale_frame(1)),
+            "frame_2.png": frame_without_scan_window(2),
+            "frame_3.png": grayscale_frame(3)}
+        self.write_patient("P1", frames)
+
+        records = self.run_pipeline("P1", "t1")
+
+        # Frames failing OCR are skipped. Frames failing segmentation have no focus
+        self.assertEqual([record[FRAME_LABEL] for record in records], ["frame_0.png", "frame_2.png", "frame_3.png"])
+        self.assertNotIn(FOCUS_HASH_LABEL, records[1])
+        self.assert_focuses([records[0], records[2]], frames)
+
+    def test_second_run_served_from_frame_cache(self):
+        frames = {
+            "frame_0.png": grayscale_frame(0),
+            "frame_1.png": color_frame(1),
+            "frame_2.png": frame_without_scan_window(2)}
+        self.write_patient("P1", frames)
+        frame_cache = FrameCache(os.path.join(self.directory, "cache"))
+
+        first_records = self.run_pipeline("P1", "t1", frame_cache)
+
+        with mock.patch.object(process, "frame_focus_batch") as frame_focus_batch, \
+                mock.patch.object(process, "isolate_text_batch") as isolate_text_batch, \
+                mock.patch.object(process.cv2, "imdecode") as imdecode:
+            second_records = self.run_pipeline("P1", "t2", frame_cache)
+
+        self.assertFalse(frame_focus_batch.called or isolate_text_batch.called or imdecode.called)
+        self.assertEqual(self.without_focus_paths(second_records), self.without_focus_paths(first_records))
+        self.assertTrue(all(os.path.dirname(record[FOCUS_HASH_LABEL]).endswith("focus_t2")
+                            for record in second_records if FOCUS_HASH_LABEL in record))
+        self.assert_focuses([record for record in second_records if FOCUS_HASH_LABEL in record], frames)
+
+    def test_identical_readouts_recognized_once(self):
+        frames = {"frame_{0}.png".format(seed): grayscale_frame(seed) for seed in range(3)}
+        self.write_patient("P1", frames)
+        ocr_engine = MemoizedEngine(FakeOCREngine())
+
+        with mock.patch.object(process, "get_ocr_engine", return_value=ocr_engine):
+            records = self.run_pipeline("P1", "t1")
+
+        # The three readout regions are identical in every frame
+        self.assertEqual(len(records), 3)
+        self.assertEqual((ocr_engine.misses, ocr_engine.hits), (3, 6))
+
+    def test_map_patients_keeps_task_order(self):
+        patients = {
+            "P1": {"frame_0.png": grayscale_frame(0), "frame_1.png": color_frame(1)},
+            "P2": {"frame_0.png": color_frame(2)},
+            "P3": {"frame_0.png": grayscale_frame(3), "frame_1.png": grayscale_frame(4)}}
+        for patient, frames in patients.items():
+            self.write_patient(patient, frames)
+
+        results = {}
+        for workers, timestamp in [(1, "serial"), (2, "parallel")]:
+            tasks = [(patient, TUMOR_BENIGN, self.directory, "frames", "focus", timestamp, None)
+                     for patient in sorted(patients)]
+            results[workers] = process.map_patients(
+                process.patient_frame_pipeline_task, tasks, "test", workers=workers,
+                path_to_log_dir=self.directory, timestamp=timestamp)
+
+        self.assertEqual([patient for patient, _ in results[2]], sorted(patients))
+        for (patient, serial_records), (_, parallel_records) in zip(results[1], results[2]):
+            self.assertEqual(self.without_focus_paths(parallel_records), self.without_focus_paths(serial_records))
+            self.assert_focuses(parallel_records, patients[patient])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,326 @@
+import unittest
+
+from unittest import mock
+
+import numpy as np
+
+from keras_preprocessing.image import image_data_generator
+from keras_preprocessing.image import ImageDataGenerator, apply_affine_transform, apply_affine_transform_batch
+from keras_preprocessing.image.image_data_generator import ZCA_EXACT_MAX_FEATURES
+
+
+class ArraySequence(object):
+    """Yields fixed float64 batches of an array, as a Keras Sequence"""
+
+    def __init__(self, x, batch_size):
+        self.batches = [x[i:i + batch_size] for i in range(0, len(x), batch_size)]
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __getitem__(self, i):
+        return self.batches[i]
+
+    def on_epoch_end(self):
+        pass
+
+
+def correlated_images(n, shape, rank=None, seed=0):
+    """Images with correlated pixels and channels. Of a low rank plus noise if rank is given"""
+    random_state = np.random.RandomState(seed)
+    features = int(np.prod(shape))
+
+    if rank is None:
+        mixing = random_state.uniform(-1, 1, (features, features)) / np.sqrt(features)
+        x = random_state.standard_normal((n, features)).dot(mixing + np.eye(features))
+    else:
+        components = random_state.standard_normal((rank, features)) * np.logspace(1, 0, rank)[:, np.newaxis]
+        x = random_state.standard_normal((n, rank)).dot(components) + 0.01 * random_state.standard_normal((n, features))
+
+    return np.reshape(x + 5, (n,) + shape)
+
+
+class Test_FitFromIterator(unittest.TestCase):
+    def fit_both(self, x, **kwargs):
+        fitted = ImageDataGenerator(**kwargs)
+        fitted.fit(x)
+
+        from_iterator = ImageDataGenerator(**kwargs)
+        batches = ArraySequence(x.astype(np.float64), 64)
+        copies = [batch.copy() for batch in batches.batches]
+        from_iterator.fit_from_iterator(batches)
+
+        # The batches of the iterator are left untouched
+        for batch, copy in zip(batches.batches, copies):
+            np.testing.assert_array_equal(batch, copy)
+
+        return fitted, from_iterator
+
+    def assert_same_whitening(self, x, fitted, from_iterator, rtol=1e-3, atol=1e-3):
+        np.testing.assert_allclose(
+            from_iterator.standardize(x[:20].astype(np.float32)),
+            fitted.standardize(x[:20].astype(np.float32)),
+            rtol=rtol, atol=atol)
+
+    def test_mean_and_std(self):
+        x = correlated_images(500, (4, 5, 3))
+
+        fitted, from_iterator = self.fit_both(x, featurewise_center=True, featurewise_std_normalization=True)
+
+        np.testing.assert_allclose(from_iterator.mean, fitted.mean, rtol=1e-5)
+        np.testing.assert_allclose(from_iterator.std, fitted.std, rtol=1e-4)
+
+    def test_full_zca(self):
+        x = correlated_images(500, (4, 4, 3))
+
+        fitted, from_iterator = self.fit_both(x, zca_whitening=True, featurewise_center=True)
+
+        np.testing.assert_allclose(
+            from_iterator.principal_components, fitted.principal_components, rtol=1e-3, atol=1e-3)
+        self.assert_same_whitening(x, fitted, from_iterator)
+
+    def test_zca_rank(self):
+        x = correlated_images(500, (4, 4, 3))
+
+        fitted, from_iterator = self.fit_both(x, zca_whitening=True, featurewise_center=True, zca_rank=6)
+
+        self.assert_same_whitening(x, fitted, from_iterator)
+
+    def test_zca_rank_randomized_above_exact_features(self):
+        shape = (40, 40, 3)
+        self.assertGreater(np.prod(shape), ZCA_EXACT_MAX_FEATURES)
+        x = correlated_images(500, shape, rank=8)
+
+        fitted, from_iterator = self.fit_both(x, zca_whitening=True, featurewise_center=True, zca_rank=4)
+
+        self.assertTrue(from_iterator.principal_axes is not None)
+        self.assert_same_whitening(x, fitted, from_iterator, rtol=1e-2, atol=1e-2)
+
+    def test_patch_zca(self):
+        x = correlated_images(500, (6, 6, 3))
+
+        fitted, from_iterator = self.fit_both(
+            x, zca_whitening=True, featurewise_center=True, zca_patch_size=(3, 3))
+
+        np.testing.assert_allclose(
+            from_iterator.principal_components, fitted.principal_components, rtol=1e-3, atol=1e-3)
+        self.assert_same_whitening(x, fitted, from_iterator)
+
+
+class Test_ZCA(unittest.TestCase):
+    def fit_rank(self, x, rank, **kwargs):
+        generator = ImageDataGenerator(zca_whitening=True, featurewise_center=True, zca_rank=rank, **kwargs)
+        generator.fit_from_iterator(ArraySequence(x, 50))
+        return generator.principal_components.dot(generator.principal_axes.T)
+
+    def test_rank_below_exact_features_uses_exact_covariance(self):
+        x = correlated_images(300, (4, 4, 3))
+        self.assertLess(x[0].size, ZCA_EXACT_MAX_FEATURES)
+
+        exact = ImageDataGenerator(zca_whitening=True, featurewise_center=True, zca_rank=5)
+        exact.fit(x)
+        expected = exact.principal_components.dot(exact.principal_axes.T)
+
+        np.testing.assert_allclose(self.fit_rank(x, 5, zca_power_iterations=0), expected, rtol=1e-4, atol=1e-4)
+
+        # The randomized range finder would only approximate the components of these images
+        with mock.patch.object(image_data_generator, "ZCA_EXACT_MAX_FEATURES", 0):
+            randomized = self.fit_rank(x, 5, zca_power_iterations=0)
+        self.assertGreater(np.abs(randomized - expected).max(), 1e-2)
+
+    def test_all_components_kept_is_full_zca(self):
+        shape = (4, 4, 3)
+        x = correlated_images(300, shape)
+
+        full = ImageDataGenerator(zca_whitening=True, featurewise_center=True)
+        full.fit_from_iterator(ArraySequence(x, 50))
+
+        np.testing.assert_allclose(
+            self.fit_rank(x, int(np.prod(shape))), full.principal_components, rtol=1e-4, atol=1e-4)
+
+    def test_whitened_second_moment_is_identity(self):
+        x = correlated_images(2000, (3, 3, 3))
+        generator = ImageDataGenerator(zca_whitening=True, featurewise_center=True, zca_epsilon=1e-9)
+        generator.fit_from_iterator(ArraySequence(x, 100))
+
+        whitened = np.reshape(generator.standardize(x.astype(np.float32)), (len(x), -1))
+
+        # Images are centered on the channel means, so the second moment is whitened
+        np.testing.assert_allclose(whitened.T.dot(whitened) / len(x), np.eye(27), atol=1e-3)
+
+    def test_patches_are_ordered_rows_columns_channels(self):
+        x = random_images(n=2, shape=(5, 6, 3))
+
+        for data_format in ["channels_last", "channels_first"]:
+            generator = ImageDataGenerator(zca_patch_size=(3, 5), data_format=data_format)
+            batch = x if data_format == "channels_last" else np.moveaxis(x, -1, 1)
+
+            patches = generator._patches(batch)
+
+            self.assertEqual(patches.shape, (2 * 3 * 2, 3 * 5 * 3))
+            np.testing.assert_array_equal(patches[0], x[0, :3, :5].reshape(-1))
+            np.testing.assert_array_equal(patches[2 * 2 + 1], x[0, 2:5, 1:6].reshape(-1))
+            np.testing.assert_array_equal(patches[-1], x[1, 2:5, 1:6].reshape(-1))
+
+    def test_whitened_patches_round_trip(self):
+        x = correlated_images(50, (7, 8, 3))
+        generator = ImageDataGenerator(zca_whitening=True, featurewise_center=True, zca_patch_size=(3, 3))
+        generator.fit(x)
+
+        image = x[:1].astype(np.float32) - generator.mean
+        whitened = generator._whiten_patches(image.copy())
+
+        # Away from the borders, a whitened pixel is the whitening rows of the patch center applied to its patch
+        center_rows = np.reshape(generator.principal_components, (3, -1))
+        expected = np.reshape(generator._patches(image).dot(center_rows.T), (1, 5, 6, 3))
+
+        np.testing.assert_allclose(whitened[:, 1:-1, 1:-1], expected, rtol=1e-4, atol=1e-4)
+
+
+def random_images(n=16, shape=(5, 6, 3), seed=0):
+    return np.random.RandomState(seed).uniform(0, 255, (n,) + shape).astype(np.float32)
+
+
+def per_sample_random_transform(generator, x, seed):
+    np.random.seed(seed)
+    return np.stack([generator.random_transform(image) for image in x])
+
+
+class Test_TransformPlan(unittest.TestCase):
+    def test_flip_only_matches_per_sample_transform(self):
+        x = random_images()
+
+        for horizontal_flip, vertical_flip in [(True, True), (True, False), (False, True)]:
+            generator = ImageDataGenerator(horizontal_flip=horizontal_flip, vertical_flip=vertical_flip)
+            self.assertTrue(generator._flip_only)
+
+            np.testing.assert_array_equal(
+                generator.random_transform_batch(x, seed=11),
+                per_sample_random_transform(generator, x, seed=11))
+
+    def test_flip_only_parameters_match_per_sample_draws(self):
+        generator = ImageDataGenerator(horizontal_flip=True, vertical_flip=True)
+
+        np.random.seed(5)
+        expected = [generator.get_random_transform((5, 6, 3)) for _ in range(16)]
+        next_after_loop = np.random.random()
+
+        params = generator.get_random_transform_batch((16, 5, 6, 3), seed=5)
+
+        for key in ["flip_horizontal", "flip_vertical", "theta", "tx", "ty", "shear", "zx", "zy"]:
+            np.testing.assert_array_equal(params[key], [p[key] for p in expected])
+        # The random state continues as after the per-sample draws
+        self.assertEqual(np.random.random(), next_after_loop)
+
+    def test_augmentation_disables_flip_only(self):
+        for kwargs in [{"rotation_range": 10}, {"zoom_range": 0.1}, {"brightness_range": (0.5, 1.5)}]:
+            self.assertFalse(ImageDataGenerator(horizontal_flip=True, **kwargs)._flip_only)
+
+    def test_rescale_only_matches_per_sample_standardize(self):
+        x = random_images()
+        generator = ImageDataGenerator(rescale=1. / 255)
+        self.assertTrue(generator._rescale_only)
+
+        np.testing.assert_array_equal(
+            generator.standardize_batch(x.copy()),
+            np.stack([generator.standardize(image.copy()) for image in x]))
+
+    def test_rescale_only_finalizes_integer_batches(self):
+        x = random_images().astype(np.uint8)
+        generator = ImageDataGenerator(rescale=1. / 255)
+
+        np.testing.assert_array_equal(
+            generator.finalize_batch(x),
+            np.stack([generator.standardize(image.astype(np.float32)) for image in x]))
+
+    def test_normalization_disables_rescale_only(self):
+        x = random_images()
+        generator = ImageDataGenerator(rescale=1. / 255, samplewise_center=True)
+        self.assertFalse(generator._rescale_only)
+
+        np.testing.assert_allclose(
+            generator.standardize_batch(x.copy()),
+            np.stack([generator.standardize(image.copy()) for image in x]))
+
+
+class Test_BatchTransforms(unittest.TestCase):
+    configurations = [
+        {"rotation_range": 30},
+        {"width_shift_range": 0.2, "height_shift_range": 0.2},
+        {"width_shift_range": [-1, 2], "height_shift_range": 2},
+        {"zoom_range": 0.3},
+        {"shear_range": 15},
+        {"horizontal_flip": True, "vertical_flip": True},
+        {"channel_shift_range": 20, "brightness_range": (0.5, 1.5)},
+        {"rotation_range": 20, "width_shift_range": 0.1, "zoom_range": [0.8, 1.2], "horizontal_flip": True,
+         "fill_mode": "constant", "cval": 7.},
+    ]
+
+    def test_random_transform_batch_matches_per_sample_transform(self):
+        x = random_images()
+
+        for kwargs in self.configurations:
+            generator = ImageDataGenerator(**kwargs)
+
+            np.testing.assert_array_equal(
+                generator.random_transform_batch(x, seed=3),
+                per_sample_random_transform(generator, x, seed=3),
+                err_msg=str(kwargs))
+
+    def test_parameters_then_apply_match_per_sample_transform(self):
+        x = random_images()
+
+        for kwargs in self.configurations:
+            generator = ImageDataGenerator(**kwargs)
+
+            params = generator.get_random_transform_batch(x.shape, seed=8)
+            np.testing.assert_array_equal(
+                generator.apply_transform_batch(x, params),
+                per_sample_random_transform(generator, x, seed=8),
+                err_msg=str(kwargs))
+
+    def test_channels_first(self):
+        x = np.moveaxis(random_images(), -1, 1)
+        generator = ImageDataGenerator(
+            rotation_range=30, width_shift_range=0.2, zoom_range=0.2, horizontal_flip=True,
+            data_format="channels_first")
+
+        np.testing.assert_array_equal(
+            generator.random_transform_batch(x, seed=4),
+            per_sample_random_transform(generator, x, seed=4))
+
+    def test_batch_is_not_modified(self):
+        x = random_images()
+        copy = x.copy()
+
+        ImageDataGenerator(rotation_range=30, horizontal_flip=True, channel_shift_range=10).random_transform_batch(x)
+
+        np.testing.assert_array_equal(x, copy)
+
+    def test_apply_affine_transform_batch_matches_per_image(self):
+        x = random_images(n=5)
+        theta = [0, 30, 0, 0, -10]
+        tx = [0, 0, 1.5, 0, 2]
+        ty = [0, 0, -2, 0, 1]
+        shear = [0, 0, 0, 0, 10]
+        zx = [1, 1, 1, 0.8, 1.1]
+        zy = [1, 1, 1, 1.2, 0.9]
+
+        batch = apply_affine_transform_batch(x, theta, tx, ty, shear, zx, zy, fill_mode="reflect")
+
+        for i, image in enumerate(x):
+            np.testing.assert_array_equal(
+                batch[i],
+                apply_affine_transform(image, theta[i], tx[i], ty[i], shear[i], zx[i], zy[i],
+                                       row_axis=0, col_axis=1, channel_axis=2, fill_mode="reflect"))
+        # Images without a transformation are not resampled
+        np.testing.assert_array_equal(batch[0], x[0])
+
+    def test_identity_batch_is_returned(self):
+        x = random_images(n=3)
+
+        self.assertIs(apply_affine_transform_batch(x, [0] * 3, [0] * 3, [0] * 3, [0] * 3, [1] * 3, [1] * 3), x)
+
+
+if __name__ == '__main__':
+    unittest.main()
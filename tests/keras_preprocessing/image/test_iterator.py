@@ -0,0 +1,176 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from PIL import Image
+
+from keras_preprocessing.image import ImageDataGenerator
+from keras_preprocessing.image import iterator as iterator_module
+
+
+def augmenting_generator():
+    return ImageDataGenerator(
+        rotation_range=20,
+        width_shift_range=0.1,
+        zoom_range=0.1,
+        horizontal_flip=True)
+
+
+def images(n=40, size=12):
+    return np.random.RandomState(0).uniform(0, 255, (n, size, size, 3))
+
+
+def copy(batch):
+    # Shared memory batches are views of slots that are reused
+    if isinstance(batch, tuple):
+        return tuple(array.copy() for array in batch)
+    return batch.copy()
+
+
+def take(iterator, count):
+    batches = [copy(next(iterator)) for _ in range(count)]
+    iterator.close()
+    return batches
+
+
+class Test_PrefetchIterator(unittest.TestCase):
+    def test_seeded_runs_are_identical(self):
+        runs = [
+            take(augmenting_generator().flow(images(), batch_size=4, seed=7).prefetch(max_prefetch=6, workers=4), 20)
+            for _ in range(2)]
+
+        for first, second in zip(*runs):
+            np.testing.assert_array_equal(first, second)
+
+    def test_batches_do_not_depend_on_workers(self):
+        serial = take(augmenting_generator().flow(images(), batch_size=4, seed=7).prefetch(workers=1), 12)
+        parallel = take(augmenting_generator().flow(images(), batch_size=4, seed=7).prefetch(workers=4), 12)
+
+        for first, second in zip(serial, parallel):
+            np.testing.assert_array_equal(first, second)
+
+    def test_batches_follow_the_iterator_order(self):
+        x = np.arange(10, dtype="float32").reshape(10, 1, 1, 1) * np.ones((1, 2, 2, 1), dtype="float32")
+
+        batches = take(ImageDataGenerator().flow(x, batch_size=3, shuffle=False).prefetch(workers=3), 5)
+
+        np.testing.assert_array_equal(
+            np.concatenate([batch[:, 0, 0, 0] for batch in batches]),
+            [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 0, 1, 2])
+        self.assertEqual([len(batch) for batch in batches], [3, 3, 3, 1, 3])
+
+
+class Test_SharedMemoryPrefetchIterator(unittest.TestCase):
+    def test_batches_follow_the_iterator_order(self):
+        x = np.arange(10, dtype="float32").reshape(10, 1, 1, 1) * np.ones((1, 2, 2, 1), dtype="float32")
+
+        batches = take(ImageDataGenerator().flow(x, np.arange(10), batch_size=3, shuffle=False)
+                       .shared_memory_prefetch(max_prefetch=4, workers=3, max_held=2), 5)
+
+        self.assertEqual([len(y) for _, y in batches], [3, 3, 3, 1, 3])
+        np.testing.assert_array_equal(np.concatenate([y for _, y in batches]), [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 0, 1, 2])
+        for batch_x, batch_y in batches:
+            np.testing.assert_array_equal(batch_x[:, 0, 0, 0], batch_y)
+
+    def test_seeded_runs_are_identical(self):
+        runs = [
+            take(augmenting_generator().flow(images(), batch_size=4, seed=7)
+                 .shared_memory_prefetch(max_prefetch=4, workers=3), 15)
+            for _ in range(2)]
+        serial = take(augmenting_generator().flow(images(), batch_size=4, seed=7)
+                      .shared_memory_prefetch(max_prefetch=4, workers=1), 15)
+
+        for first, second, third in zip(runs[0], runs[1], serial):
+            np.testing.assert_array_equal(first, second)
+            np.testing.assert_array_equal(first, third)
+
+    def test_segments_are_released_on_close(self):
+        prefetcher = augmenting_generator().flow(images(), batch_size=4, seed=7).shared_memory_prefetch(
+            max_prefetch=4, workers=2)
+        names = [segment.name for segment in prefetcher.segments]
+
+        held = next(prefetcher)
+        for _ in range(6):
+            next(prefetcher)
+        prefetcher.close()
+
+        self.assertEqual(prefetcher.segments, [])
+        self.assertFalse(any(process.is_alive() for process in prefetcher.processes))
+        for name in names:
+            with self.assertRaises(FileNotFoundError):
+                iterator_module.shared_memory.SharedMemory(name=name)
+
+        # A batch still referenced keeps its segment mapped until it is released
+        self.assertTrue(iterator_module._pending_segments)
+        self.assertEqual(held.shape, (4, 12, 12, 3))
+        del held
+        iterator_module._release_segments([])
+        self.assertEqual(iterator_module._pending_segments, [])
+
+
+class Test_BatchFromFilesMixin(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        random_state = np.random.RandomState(0)
+        filenames = []
+        for i in range(20):
+            filename = os.path.join(self.directory, "image_{0}.png".format(i))
+            Image.fromarray(random_state.randint(0, 256, (12, 10, 3)).astype(np.uint8)).save(filename)
+            filenames.append(filename)
+        self.dataframe = pd.DataFrame({"filename": filenames, "class": ["a", "b"] * 10})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def flow(self, num_threads):
+        return augmenting_generator().flow_from_dataframe(
+            self.dataframe,
+            target_size=(12, 10),
+            class_mode="binary",
+            batch_size=6,
+            seed=5,
+            num_threads=num_threads)
+
+    def test_threads_produce_serial_batches(self):
+        serial = self.flow(None)
+        threaded = self.flow(4)
+
+        for i in range(len(serial)):
+            serial_x, serial_y = serial[i]
+            threaded_x, threaded_y = threaded[i]
+            np.testing.assert_array_equal(threaded_x, serial_x)
+            np.testing.assert_array_equal(threaded_y, serial_y)
+
+    def test_thread_pool_is_recreated_after_fork(self):
+        iterator = self.flow(2)
+        iterator[0]
+        parent_pool = iterator._thread_pool
+
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+
+        def produce():
+            x, _ = iterator[1]
+            results.put((x, iterator._thread_pool is parent_pool, iterator._thread_pool_pid == os.getpid()))
+
+        process = context.Process(target=produce)
+        process.start()
+        x, reused_parent_pool, pool_of_child = results.get(timeout=30)
+        process.join()
+
+        # The random state of a batch depends on the batches seen, identical in both processes
+        expected_x, _ = iterator[1]
+        np.testing.assert_array_equal(x, expected_x)
+        self.assertFalse(reused_parent_pool)
+        self.assertTrue(pool_of_child)
+        # The pool of the parent is kept
+        self.assertIs(iterator._thread_pool, parent_pool)
+
+
+if __name__ == '__main__':
+    unittest.main()
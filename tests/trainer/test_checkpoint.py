@@ -0,0 +1,111 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from keras_preprocessing.image import ImageDataGenerator
+
+from src.trainer.checkpoint import CHECKPOINT_PREFIX, LATEST_CHECKPOINT_FILE, TrainingCheckpoint, load_checkpoint
+
+
+class FakeWeightsModel(object):
+    """Writes its weights file in the manner of a keras Model"""
+
+    def save_weights(self, path):
+        with open(path, "wb") as f:
+            f.write(b"weights")
+
+
+class FakeOptimizer(object):
+    def get_weights(self):
+        return [np.arange(3), np.ones((2, 2))]
+
+
+class FakeTrainingModel(object):
+    optimizer = FakeOptimizer()
+
+
+class Test_IteratorState(unittest.TestCase):
+    def flow(self):
+        x = np.arange(10, dtype=np.float32).reshape((10, 1, 1, 1))
+        return ImageDataGenerator().flow(x, np.arange(10), batch_size=4, shuffle=True, seed=3)
+
+    def test_batches_identical_after_set_state(self):
+        iterator = self.flow()
+        # Stop within the second epoch
+        for _ in range(4):
+            next(iterator)
+
+        state = json.loads(json.dumps(iterator.get_state()))
+        expected = [next(iterator)[1] for _ in range(5)]
+
+        resumed = self.flow()
+        resumed.set_state(state)
+
+        for expected_y, (_, resumed_y) in zip(expected, [next(resumed) for _ in range(5)]):
+            np.testing.assert_array_equal(resumed_y, expected_y)
+
+
+class Test_TrainingCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.checkpoint_dir = os.path.join(self.directory, "checkpoints")
+        # Weights are written to the working directory before the copy
+        self.working_directory = os.getcwd()
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        os.chdir(self.working_directory)
+        shutil.rmtree(self.directory)
+
+    def test_latest_checkpoint_kept_and_older_pruned(self):
+        callback = TrainingCheckpoint(
+            self.checkpoint_dir, "test", "train", FakeWeightsModel(), history={"loss": [0.9]}, max_to_keep=2)
+        callback.set_model(FakeTrainingModel())
+
+        for epoch in range(1, 4):
+            callback.on_epoch_end(epoch, logs={"loss": 1. / epoch})
+
+        state = load_checkpoint(self.checkpoint_dir, "test")
+
+        self.assertEqual(state["epoch"], 4)
+        self.assertEqual(state["stage"], "train")
+        self.assertEqual(state["history"]["loss"], [0.9, 1., 0.5, 1. / 3])
+        self.assertIsNone(load_checkpoint(self.checkpoint_dir, "test", epoch=2))
+        self.assertEqual(load_checkpoint(self.checkpoint_dir, "test", epoch=3)["epoch"], 3)
+        self.assertEqual(sorted(os.listdir(self.checkpoint_dir)), sorted(
+            [LATEST_CHECKPOINT_FILE.format("test")] +
+            [CHECKPOINT_PREFIX.format("test", epoch) + suffix
+             for epoch in [3, 4] for suffix in [".h5", "_optimizer.npz", "_state.json"]]))
+
+    def test_checkpoints_before_resume_are_pruned(self):
+        callback = TrainingCheckpoint(self.checkpoint_dir, "test", "train", FakeWeightsModel(), max_to_keep=2)
+        callback.set_model(FakeTrainingModel())
+
+        for epoch in range(2):
+            callback.on_epoch_end(epoch)
+
+        # Fine tuning continues the epochs of the same identifier
+        fine_tune = TrainingCheckpoint(self.checkpoint_dir, "test", "fine_tune", FakeWeightsModel(), max_to_keep=2)
+        fine_tune.set_model(FakeTrainingModel())
+        fine_tune.on_epoch_end(2)
+
+        # A new process resumes the fine tuning from the latest checkpoint
+        resumed = TrainingCheckpoint(self.checkpoint_dir, "test", "fine_tune", FakeWeightsModel(), max_to_keep=1)
+        resumed.set_model(FakeTrainingModel())
+
+        self.assertEqual(resumed.prefixes, [CHECKPOINT_PREFIX.format("test", 3)])
+
+        resumed.on_epoch_end(3)
+
+        self.assertIsNone(load_checkpoint(self.checkpoint_dir, "test", epoch=3))
+        self.assertEqual(load_checkpoint(self.checkpoint_dir, "test")["epoch"], 4)
+        # Checkpoints of the other stage are kept
+        self.assertEqual(load_checkpoint(self.checkpoint_dir, "test", epoch=1)["stage"], "train")
+        self.assertEqual(load_checkpoint(self.checkpoint_dir, "test", epoch=2)["stage"], "train")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from PIL import Image
+from keras_preprocessing.image import ImageDataGenerator, ShardIterator
+
+from src.utilities.dataset.dataset import compile_dataset, load_image_array
+
+CLASSES = ["BENIGN", "MALIGNANT"]
+TARGET_SHAPE = (16, 16)
+
+
+class Test_CompileDataset(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dataset_dir = os.path.join(self.directory, "dataset")
+
+        random_state = np.random.RandomState(0)
+        rows = []
+        # Sizes around the target shape, so that frames are both center cropped and upscaled
+        for i, height in enumerate([20, 24, 16, 12, 30]):
+            path = os.path.join(self.directory, "{0}.png".format(i))
+            Image.fromarray(random_state.randint(0, 255, (height, 22, 3)).astype(np.uint8)).save(path)
+            rows.append({"filename": path, "class": CLASSES[i % 2], "patient": "P{0}".format(i // 2)})
+
+        self.dataframe = pd.DataFrame(rows)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def shard_modification_times(self):
+        return {filename: os.stat(os.path.join(self.dataset_dir, filename)).st_mtime_ns
+                for filename in os.listdir(self.dataset_dir) if filename.endswith(".npy")}
+
+    def test_reused_until_frames_change(self):
+        index = compile_dataset(self.dataframe, self.dataset_dir, TARGET_SHAPE, CLASSES, shard_size=2)
+        modification_times = self.shard_modification_times()
+
+        reused = compile_dataset(self.dataframe, self.dataset_dir, TARGET_SHAPE, CLASSES, shard_size=2)
+
+        self.assertEqual(reused["fingerprint"], index["fingerprint"])
+        self.assertEqual(self.shard_modification_times(), modification_times)
+
+        changed = compile_dataset(self.dataframe.iloc[1:], self.dataset_dir, TARGET_SHAPE, CLASSES, shard_size=2)
+
+        self.assertNotEqual(changed["fingerprint"], index["fingerprint"])
+        self.assertEqual(changed["filenames"], self.dataframe["filename"].tolist()[1:])
+        self.assertEqual([shard["samples"] for shard in changed["shards"]], [2, 2])
+        np.testing.assert_array_equal(
+            ShardIterator(self.dataset_dir, shuffle=False)._get_sample(0),
+            load_image_array(self.dataframe["filename"][1], TARGET_SHAPE))
+
+    def test_samples_split_across_shards(self):
+        index = compile_dataset(self.dataframe, self.dataset_dir, TARGET_SHAPE, CLASSES, shard_size=2)
+
+        self.assertEqual([shard["samples"] for shard in index["shards"]], [2, 2, 1])
+
+        iterator = ShardIterator(self.dataset_dir, shuffle=False)
+        for j, filename in enumerate(self.dataframe["filename"]):
+            np.testing.assert_array_equal(iterator._get_sample(j), load_image_array(filename, TARGET_SHAPE))
+
+    def test_shard_batches_equal_dataframe_batches(self):
+        compile_dataset(self.dataframe, self.dataset_dir, TARGET_SHAPE, CLASSES, shard_size=2)
+        generator = ImageDataGenerator(rescale=1. / 255)
+
+        dataframe_iterator = generator.flow_from_dataframe(
+            self.dataframe,
+            directory=None,
+            target_size=TARGET_SHAPE,
+            class_mode="binary",
+            classes=CLASSES,
+            batch_size=3,
+            seed=7,
+            drop_duplicates=False)
+        shard_iterator = generator.flow_from_shards(self.dataset_dir, class_mode="binary", batch_size=3, seed=7)
+
+        for _ in range(4):
+            (dataframe_x, dataframe_y), (shard_x, shard_y) = next(dataframe_iterator), next(shard_iterator)
+            np.testing.assert_array_equal(shard_x, dataframe_x)
+            np.testing.assert_array_equal(shard_y, dataframe_y)
+
+if __name__ == '__main__':
+    unittest.main()
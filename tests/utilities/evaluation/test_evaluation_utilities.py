@@ -0,0 +1,68 @@
+import io
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from src.utilities.evaluation.evaluation import (
+    aggregate_patients,
+    binary_classification_metrics,
+    frame_predictions,
+    prediction_frame,
+    read_prediction_store,
+    reduce_crops,
+    write_prediction_store)
+
+
+class Test_PredictionStore(unittest.TestCase):
+    def setUp(self):
+        self.dataframe = pd.DataFrame({
+            "filename": ["a.png", "b.png", "c.png", "b.png"],
+            "class": ["BENIGN", "BENIGN", "MALIGNANT", "BENIGN"],
+            "patient": ["P1", "P1", "P2", "P1"]
+        })
+
+    def test_store_round_trip(self):
+        store = prediction_frame(self.dataframe, ["c.png", "a.png", "b.png"], [[0.9], [0.1], [0.4]], "validation")
+
+        buffer = io.BytesIO()
+        write_prediction_store(store, buffer)
+        buffer.seek(0)
+        loaded = read_prediction_store(buffer)
+
+        self.assertEqual(loaded["patient"].tolist(), ["P2", "P1", "P1"])
+        self.assertEqual(loaded["class"].tolist(), ["MALIGNANT", "BENIGN", "BENIGN"])
+        np.testing.assert_array_almost_equal(loaded["prediction"], [0.9, 0.1, 0.4])
+
+    def test_duplicate_rows_share_prediction(self):
+        store = prediction_frame(self.dataframe, ["a.png", "b.png", "c.png"], [0.1, 0.4, 0.9], "validation")
+
+        np.testing.assert_array_almost_equal(frame_predictions(store, self.dataframe), [0.1, 0.4, 0.9, 0.4])
+
+    def test_patient_aggregation(self):
+        store = prediction_frame(self.dataframe, ["a.png", "b.png", "c.png"], [0.1, 0.4, 0.9], "validation")
+
+        patients = aggregate_patients(store, "max")
+
+        self.assertEqual(patients["patient"].tolist(), ["P1", "P2"])
+        self.assertEqual(patients["class"].tolist(), ["BENIGN", "MALIGNANT"])
+        self.assertEqual(patients["frames"].tolist(), [2, 1])
+        np.testing.assert_array_almost_equal(patients["prediction"], [0.4, 0.9])
+
+
+class Test_BinaryClassificationMetrics(unittest.TestCase):
+    def test_perfect_predictions(self):
+        classes = ["BENIGN", "MALIGNANT", "BENIGN", "MALIGNANT"]
+        _, _, scores_df = binary_classification_metrics(classes, [0.2, 0.8, 0.1, 0.7])
+
+        self.assertEqual(scores_df["AUC"][0], 1.0)
+        self.assertEqual(scores_df[["TP", "FP", "FN", "TN"]].values.tolist(), [[2, 0, 0, 2]])
+
+    def test_reduce_crops(self):
+        predictions = np.array([[0.1], [0.3], [0.8], [0.9], [0.2], [0.6]])
+
+        np.testing.assert_array_almost_equal(reduce_crops(predictions, 3), [0.4, 1.7 / 3])
+        np.testing.assert_array_almost_equal(reduce_crops(predictions, 2, "max"), [0.3, 0.9, 0.6])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.utilities.features.features import compile_feature_cache, feature_batches
+
+
+class ArrayIterator(object):
+    """Unshuffled batches of an image array, in the manner of an Iterator"""
+
+    def __init__(self, images, classes, batch_size):
+        self.images = images
+        self.classes = classes
+        self.batch_size = batch_size
+
+    def __len__(self):
+        return (len(self.images) + self.batch_size - 1) // self.batch_size
+
+    def __getitem__(self, idx):
+        batch = slice(idx * self.batch_size, (idx + 1) * self.batch_size)
+        return self.images[batch], self.classes[batch]
+
+
+class FlipGenerator(object):
+    """Horizontal flips and rescaling of channels_last batches, in the manner of an ImageDataGenerator"""
+
+    horizontal_flip = True
+    vertical_flip = False
+
+    def __init__(self, rescale):
+        self.rescale = rescale
+
+    def apply_transform_batch(self, x, transform_parameters):
+        if not transform_parameters["flip_horizontal"].any():
+            return x
+        return np.where(transform_parameters["flip_horizontal"][:, None, None, None], x[:, :, ::-1], x)
+
+    def standardize_batch(self, x):
+        x *= self.rescale
+        return x
+
+
+def first_column(images):
+    return images[:, :, 0, 0]
+
+
+class Test_FeatureCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.images = np.random.randint(0, 255, (5, 4, 6, 1)).astype(np.float32)
+        self.iterator = ArrayIterator(self.images, np.array([0, 1, 1, 0, 1]), batch_size=2)
+        self.generator = FlipGenerator(rescale=0.5)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_features_of_every_flip(self):
+        index, features = compile_feature_cache(
+            self.cache_dir, self.iterator, self.generator, first_column, {"model": "test"})
+
+        self.assertEqual(index["variants"], [[False, False], [True, False]])
+        self.assertEqual(features.shape, (2, 5, 4))
+        np.testing.assert_array_equal(features[0], self.images[:, :, 0, 0] * 0.5)
+        np.testing.assert_array_equal(features[1], self.images[:, :, -1, 0] * 0.5)
+        # The images of the iterator are not modified
+        np.testing.assert_array_equal(self.iterator.images, self.images)
+
+    def test_cache_reused_until_description_changes(self):
+        compile_feature_cache(self.cache_dir, self.iterator, self.generator, first_column, {"model": "test"})
+
+        reused = compile_feature_cache(self.cache_dir, self.iterator, self.generator, None, {"model": "test"})
+        self.assertEqual(reused[1].shape, (2, 5, 4))
+
+        self.assertRaises(
+            TypeError,
+            compile_feature_cache, self.cache_dir, self.iterator, self.generator, None, {"model": "other"})
+
+    def test_batches_cover_every_sample_once_per_epoch(self):
+        features = np.arange(2 * 5).reshape((2, 5, 1)) % 5
+        labels = np.arange(5)
+        batches = feature_batches(features, labels, batch_size=2, seed=3)
+
+        epoch = [next(batches) for _ in range(3)]
+
+        self.assertEqual([len(batch_labels) for _, batch_labels in epoch], [2, 2, 1])
+        epoch_features = np.concatenate([batch_features[:, 0] for batch_features, _ in epoch])
+        epoch_labels = np.concatenate([batch_labels for _, batch_labels in epoch])
+        self.assertEqual(sorted(epoch_labels), [0, 1, 2, 3, 4])
+        np.testing.assert_array_equal(epoch_features, epoch_labels)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -233,5 +233,88 @@ class Test_TestSampleToBatchCenterOrigin(unittest.TestCase):
         args, _ = applyMultipleCropsMock.call_args_list[0]
         self.assertEqual(len(args[1]), BATCH_SIZE)
 
+class Test_TestBatchRandomCrops(unittest.TestCase):
+
+    def test_crops_match_origins(self):
+        IMAGE_SHAPE = (4, 20, 30, 3)
+        TARGET_SHAPE = (8, 12)
+        NUMBER_CROPS = 5
+        images = np.random.randint(0, 255, IMAGE_SHAPE).astype(np.uint8)
+
+        np.random.seed(7)
+        crops = util.batch_random_crops(images, TARGET_SHAPE, NUMBER_CROPS)
+
+        np.random.seed(7)
+        row_origins, column_origins = util.batch_random_origins(
+            IMAGE_SHAPE[1:], TARGET_SHAPE, NUMBER_CROPS, IMAGE_SHAPE[0])
+
+        self.assertEqual(crops.shape, (IMAGE_SHAPE[0] * NUMBER_CROPS,) + TARGET_SHAPE + (3,))
+        for i in range(IMAGE_SHAPE[0]):
+            for k in range(NUMBER_CROPS):
+                r, c = row_origins[i, k], column_origins[i, k]
+                np.testing.assert_array_equal(
+                    crops[i * NUMBER_CROPS + k],
+                    images[i, r: r + TARGET_SHAPE[0], c: c + TARGET_SHAPE[1]])
+
+    def test_crop_exceeds_image(self):
+        images = np.zeros((2, 10, 10, 3))
+        self.assertRaises(ValueError, util.batch_random_crops, images, (11, 5), 3)
+
+    def test_crop_generator_reuses_buffers(self):
+        images = np.ones((3, 10, 10, 3))
+        labels = np.array([0, 1, 0])
+        generator = util.crop_generator(iter([(images, labels)] * 3), (4, 4), 2, buffer_count=2)
+
+        first, second, third = [next(generator) for _ in range(3)]
+
+        self.assertEqual(first[0].dtype, np.float32)
+        self.assertEqual(first[0].shape, (6, 4, 4, 3))
+        np.testing.assert_array_equal(first[1], [0, 0, 1, 1, 0, 0])
+        self.assertFalse(np.shares_memory(first[0], second[0]))
+        self.assertTrue(np.shares_memory(first[0], third[0]))
+
+    def test_crop_generator_keeps_integer_dtype(self):
+        images = np.random.randint(0, 255, (3, 10, 10, 3)).astype(np.uint8)
+        labels = np.array([0, 1, 0])
+        generator = util.crop_generator(iter([(images, labels)] * 2), (4, 4), 2, buffer_count=1)
+
+        crops, crop_labels = next(generator)
+
+        self.assertEqual(crops.dtype, np.uint8)
+        self.assertEqual(crop_labels.dtype, np.float32)
+
+class Test_TestTTACrops(unittest.TestCase):
+
+    def test_corner_origins(self):
+        origins = util.tta_crop_origins((20, 30, 3), (8, 12), "corners")
+        self.assertEqual(origins, [(6, 9), (0, 0), (0, 18), (12, 0), (12, 18)])
+
+    def test_fixed_crops_by_flip_then_origin(self):
+        images = np.random.randint(0, 255, (2, 6, 7, 3)).astype(np.uint8)
+        origins = [(1, 2), (0, 0)]
+        flips = [(False, False), (True, False), (False, True)]
+
+        crops = util.batch_fixed_crops(images, (4, 5), origins, flips)
+
+        self.assertEqual(crops.shape, (2 * 6, 4, 5, 3))
+        self.assertEqual(crops.dtype, np.uint8)
+        for i in range(2):
+            for f, (horizontal, vertical) in enumerate(flips):
+                for o, (r, c) in enumerate(origins):
+                    expected = images[i, r: r + 4, c: c + 5]
+                    expected = expected[:, ::-1] if horizontal else expected
+                    expected = expected[::-1] if vertical else expected
+                    np.testing.assert_array_equal(crops[i * 6 + f * 2 + o], expected)
+
+    def test_tta_crop_generator_covers_epoch_in_order(self):
+        images = np.arange(3 * 6 * 6).reshape((3, 6, 6, 1)).astype(np.float32)
+        iterator = [(images[:2], np.array([0, 1])), (images[2:], np.array([1]))]
+
+        batches = list(util.tta_crop_generator(iterator, (4, 4), "corners", [(False, False), (True, False)]))
+
+        self.assertEqual([len(labels) for _, labels in batches], [20, 10])
+        np.testing.assert_array_equal(batches[1][1], np.ones(10))
+        np.testing.assert_array_equal(batches[1][0][0], images[2, 1:5, 1:5])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,141 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from src.utilities.storage.storage import DecodedImageCache, LocalDirectoryStorage, ReadThroughCache, WeightsCache
+
+
+class Test_ReadThroughCache(unittest.TestCase):
+    def setUp(self):
+        self.bucket_dir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.bucket_dir, "bucket"))
+
+        for name in ["a", "b", "c"]:
+            self.write_object(name, name.encode() * 10)
+
+        self.storage = LocalDirectoryStorage(self.bucket_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.bucket_dir)
+        shutil.rmtree(self.cache_dir)
+
+    def write_object(self, name, data):
+        with open(os.path.join(self.bucket_dir, "bucket", name), "wb") as f:
+            f.write(data)
+
+    def test_second_read_hits_local_disk(self):
+        cache = ReadThroughCache(self.cache_dir, storage=self.storage)
+
+        self.assertEqual(cache.read("gs://bucket/a"), b"a" * 10)
+        self.assertEqual(cache.read("gs://bucket/a"), b"a" * 10)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_cache_survives_restart(self):
+        ReadThroughCache(self.cache_dir, storage=self.storage).read("gs://bucket/a")
+
+        cache = ReadThroughCache(self.cache_dir, storage=self.storage)
+        cache.read("gs://bucket/a")
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+    def test_rewritten_object_not_served_stale(self):
+        ReadThroughCache(self.cache_dir, storage=self.storage).read("gs://bucket/a")
+
+        # Guarantee a new modification time
+        time.sleep(0.01)
+        self.write_object("a", b"new")
+
+        cache = ReadThroughCache(self.cache_dir, storage=self.storage)
+        self.assertEqual(cache.read("gs://bucket/a"), b"new")
+        self.assertEqual(cache.misses, 1)
+
+    def test_least_recently_used_evicted(self):
+        cache = ReadThroughCache(self.cache_dir, maximum_bytes=25, storage=self.storage)
+
+        cache.read("gs://bucket/a")
+        cache.read("gs://bucket/b")
+        cache.read("gs://bucket/a")
+        cache.read("gs://bucket/c")
+
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+        cache.read("gs://bucket/a")
+        cache.read("gs://bucket/b")
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+
+
+class Test_DecodedImageCache(unittest.TestCase):
+    def test_cached_array_is_read_only(self):
+        cache = DecodedImageCache()
+        cache.put("a", np.zeros((2, 2), dtype=np.uint8))
+
+        with self.assertRaises(ValueError):
+            cache.get("a")[0, 0] = 1
+
+    def test_least_recently_used_evicted(self):
+        cache = DecodedImageCache(maximum_bytes=25)
+
+        cache.put("a", np.zeros(10, dtype=np.uint8))
+        cache.put("b", np.zeros(10, dtype=np.uint8))
+        cache.get("a")
+        cache.put("c", np.zeros(10, dtype=np.uint8))
+
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+
+class Test_WeightsCache(unittest.TestCase):
+    def setUp(self):
+        self.bucket_dir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.bucket_dir, "bucket"))
+
+        self.write_object(b"weights" * 10)
+        self.storage = LocalDirectoryStorage(self.bucket_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.bucket_dir)
+        shutil.rmtree(self.cache_dir)
+
+    def write_object(self, data):
+        with open(os.path.join(self.bucket_dir, "bucket", "weights.h5"), "wb") as f:
+            f.write(data)
+
+    def test_warm_cache_does_not_download(self):
+        WeightsCache(self.cache_dir, storage=self.storage, chunk_size=16).resolve("gs://bucket/weights.h5")
+
+        cache = WeightsCache(self.cache_dir, storage=self.storage, chunk_size=16)
+        local_path = cache.resolve("gs://bucket/weights.h5")
+
+        self.assertTrue(local_path.endswith("weights.h5"))
+        with open(local_path, "rb") as f:
+            self.assertEqual(f.read(), b"weights" * 10)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+    def test_corrupted_copy_downloaded_again(self):
+        cache = WeightsCache(self.cache_dir, storage=self.storage)
+        local_path = cache.resolve("gs://bucket/weights.h5")
+
+        with open(local_path, "r+b") as f:
+            f.write(b"W")
+
+        cache.resolve("gs://bucket/weights.h5")
+        with open(local_path, "rb") as f:
+            self.assertEqual(f.read(), b"weights" * 10)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+    def test_rewritten_object_downloaded_again(self):
+        cache = WeightsCache(self.cache_dir, storage=self.storage)
+        cache.resolve("gs://bucket/weights.h5")
+
+        # Change the size so the generation changes regardless of timestamp resolution
+        self.write_object(b"new weights")
+
+        with open(cache.resolve("gs://bucket/weights.h5"), "rb") as f:
+            self.assertEqual(f.read(), b"new weights")